@@ -0,0 +1,196 @@
+# Cost collectors end to end against the local fake Cost Management service:
+# the activity's get_rgs_cost (sync, one query per RG or per subscription)
+# and the HTTP function's collect_rgs_cost (aio clients, concurrent queries).
+#
+#   python benchmarks/bench_collectors.py --rgs 200 --latency 0.05
+#   python benchmarks/bench_collectors.py --variant http --qpu 12 --rate 1.2 --burst 12
+#   python benchmarks/bench_collectors.py --query-mode subscription --page-size 500 --json
+#
+# Reports wall time, API calls (throttled/failed), time spent sleeping in the
+# rate limiter and retries (summed over concurrent queries), peak traced
+# memory and per-RG latency percentiles (first request to last response of
+# each RG scope, as seen by the fake).
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000000"
+SCOPE = f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/"
+
+VARIANT_ACTIVITY = "activity"
+VARIANT_HTTP = "http"
+
+def load_function(folder):
+    spec = importlib.util.spec_from_file_location(folder.replace("-", "_"), os.path.join(ROOT, folder, "__init__.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def get_percentiles(values, percentiles=(50, 90, 99)):
+    values = sorted(values)
+    if len(values) == 0:
+        return {f"p{p}": None for p in percentiles}
+    return {f"p{p}": round(values[min(len(values) - 1, int(len(values) * p / 100))], 4) for p in percentiles}
+
+def get_window():
+    # Same window as the functions: the days to fetch, ending yesterday
+    from shared_code import rgs_cost
+
+    to_date = datetime.strptime(datetime.utcnow().strftime("%Y-%m-%d 0:0"), "%Y-%m-%d 0:0").replace(tzinfo = timezone.utc)
+    return to_date, to_date - timedelta(days=rgs_cost.get_num_days_to_fetch()), to_date - timedelta(minutes=1)
+
+def run_activity(activity, resource_groups, service, query_mode):
+    import fake_azure
+    from shared_code import cost_query
+
+    _, from_datetime, to_datetime = get_window()
+    cost_mgmt_client = fake_azure.FakeCostManagementClient(service)
+
+    rows_of_cost_by_rg = None
+    if query_mode == cost_query.QUERY_MODE_SUBSCRIPTION:
+        rows_of_cost_by_rg = cost_query.get_rows_of_cost_by_rg(cost_query.get_subscription_scope(SCOPE), from_datetime, to_datetime, cost_mgmt_client)
+
+    return activity.get_rgs_cost(resource_groups, SCOPE, from_datetime, to_datetime, cost_mgmt_client, rows_of_cost_by_rg)
+
+def run_http(http, resource_groups, service, query_mode, max_concurrency):
+    import fake_azure
+    from shared_code import clients
+
+    clients.set_factory(clients.AIO_CREDENTIAL, lambda: None)
+    clients.set_factory(clients.AIO_COST_MGMT_CLIENT, lambda credential, transport: fake_azure.AioFakeCostManagementClient(service))
+    clients.set_factory(clients.AIO_RESOURCE_MGMT_CLIENT, lambda credential, subscription_id, transport: fake_azure.AioFakeResourceManagementClient(resource_groups))
+    clients.set_factory(clients.AIO_RESOURCE_GRAPH_CLIENT, lambda credential, transport: None)
+
+    req_body = {"scope": SCOPE, "queryMode": query_mode, "maxConcurrency": max_concurrency}
+
+    async def collect():
+        try:
+            return await http.collect_rgs_cost(req_body)
+        finally:
+            await clients.close_aio_session()
+
+    try:
+        return asyncio.run(collect())
+    finally:
+        clients.reset()
+
+def run_variant(variant, args):
+    import fake_azure
+    from shared_code import rate_limiter as rl
+
+    resource_groups = fake_azure.make_resource_groups(args.rgs, args.managed)
+    to_date, _, _ = get_window()
+    costs = fake_azure.make_costs(resource_groups, to_date, args.days + 1, args.sparsity)
+    service = fake_azure.FakeCostManagementService(
+        costs,
+        latency_secs=args.latency,
+        qpu_per_window=args.qpu,
+        window_secs=args.window,
+        failure_rate=args.failure_rate,
+        page_size=args.page_size
+    )
+
+    # Loaded before measuring, the imports would dominate the memory peak
+    function = load_function("fn-drbl-cost-tracker-activity" if variant == VARIANT_ACTIVITY else "fn-http-cost-tracker")
+
+    rate_limiter = rl.get_shared_rate_limiter()
+    wait_secs_before = rate_limiter.total_wait_secs
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    if variant == VARIANT_ACTIVITY:
+        rgs_cost_dict = run_activity(function, resource_groups, service, args.query_mode)
+    else:
+        rgs_cost_dict = run_http(function, resource_groups, service, args.query_mode, args.max_concurrency)
+    wall_secs = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = [service.last_response_at[scope] - first_call_at for scope, first_call_at in service.first_call_at.items() if scope in service.last_response_at]
+
+    return {
+        "variant": variant,
+        "queryMode": args.query_mode,
+        "rgs": args.rgs,
+        "days": args.days,
+        "wallSecs": round(wall_secs, 3),
+        "apiCalls": service.calls,
+        "throttled": service.throttled,
+        "failed": service.failed,
+        "peakInFlight": service.peak_in_flight,
+        "sleepSecs": round(rate_limiter.total_wait_secs - wait_secs_before, 3),
+        "peakMemoryMB": round(peak_bytes / 1024 / 1024, 2),
+        "scopeLatencySecs": get_percentiles(latencies),
+        "failedResourceGroups": len(rgs_cost_dict.get("failedResourceGroups", [])),
+        # Summed over the RGs, the team totals depend on each function's team keys
+        "monthlyCost": round(sum(rg_cost["rgcost"] for rg_cost in rgs_cost_dict["monthly"]["resourceGroupCost"]), 2)
+    }
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Benchmark the cost collectors against a fake Cost Management service")
+    parser.add_argument("--variant", choices=[VARIANT_ACTIVITY, VARIANT_HTTP, "all"], default="all")
+    parser.add_argument("--query-mode", choices=["resourceGroup", "subscription"], default="resourceGroup")
+    parser.add_argument("--rgs", type=int, default=100, help="unmanaged RGs")
+    parser.add_argument("--managed", type=int, default=0, help="managed RGs, skipped by the collectors")
+    parser.add_argument("--days", type=int, default=30, help="longest window, longer than 30 adds COST_EXTRA_WINDOWS")
+    parser.add_argument("--sparsity", type=float, default=0.0, help="share of RG days without a cost row")
+    parser.add_argument("--latency", type=float, default=0.05, help="secs per query")
+    parser.add_argument("--qpu", type=int, default=0, help="queries per window before 429s, 0 for no throttling")
+    parser.add_argument("--window", type=float, default=10, help="throttling window in secs")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of queries failing with 503")
+    parser.add_argument("--page-size", type=int, default=0, help="rows per page, 0 for a single page")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="HTTP variant only")
+    parser.add_argument("--rate", type=float, default=50, help="client rate limiter, queries per sec (app default 0, unpaced)")
+    parser.add_argument("--burst", type=float, default=50, help="client rate limiter burst (app default 12)")
+    parser.add_argument("--json", action="store_true", help="one JSON line per variant")
+    return parser.parse_args()
+
+def print_result(result):
+    print(f"{result['variant']} ({result['queryMode']}), {result['rgs']} RGs x {result['days']} days")
+    print(f"  wall time:       {result['wallSecs']} secs")
+    print(f"  API calls:       {result['apiCalls']} ({result['throttled']} throttled, {result['failed']} failed), peak in flight {result['peakInFlight']}")
+    print(f"  sleep time:      {result['sleepSecs']} secs")
+    print(f"  peak memory:     {result['peakMemoryMB']} MB")
+    print(f"  scope latency:   {result['scopeLatencySecs']}")
+    print(f"  failed RGs:      {result['failedResourceGroups']}, monthly cost {result['monthlyCost']}")
+
+def main():
+    args = get_args()
+
+    if args.variant == "all":
+        # One process per variant, so neither inherits the other's rate
+        # limiter, client pool or RG inventory
+        for variant in [VARIANT_ACTIVITY, VARIANT_HTTP]:
+            subprocess.run([sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ["--variant", variant], check=True)
+        return
+
+    # Before the shared_code imports read them
+    os.environ["COST_QUERY_RATE_PER_SEC"] = str(args.rate)
+    os.environ["COST_QUERY_BURST"] = str(args.burst)
+    os.environ["COST_STORE_BACKEND"] = "none"
+    os.environ["CHECKPOINT_STORE_BACKEND"] = "none"
+    os.environ["ANOMALY_STORE_BACKEND"] = "none"
+    os.environ["RG_INVENTORY_BACKEND"] = "arm"
+    if args.days > 30:
+        os.environ["COST_EXTRA_WINDOWS"] = str(args.days)
+
+    result = run_variant(args.variant, args)
+
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print_result(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Period rollups: per-RG Python loops vs the vectorized RG x day matrix.
+#
+#   python benchmarks/bench_rollups.py [num_rgs] [num_days]
+
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from shared_code import cost_store
+from shared_code import rollups
+
+WINDOWS = [7, 14, 30, 90]
+NUM_TEAMS = 10
+FROM_DATE = date(2023, 1, 1)
+
+def make_rows_of_cost_list(num_rgs, num_days, seed=1):
+    rnd = random.Random(seed)
+    usage_dates = [cost_store.to_usage_date(FROM_DATE + timedelta(days=day)) for day in range(num_days)]
+    return [[[rnd.random() * 10, usage_date, f"rg-{i}", "USD"] for usage_date in usage_dates] for i in range(num_rgs)]
+
+def loop_rollups(rows_of_cost_list, team_indexes, windows):
+    # The previous approach: slice each RG's rows per window and sum in Python.
+    # Only equivalent on dense fixtures, with one row for every day.
+    team_totals = {num_days: [float(0)] * NUM_TEAMS for num_days in ["yesterday"] + windows}
+
+    for rows_of_cost, team_index in zip(rows_of_cost_list, team_indexes):
+        if len(rows_of_cost) > 0:
+            team_totals["yesterday"][team_index] += float(sum([rows_of_cost[-1][0]]))
+        for num_days in windows:
+            if len(rows_of_cost) >= num_days + 1:
+                past_numDays_cost = list()
+                for row in rows_of_cost[len(rows_of_cost)-num_days-1: len(rows_of_cost)-1]:
+                    past_numDays_cost.append(row[0])
+                team_totals[num_days][team_index] += float(sum(past_numDays_cost))
+
+    return team_totals
+
+def vectorized_rollups(rows_of_cost_list, team_indexes, windows, num_days):
+    cost_matrix = rollups.build_cost_matrix(rows_of_cost_list, FROM_DATE, num_days)
+    team_indexes = np.array(team_indexes, dtype=np.int64)
+
+    team_totals = {"yesterday": rollups.get_team_totals(rollups.get_yesterday_cost(cost_matrix), team_indexes, NUM_TEAMS)}
+
+    cumulative_cost = rollups.get_cumulative_cost(cost_matrix)
+    for window_num_days in windows:
+        window_cost = rollups.get_window_cost(cumulative_cost, window_num_days)
+        team_totals[window_num_days] = rollups.get_team_totals(window_cost, team_indexes, NUM_TEAMS)
+
+    return team_totals
+
+def main():
+    num_rgs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    num_days = (int(sys.argv[2]) if len(sys.argv) > 2 else 90) + 1
+    windows = [num_days_window for num_days_window in WINDOWS if num_days_window < num_days]
+
+    rows_of_cost_list = make_rows_of_cost_list(num_rgs, num_days)
+    team_indexes = [i % NUM_TEAMS for i in range(num_rgs)]
+
+    start = time.perf_counter()
+    loop_totals = loop_rollups(rows_of_cost_list, team_indexes, windows)
+    loop_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized_totals = vectorized_rollups(rows_of_cost_list, team_indexes, windows, num_days)
+    vectorized_secs = time.perf_counter() - start
+
+    cost_matrix = rollups.build_cost_matrix(rows_of_cost_list, FROM_DATE, num_days)
+    start = time.perf_counter()
+    cumulative_cost = rollups.get_cumulative_cost(cost_matrix)
+    for window_num_days in windows:
+        rollups.get_window_cost(cumulative_cost, window_num_days)
+    reduction_secs = time.perf_counter() - start
+
+    # The windows are differences of running sums, equal up to float rounding
+    matching = all(np.allclose(loop_totals[key], vectorized_totals[key], rtol=1e-9, atol=1e-9) for key in loop_totals)
+
+    print(f"RGs: {num_rgs}, days: {num_days}, windows: yesterday + {windows}")
+    print(f"Python loops:            {loop_secs * 1000:.1f} ms")
+    print(f"Vectorized (incl. load): {vectorized_secs * 1000:.1f} ms")
+    print(f"Vectorized reductions:   {reduction_secs * 1000:.1f} ms")
+    print(f"Team totals matching:    {matching}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# Local stand-ins for CostManagementClient and ResourceManagementClient (sync
+# and aio), serving generated daily costs with a configurable latency,
+# throttling and failure rate. Every call is counted so collectors can be
+# compared run against run.
+
+import asyncio
+import random
+import threading
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+from azure.core.exceptions import HttpResponseError
+
+RATELIMIT_HEADER_PREFIX = "x-ms-ratelimit-microsoft.costmanagement-"
+
+COLUMNS = [{"name": "PreTaxCost", "type": "Number"}, {"name": "UsageDate", "type": "Number"}, {"name": "ResourceGroup", "type": "String"}, {"name": "Currency", "type": "String"}]
+
+TEAMS = ["SQL Migration", "AI", "Infra", "Network", "App Migration", None]
+
+def to_usage_date(day):
+    return int(day.strftime("%Y%m%d"))
+
+def make_resource_groups(num_rgs, num_managed=0, teams=TEAMS):
+    resource_groups = [
+        SimpleNamespace(name=f"rg-{i}", tags={"Team": teams[i % len(teams)]} if teams[i % len(teams)] else None, managed_by=None)
+        for i in range(num_rgs)
+    ]
+    resource_groups += [SimpleNamespace(name=f"rg-managed-{i}", tags=None, managed_by="/subscriptions/x/providers/Microsoft.Databricks/workspaces/w") for i in range(num_managed)]
+    return resource_groups
+
+def make_costs(resource_groups, to_date, num_days, sparsity=0.0, seed=1):
+    # {rg name: {usage_date: cost}} for the num_days days before to_date, with a
+    # fraction of the days (sparsity) missing like for RGs without usage
+    rnd = random.Random(seed)
+    usage_dates = [to_usage_date(to_date - timedelta(days=day)) for day in range(num_days, 0, -1)]
+    return {
+        rg.name.lower(): {usage_date: round(rnd.random() * 50, 4) for usage_date in usage_dates if rnd.random() >= sparsity}
+        for rg in resource_groups if rg.managed_by is None
+    }
+
+class FakeResponse:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+        self.reason = "Too Many Requests" if status_code == 429 else "Service Unavailable"
+
+    def text(self):
+        return ""
+
+class FakePipelineResponse:
+    def __init__(self, headers):
+        self.http_response = FakeResponse(200, headers)
+
+class FakeCostManagementService:
+    # State shared by the sync and aio fakes.
+    #   latency_secs      time taken by each query
+    #   qpu_per_window    queries accepted per window_secs before 429s
+    #   failure_rate      share of queries failing with a transient 503
+    #   page_size         rows per page, the rest behind next_link
+
+    def __init__(self, costs, latency_secs=0.05, qpu_per_window=0, window_secs=10, failure_rate=0.0, page_size=0, seed=1):
+        self.costs = costs
+        self.latency_secs = latency_secs
+        self.qpu_per_window = qpu_per_window
+        self.window_secs = window_secs
+        self.failure_rate = failure_rate
+        self.page_size = page_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_calls = 0
+
+        self.calls = 0
+        self.throttled = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        # First request and last response of every scope, for per-RG latencies
+        self.first_call_at = {}
+        self.last_response_at = {}
+
+    def begin(self, scope):
+        # Counts the call and returns the error to raise, if any
+        with self._lock:
+            now = time.monotonic()
+            self.calls += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.first_call_at.setdefault(scope, now)
+
+            if now - self._window_start >= self.window_secs:
+                self._window_start, self._window_calls = now, 0
+            self._window_calls += 1
+
+            if self.qpu_per_window and self._window_calls > self.qpu_per_window:
+                self.throttled += 1
+                retry_after = round(self.window_secs - (now - self._window_start), 2)
+                return self._error(429, {"Retry-After": str(retry_after), RATELIMIT_HEADER_PREFIX + "qpu-retry-after": str(retry_after)})
+
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                self.failed += 1
+                return self._error(503, {})
+
+            return None
+
+    def end(self, scope):
+        with self._lock:
+            self.in_flight -= 1
+            self.last_response_at[scope] = time.monotonic()
+
+    def get_headers(self):
+        with self._lock:
+            remaining = max(0, self.qpu_per_window - self._window_calls) if self.qpu_per_window else 100
+            return {RATELIMIT_HEADER_PREFIX + "qpu-remaining": f"QueryResource:{remaining}"}
+
+    @staticmethod
+    def _error(status_code, headers):
+        e = HttpResponseError(message=f"Fake error {status_code}", response=FakeResponse(status_code, headers))
+        e.status_code = status_code
+        return e
+
+    def get_result(self, scope, parameters, params=None):
+        from_date = to_usage_date(parameters.time_period.from_property)
+        to_date = to_usage_date(parameters.time_period.to)
+
+        scope_parts = scope.rstrip("/").split("/")
+        if len(scope_parts) > 4 and scope_parts[3].lower() == "resourcegroups":
+            rg_names = [scope_parts[4].lower()]
+        else:
+            rg_names = list(self.costs.keys())
+            query_filter = getattr(parameters.dataset, "filter", None)
+            if query_filter:
+                rg_names = [name.lower() for name in query_filter["dimensions"]["values"]]
+
+        rows = [
+            [cost, usage_date, rg_name, "USD"]
+            for rg_name in rg_names
+            for usage_date, cost in self.costs.get(rg_name, {}).items()
+            if from_date <= usage_date <= to_date
+        ]
+
+        start = int((params or {}).get("$skiptoken", 0))
+        if not self.page_size:
+            return SimpleNamespace(columns=COLUMNS, rows=rows, next_link=None)
+
+        end = start + self.page_size
+        next_link = f"https://management.azure.com{scope}/providers/Microsoft.CostManagement/query?api-version=2022-10-01&$skiptoken={end}" if end < len(rows) else None
+        return SimpleNamespace(columns=COLUMNS, rows=rows[start:end], next_link=next_link)
+
+class FakeQueryOperations:
+
+    def __init__(self, service):
+        self.service = service
+
+    def usage(self, scope, parameters, raw_response_hook=None, params=None, **kwargs):
+        error = self.service.begin(scope)
+        try:
+            time.sleep(self.service.latency_secs)
+            if error is not None:
+                raise error
+            if raw_response_hook is not None:
+                raw_response_hook(FakePipelineResponse(self.service.get_headers()))
+            return self.service.get_result(scope, parameters, params)
+        finally:
+            self.service.end(scope)
+
+class AioFakeQueryOperations(FakeQueryOperations):
+
+    async def usage(self, scope, parameters, raw_response_hook=None, params=None, **kwargs):
+        error = self.service.begin(scope)
+        try:
+            await asyncio.sleep(self.service.latency_secs)
+            if error is not None:
+                raise error
+            if raw_response_hook is not None:
+                raw_response_hook(FakePipelineResponse(self.service.get_headers()))
+            return self.service.get_result(scope, parameters, params)
+        finally:
+            self.service.end(scope)
+
+class FakeCostManagementClient:
+
+    def __init__(self, service):
+        self.query = FakeQueryOperations(service)
+
+class AioFakeCostManagementClient:
+
+    def __init__(self, service):
+        self.query = AioFakeQueryOperations(service)
+
+class FakeResourceManagementClient:
+
+    def __init__(self, resource_groups):
+        self.resource_groups = SimpleNamespace(list=lambda: iter(resource_groups))
+
+class AioFakeResourceManagementClient:
+
+    def __init__(self, resource_groups):
+        async def list_resource_groups():
+            for rg in resource_groups:
+                yield rg
+        self.resource_groups = SimpleNamespace(list=list_resource_groups)
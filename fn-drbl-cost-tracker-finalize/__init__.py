@@ -0,0 +1,23 @@
+import logging
+
+from shared_code import budget_alerts
+from shared_code import cost_payload
+from shared_code import cost_query
+from shared_code import forecast
+
+def main(name: dict) -> dict:
+    logging.info('Executing durable finalize activity function')
+
+    # {"request": <orchestration input>, "rgsCost": <merged totals, encoded>, "payloadFormat": ...}.
+    # The steps after the merge that must not run in the orchestrator, where
+    # every replay would repeat them.
+    payload_format = name.get("payloadFormat")
+    rgs_cost_dict = cost_payload.decode(name["rgsCost"])
+
+    forecast.add_forecast(rgs_cost_dict)
+
+    # Team budgets on the merged totals, and one notification for the run
+    alert_scope = budget_alerts.get_alert_scope(name.get("request"), cost_query.get_default_scope())
+    budget_alerts.alert(rgs_cost_dict, alert_scope)
+
+    return cost_payload.encode(rgs_cost_dict, payload_format)
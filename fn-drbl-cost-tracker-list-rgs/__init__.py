@@ -0,0 +1,43 @@
+import logging
+
+from shared_code import clients
+from shared_code import cost_query
+from shared_code import rg_inventory
+from shared_code import subscriptions
+
+def main(name: str) -> list:
+    logging.info('Executing durable list resource groups activity function')
+
+    resource_graph_client = clients.get_resource_graph_client()
+
+    # The orchestration input may ask for several subscriptions, a management
+    # group or the RGs of its own scope
+    subscription_ids, management_group_id = subscriptions.get_requested_subscriptions(name)
+    if subscription_ids is None and management_group_id is None:
+        scope = subscriptions.get_request_scope(name) or cost_query.get_default_scope()
+        if not cost_query.is_resource_groups_scope(scope):
+            raise ValueError(f"scope must be /subscriptions/{{id}}/resourceGroups/ or a management group, got {scope}")
+        subscription_ids = [scope.split("/")[2]]
+
+    subscription_ids = subscriptions.resolve_subscription_ids(subscription_ids, management_group_id, resource_graph_client)
+
+    resource_groups_by_subscription = rg_inventory.get_resource_groups_by_subscription(
+        subscription_ids,
+        clients.get_resource_mgmt_client,
+        resource_graph_client
+    )
+
+    # Managed RGs are skipped by the cost activity anyway, so they are not sent
+    resource_groups_list = []
+    for subscription_id, resource_groups in resource_groups_by_subscription.items():
+        for rg in resource_groups:
+            resource_groups_list.append({
+                "subscriptionId": subscription_id,
+                "name": rg.name,
+                "tags": rg.tags,
+                "managedBy": rg.managed_by
+            })
+
+    logging.info(f"[INFO]: Found {len(resource_groups_list)} unmanaged resource groups in {len(subscription_ids)} subscriptions")
+
+    return resource_groups_list
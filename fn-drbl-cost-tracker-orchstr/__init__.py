@@ -1,16 +1,79 @@
 import logging
 import json
+import os
 
 import azure.functions as func
 import azure.durable_functions as df
 
+from shared_code import cost_merge
+from shared_code import cost_payload
+from shared_code import subscriptions
+
 
 def orchestrator_function(context: df.DurableOrchestrationContext):
     try:
-        rgs_cost = yield context.call_activity('fn-drbl-cost-tracker-activity', None)
-        return rgs_cost
+        orchestration_input = context.get_input() or {}
+
+        batch_size = int(orchestration_input.get("batchSize", os.environ.get("COST_TRACKER_BATCH_SIZE", "50")))
+        max_parallelism = int(orchestration_input.get("maxParallelism", os.environ.get("COST_TRACKER_MAX_PARALLELISM", "4")))
+        payload_format = cost_payload.get_payload_format(orchestration_input.get("payloadFormat"))
+
+        # A failed batch is retried, and resumes from its checkpoint
+        retry_options = df.RetryOptions(
+            first_retry_interval_in_milliseconds=int(os.environ.get("COST_TRACKER_ACTIVITY_RETRY_INTERVAL_MS", "30000")),
+            max_number_of_attempts=int(os.environ.get("COST_TRACKER_ACTIVITY_MAX_ATTEMPTS", "3"))
+        )
+
+        # {"subscriptions": [...]} or {"managementGroup": "<id>"} in the input
+        # runs every subscription, the list-rgs activity resolves them
+        resource_groups = yield context.call_activity('fn-drbl-cost-tracker-list-rgs', orchestration_input)
+
+        # Batches never span subscriptions, each activity queries one scope
+        resource_groups_by_subscription = {}
+        for rg in resource_groups:
+            resource_groups_by_subscription.setdefault(rg.get("subscriptionId"), []).append(rg)
+
+        batches = [
+            {"subscriptionId": subscription_id, "resourceGroups": subscription_resource_groups[i:i + batch_size], "payloadFormat": payload_format}
+            for subscription_id, subscription_resource_groups in resource_groups_by_subscription.items()
+            for i in range(0, len(subscription_resource_groups), batch_size)
+        ] or [{"resourceGroups": [], "payloadFormat": payload_format}]
+
+        # Fan out at most max_parallelism batches at a time, a new batch
+        # starting as soon as one finishes; fan in by merging the team totals
+        batches_rgs_cost = [None] * len(batches)
+        running_tasks = {}
+        next_batch = 0
+        while next_batch < len(batches) or len(running_tasks) > 0:
+            while next_batch < len(batches) and len(running_tasks) < max_parallelism:
+                running_tasks[next_batch] = context.call_activity_with_retry('fn-drbl-cost-tracker-activity', retry_options, batches[next_batch])
+                next_batch += 1
+
+            finished_task = yield context.task_any(list(running_tasks.values()))
+            # A batch that failed all its attempts fails the run, like task_all did
+            if isinstance(finished_task.result, Exception):
+                raise finished_task.result
+
+            for i, task in list(running_tasks.items()):
+                if task is finished_task:
+                    batches_rgs_cost[i] = cost_payload.decode(task.result)
+                    del running_tasks[i]
+
+        if subscriptions.is_multi_subscription(orchestration_input):
+            rgs_cost_dict = cost_merge.merge_subscriptions_rgs_cost([(batch.get("subscriptionId"), batch_rgs_cost) for batch, batch_rgs_cost in zip(batches, batches_rgs_cost)])
+        else:
+            rgs_cost_dict = cost_merge.merge_rgs_cost(batches_rgs_cost)
+
+        # The forecast and the team budgets (read from the app settings or a
+        # file) are done in an activity, once, instead of on every replay.
+        # Orchestrators must not have side effects, the notification goes out
+        # from there too.
+        finalized = yield context.call_activity('fn-drbl-cost-tracker-finalize', {"request": orchestration_input, "rgsCost": cost_payload.encode(rgs_cost_dict, payload_format), "payloadFormat": payload_format})
+        rgs_cost_dict = cost_payload.decode(finalized)
+
+        return cost_payload.dumps(rgs_cost_dict, payload_format)
     except Exception as e:
         logging.exception(e)
         return "[ERROR]: Something went wrong in the orchestrator function"
 
-main = df.Orchestrator.create(orchestrator_function)
\ No newline at end of file
+main = df.Orchestrator.create(orchestrator_function)
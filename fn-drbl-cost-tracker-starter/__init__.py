@@ -3,10 +3,24 @@ import logging
 import azure.functions as func
 import azure.durable_functions as df
 
+from shared_code import subscriptions
+
 
 async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
+    # An optional JSON body (e.g. {"batchSize": 50, "maxParallelism": 4}) becomes the orchestration input
+    try:
+        orchestration_input = req.get_json()
+    except ValueError:
+        orchestration_input = None
+
+    # A scope the list-rgs activity would fail on is rejected before the run starts
+    scope = subscriptions.get_request_scope(orchestration_input)
+    if scope is not None and not subscriptions.is_valid_scope(scope):
+        return func.HttpResponse(f"scope must be /subscriptions/{{id}}/resourceGroups/ or a management group, got {scope}", status_code=400)
+
     client = df.DurableOrchestrationClient(starter)
-    instance_id = await client.start_new(req.route_params["functionName"], None, None)
+
+    instance_id = await client.start_new(req.route_params["functionName"], None, orchestration_input)
 
     logging.info(f"Started orchestration with ID = '{instance_id}'.")
 
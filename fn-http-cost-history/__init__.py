@@ -0,0 +1,53 @@
+import logging
+import json
+
+import azure.functions as func
+
+from shared_code import cost_warehouse
+
+def get_list_param(req, name):
+    # Comma separated values, None when absent
+    value = req.params.get(name)
+    if not value:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    # Cost history from the cost warehouse, no Cost Management call, e.g.
+    #   ?from=2026-07-01&to=2026-09-30&groupBy=team,month&team=AI
+    logging.info('Python HTTP trigger cost history function processed a request.')
+
+    warehouse = cost_warehouse.get_cost_warehouse()
+    if warehouse is None:
+        return func.HttpResponse("No cost warehouse configured, see COST_WAREHOUSE_BACKEND", status_code=503)
+
+    from_date = req.params.get('from')
+    to_date = req.params.get('to')
+    if not from_date or not to_date:
+        return func.HttpResponse("The from and to dates (yyyy-mm-dd) are required", status_code=400)
+
+    group_by = get_list_param(req, 'groupBy') or [cost_warehouse.GROUP_BY_TEAM]
+
+    try:
+        rows = warehouse.query_cost(
+            from_date, to_date, group_by,
+            teams=get_list_param(req, 'team'),
+            resource_groups=get_list_param(req, 'rg'),
+            subscription_ids=get_list_param(req, 'subscription'))
+    except ValueError as e:
+        return func.HttpResponse(str(e), status_code=400)
+    except Exception as e:
+        logging.exception(e)
+        return func.HttpResponse("[ERROR]: Something went wrong while querying the cost history", status_code=500)
+
+    history = {
+        "fromDate": from_date,
+        "toDate": to_date,
+        "groupBy": group_by,
+        "totalCost": {},
+        "rows": rows
+    }
+    for row in rows:
+        history["totalCost"][row["currency"]] = round(history["totalCost"].get(row["currency"], 0) + row["cost"], 2)
+
+    return func.HttpResponse(json.dumps(history), status_code=200, mimetype="application/json")
@@ -1,545 +1,265 @@
+import asyncio
 import logging
 
 import azure.functions as func
 from datetime import datetime, timezone, timedelta
-from azure.identity import DefaultAzureCredential
-from azure.mgmt.costmanagement import CostManagementClient
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.costmanagement.models import (QueryDefinition, ExportType, TimeframeType, QueryTimePeriod, GranularityType, QueryDataset, QueryAggregation, QueryGrouping)
 import json
+import math
 import time
-
-def get_cost(scope_with_rg , from_datetime, to_datetime, cost_mgmt_client):
-
-    query_dataset = QueryDataset(
-        granularity=GranularityType("Daily"),                
-        # configuration=QueryDatasetConfiguration(), 
-        aggregation={"totalCost" : QueryAggregation(name="PreTaxCost", function ="Sum")}, 
-        grouping=[QueryGrouping(type="Dimension", name="ResourceGroup")], 
-        # filter = QueryFilter()
-    )
-    
-    query_def = QueryDefinition(
-        type=ExportType("Usage"),
-        timeframe=TimeframeType("Custom"),            
-        time_period=QueryTimePeriod(from_property=from_datetime, to=to_datetime),
-        dataset=query_dataset
+import os
+
+from shared_code import aio_cost_query
+from shared_code import budget_alerts
+from shared_code import cost_merge
+from shared_code import cost_payload
+from shared_code import cost_query
+from shared_code import forecast
+from shared_code import job_store
+from shared_code import rate_limiter as rl
+from shared_code import retry_policy as rp
+from shared_code import rgs_cost
+from shared_code import subscriptions
+from shared_code import team_aggregator
+from shared_code import telemetry
+
+DEFAULT_TEAM_COST_KEYS = {
+    "SQL Migration Factory": "smfTotalCost",
+    "Lakehouse Factory": "lmfTotalCost",
+    "AI Factory": "aifTotalCost"
+}
+
+def get_rgs_cost(resource_groups, scope, from_datetime, to_datetime, rows_of_cost_by_rg, round_totals=True, breakdown_by_rg=None):
+
+    # The rows of every RG are prefetched by aio_cost_query, nothing is
+    # queried from here
+    return rgs_cost.get_rgs_cost(
+        resource_groups, scope, from_datetime, to_datetime,
+        None,
+        team_aggregator.get_team_cost_keys(DEFAULT_TEAM_COST_KEYS),
+        rows_of_cost_by_rg,
+        round_totals,
+        catch_errors=False,
+        breakdown_by_rg=breakdown_by_rg
     )
 
-    query_result = cost_mgmt_client.query.usage(scope=scope_with_rg, parameters=query_def)
-    query_result_dict = query_result.as_dict()
-    rows_of_cost = query_result_dict["rows"]
-
-    return rows_of_cost
-
-def get_yesterday_cost(resource_groups, scope, from_datetime, to_datetime, cost_mgmt_client):
-
-    logging.info("-----------------Yesterdays' Cost-----------------")
-
-    yesterday_cost_dict = {}
-
-    yesterday_cost_dict["resourceGroupCost"] = list()
-    yesterday_cost_dict["smfTotalCost"] = float(0)
-    yesterday_cost_dict["lmfTotalCost"] = float(0)
-    yesterday_cost_dict["aifTotalCost"] = float(0)
-    yesterday_cost_dict["totalCost"] = float(0)
-
-    for x,rg in enumerate(resource_groups, start=1):
-        logging.info(f"--------------------------------------{str(x)}--------------------------------------")
-                    
-        if rg.managed_by is None:
-            scope_with_rg = '' + scope + str(rg.name)
-
-            rows_of_cost = get_cost(scope_with_rg, from_datetime, to_datetime, cost_mgmt_client)
-            
-            if(len(rows_of_cost) == 1): 
-                past_numDays_cost = list()
-                for row in rows_of_cost: 
-                    past_numDays_cost.append(row[0])
-                total_cost = float(sum(past_numDays_cost)) 
-
-                logging.info("Total Cost: $ {0}".format(round(total_cost,2)))
-
-                if rg.tags is not None and "Team" in rg.tags.keys():
-                    yesterday_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": rg.tags.get("Team"),
-                        "rgcost": round(total_cost,2)
-                    })
-                else:
-                    yesterday_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": "NA",
-                        "rgcost": round(total_cost,2)
-                    })
-
-                if rg.tags is not None and "Team" in rg.tags.keys():
-                    if rg.tags['Team'].lower() == "SQL Migration Factory".lower():
-                        yesterday_cost_dict["smfTotalCost"] = yesterday_cost_dict["smfTotalCost"] + total_cost
-                    elif rg.tags['Team'].lower() == "Lakehouse Factory".lower():
-                        yesterday_cost_dict["lmfTotalCost"] = yesterday_cost_dict["lmfTotalCost"] + total_cost
-                    elif rg.tags['Team'].lower() == "AI Factory".lower():
-                        yesterday_cost_dict["aifTotalCost"] = yesterday_cost_dict["aifTotalCost"] + total_cost
-            else:
-                logging.info(f"Cost data not available from {from_datetime.date()} to {to_datetime.date()} for RG - {rg.name}")
-        
-        logging.info(f"--------------------------------------{str(x)}--------------------------------------")
-
-        if x in range(1,100,5):
-            logging.info("++++++++++ Request throttled, waiting for 10 secs ++++++++++")
-            time.sleep(10)
-            logging.info("++++++++++ Continuing ++++++++++")
-
-    yesterday_cost_dict["smfTotalCost"] = round(yesterday_cost_dict["smfTotalCost"],2)            
-    yesterday_cost_dict["lmfTotalCost"] = round(yesterday_cost_dict["lmfTotalCost"],2)      
-    yesterday_cost_dict["aifTotalCost"] = round(yesterday_cost_dict["aifTotalCost"],2)      
-    yesterday_cost_dict["totalCost"] = round(yesterday_cost_dict["smfTotalCost"] + yesterday_cost_dict["lmfTotalCost"] + yesterday_cost_dict["aifTotalCost"],2)
-    yesterday_cost_dict["fromDate"] = str(from_datetime.date())
-    yesterday_cost_dict["toDate"] = str(to_datetime.date())
-
-    return yesterday_cost_dict
-
-def get_daily_and_weekly_cost(resource_groups, scope, from_datetime, to_datetime, cost_mgmt_client):
-
-    logging.info("-----------------Daily & Weekly Cost-----------------")
-
-    daily_cost_dict = {}
-    daily_cost_dict["resourceGroupCost"] = list()
-    daily_cost_dict["smfTotalCost"] = float(0)
-    daily_cost_dict["lmfTotalCost"] = float(0)
-    daily_cost_dict["aifTotalCost"] = float(0)
-    daily_cost_dict["totalCost"] = float(0)
-
-    weekly_cost_dict = {}
-    weekly_cost_dict["resourceGroupCost"] = list()
-    weekly_cost_dict["smfTotalCost"] = float(0)
-    weekly_cost_dict["lmfTotalCost"] = float(0)
-    weekly_cost_dict["aifTotalCost"] = float(0)
-    weekly_cost_dict["totalCost"] = float(0)
-
-    for x,rg in enumerate(resource_groups, start=1):
-        logging.info(f"--------------------------------------{str(x)}--------------------------------------")
-                    
-        if rg.managed_by is None:
-            scope_with_rg = '' + scope + str(rg.name)
-
-            rows_of_cost = get_cost(scope_with_rg, from_datetime, to_datetime, cost_mgmt_client)
-            
-            if(len(rows_of_cost) == 7): 
-                past_numDays_cost = list()
-                for row in rows_of_cost: 
-                    past_numDays_cost.append(row[0])
-                avg_cost = float(sum(past_numDays_cost)/7) 
-                total_cost = float(sum(past_numDays_cost))
-
-                logging.info("Avg Cost: $ {0}".format(round(avg_cost,2)))
-                logging.info("Total Cost: $ {0}".format(round(total_cost,2)))
-
-                if rg.tags is not None and "Team" in rg.tags.keys():
-                    daily_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": rg.tags.get("Team"),
-                        "rgcost": round(avg_cost,2)
-                    })
-                    weekly_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": rg.tags.get("Team"),
-                        "rgcost": round(total_cost,2)
-                    })
-                else:
-                    daily_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": "NA",
-                        "rgcost": round(avg_cost,2)
-                    })
-                    weekly_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": "NA",
-                        "rgcost": round(total_cost,2)
-                    })
-
-                if rg.tags is not None and "Team" in rg.tags.keys():
-                    if rg.tags['Team'].lower() == "SQL Migration Factory".lower():
-                        daily_cost_dict["smfTotalCost"] = daily_cost_dict["smfTotalCost"] + avg_cost
-                        weekly_cost_dict["smfTotalCost"] = weekly_cost_dict["smfTotalCost"] + total_cost
-                    elif rg.tags['Team'].lower() == "Lakehouse Factory".lower():
-                        daily_cost_dict["lmfTotalCost"] = daily_cost_dict["lmfTotalCost"] + avg_cost
-                        weekly_cost_dict["lmfTotalCost"] = weekly_cost_dict["lmfTotalCost"] + total_cost
-                    elif rg.tags['Team'].lower() == "AI Factory".lower():
-                        daily_cost_dict["aifTotalCost"] = daily_cost_dict["aifTotalCost"] + avg_cost
-                        weekly_cost_dict["aifTotalCost"] = weekly_cost_dict["aifTotalCost"] + total_cost
-            else:
-                logging.info(f"Cost data not available from {from_datetime.date()} to {to_datetime.date()} for RG - {rg.name}")
-        
-        logging.info(f"--------------------------------------{str(x)}--------------------------------------")
-
-        if x in range(1,100,5):
-            logging.info("++++++++++ Request throttled, waiting for 10 secs ++++++++++")
-            time.sleep(10)
-            logging.info("++++++++++ Continuing ++++++++++")
-
-    daily_cost_dict["smfTotalCost"] = round(daily_cost_dict["smfTotalCost"],2)            
-    daily_cost_dict["lmfTotalCost"] = round(daily_cost_dict["lmfTotalCost"],2)      
-    daily_cost_dict["aifTotalCost"] = round(daily_cost_dict["aifTotalCost"],2)      
-    daily_cost_dict["totalCost"] = round(daily_cost_dict["smfTotalCost"] + daily_cost_dict["lmfTotalCost"] + daily_cost_dict["aifTotalCost"],2)
-    daily_cost_dict["fromDate"] = str(from_datetime.date())
-    daily_cost_dict["toDate"] = str(to_datetime.date())
-
-    weekly_cost_dict["smfTotalCost"] = round(weekly_cost_dict["smfTotalCost"],2)            
-    weekly_cost_dict["lmfTotalCost"] = round(weekly_cost_dict["lmfTotalCost"],2)      
-    weekly_cost_dict["aifTotalCost"] = round(weekly_cost_dict["aifTotalCost"],2)      
-    weekly_cost_dict["totalCost"] = round(weekly_cost_dict["smfTotalCost"] + weekly_cost_dict["lmfTotalCost"] + weekly_cost_dict["aifTotalCost"],2)
-    weekly_cost_dict["fromDate"] = str(from_datetime.date())
-    weekly_cost_dict["toDate"] = str(to_datetime.date())
-
-    return daily_cost_dict, weekly_cost_dict
-
-def get_monthly_cost(resource_groups, scope, from_datetime, to_datetime, cost_mgmt_client):
-
-    logging.info("-----------------Monthly Cost-----------------")
-
-    monthly_cost_dict = {}
-
-    monthly_cost_dict["resourceGroupCost"] = list()
-    monthly_cost_dict["smfTotalCost"] = float(0)
-    monthly_cost_dict["lmfTotalCost"] = float(0)
-    monthly_cost_dict["aifTotalCost"] = float(0)
-    monthly_cost_dict["totalCost"] = float(0)
-
-    for x,rg in enumerate(resource_groups, start=1):
-        logging.info(f"--------------------------------------{str(x)}--------------------------------------")
-                    
-        if rg.managed_by is None:
-            scope_with_rg = '' + scope + str(rg.name)
-
-            rows_of_cost = get_cost(scope_with_rg, from_datetime, to_datetime, cost_mgmt_client)
-            
-            if(len(rows_of_cost) >= 30 and len(rows_of_cost) <=31): 
-                past_numDays_cost = list()
-                for row in rows_of_cost: 
-                    past_numDays_cost.append(row[0])
-                total_cost = float(sum(past_numDays_cost)) 
-
-                logging.info("Total Cost: $ {0}".format(round(total_cost,2)))
-
-                if rg.tags is not None and "Team" in rg.tags.keys():
-                    monthly_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": rg.tags.get("Team"),
-                        "rgcost": round(total_cost,2)
-                    })
-                else:
-                    monthly_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": "NA",
-                        "rgcost": round(total_cost,2)
-                    })
-
-                if rg.tags is not None and "Team" in rg.tags.keys():
-                    if rg.tags['Team'].lower() == "SQL Migration Factory".lower():
-                        monthly_cost_dict["smfTotalCost"] = monthly_cost_dict["smfTotalCost"] + total_cost
-                    elif rg.tags['Team'].lower() == "Lakehouse Factory".lower():
-                        monthly_cost_dict["lmfTotalCost"] = monthly_cost_dict["lmfTotalCost"] + total_cost
-                    elif rg.tags['Team'].lower() == "AI Factory".lower():
-                        monthly_cost_dict["aifTotalCost"] = monthly_cost_dict["aifTotalCost"] + total_cost
-            else:
-                logging.info(f"Cost data not available from {from_datetime.date()} to {to_datetime.date()} for RG - {rg.name}")
-        
-        logging.info(f"--------------------------------------{str(x)}--------------------------------------")
-
-        if x in range(1,100,5):
-            logging.info("++++++++++ Request throttled, waiting for 10 secs ++++++++++")
-            time.sleep(10)
-            logging.info("++++++++++ Continuing ++++++++++")
-
-    monthly_cost_dict["smfTotalCost"] = round(monthly_cost_dict["smfTotalCost"],2)            
-    monthly_cost_dict["lmfTotalCost"] = round(monthly_cost_dict["lmfTotalCost"],2)      
-    monthly_cost_dict["aifTotalCost"] = round(monthly_cost_dict["aifTotalCost"],2)      
-    monthly_cost_dict["totalCost"] = round(monthly_cost_dict["smfTotalCost"] + monthly_cost_dict["lmfTotalCost"] + monthly_cost_dict["aifTotalCost"],2)
-    monthly_cost_dict["fromDate"] = str(from_datetime.date())
-    monthly_cost_dict["toDate"] = str(to_datetime.date())
-
-    return monthly_cost_dict
-
-def get_rgs_cost(resource_groups, scope, from_datetime, to_datetime, cost_mgmt_client):
-
-    logging.info("-----------------Yesterday, Daily, Weekly & Monthly Cost-----------------")
-
-    yesterday_cost_dict = {}
-    yesterday_cost_dict["resourceGroupCost"] = list()
-    yesterday_cost_dict["smfTotalCost"] = float(0)
-    yesterday_cost_dict["lmfTotalCost"] = float(0)
-    yesterday_cost_dict["aifTotalCost"] = float(0)
-    yesterday_cost_dict["totalCost"] = float(0)
-
-    daily_cost_dict = {}
-    daily_cost_dict["resourceGroupCost"] = list()
-    daily_cost_dict["smfTotalCost"] = float(0)
-    daily_cost_dict["lmfTotalCost"] = float(0)
-    daily_cost_dict["aifTotalCost"] = float(0)
-    daily_cost_dict["totalCost"] = float(0)
-
-    weekly_cost_dict = {}
-    weekly_cost_dict["resourceGroupCost"] = list()
-    weekly_cost_dict["smfTotalCost"] = float(0)
-    weekly_cost_dict["lmfTotalCost"] = float(0)
-    weekly_cost_dict["aifTotalCost"] = float(0)
-    weekly_cost_dict["totalCost"] = float(0)
-
-    monthly_cost_dict = {}
-    monthly_cost_dict["resourceGroupCost"] = list()
-    monthly_cost_dict["smfTotalCost"] = float(0)
-    monthly_cost_dict["lmfTotalCost"] = float(0)
-    monthly_cost_dict["aifTotalCost"] = float(0)
-    monthly_cost_dict["totalCost"] = float(0)
-
-    for x,rg in enumerate(resource_groups, start=1):
-        logging.info(f"--------------------------------------{str(x)}--------------------------------------")
-                    
-        if rg.managed_by is None:
-            scope_with_rg = '' + scope + str(rg.name)
-
-            rows_of_cost = get_cost(scope_with_rg, from_datetime, to_datetime, cost_mgmt_client)
-
-            logging.info(len(rows_of_cost))
-
-            yesterday_row_of_cost = list()
-            daily_weekly_rows_of_cost = list()
-            monthly_rows_of_cost = list()
-
-            if (len(rows_of_cost) <= 31 and len(rows_of_cost) > 0):
-                logging.info("Yesterday cost present")
-                yesterday_row_of_cost = [rows_of_cost[-1]]
-            if (len(rows_of_cost) >= 8):
-                logging.info("Daily & Weekly cost present")
-                daily_weekly_rows_of_cost = rows_of_cost[len(rows_of_cost)-8: len(rows_of_cost)-1]
-            if (len(rows_of_cost) == 31):
-                logging.info("Monthly cost present")
-                monthly_rows_of_cost = rows_of_cost[0: len(rows_of_cost)-1]
-
-            if(len(yesterday_row_of_cost) == 1): 
-                past_numDays_cost = list()
-                for row in yesterday_row_of_cost: 
-                    past_numDays_cost.append(row[0])
-                total_cost = float(sum(past_numDays_cost))
-
-                logging.info("Yesterdays' Total Cost: $ {0}".format(round(total_cost,2)))
-
-                if rg.tags is not None and "Team" in rg.tags.keys():
-                    yesterday_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": rg.tags.get("Team"),
-                        "rgcost": round(total_cost,2)
-                    })
-                else:
-                    yesterday_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": "NA",
-                        "rgcost": round(total_cost,2)
-                    })
-
-                if rg.tags is not None and "Team" in rg.tags.keys():
-                    if rg.tags['Team'].lower() == "SQL Migration Factory".lower():
-                        yesterday_cost_dict["smfTotalCost"] = yesterday_cost_dict["smfTotalCost"] + total_cost
-                    elif rg.tags['Team'].lower() == "Lakehouse Factory".lower():
-                        yesterday_cost_dict["lmfTotalCost"] = yesterday_cost_dict["lmfTotalCost"] + total_cost
-                    elif rg.tags['Team'].lower() == "AI Factory".lower():
-                        yesterday_cost_dict["aifTotalCost"] = yesterday_cost_dict["aifTotalCost"] + total_cost
-            else:
-                logging.info(f"Yesterdays' cost data not available from {from_datetime.date()} to {to_datetime.date()} for RG - {rg.name}")
-            
-            if(len(daily_weekly_rows_of_cost) == 7): 
-                past_numDays_cost = list()
-                for row in daily_weekly_rows_of_cost: 
-                    past_numDays_cost.append(row[0])
-                avg_cost = float(sum(past_numDays_cost)/7) 
-                total_cost = float(sum(past_numDays_cost))
-
-                logging.info("Daily Avg Cost: $ {0}".format(round(avg_cost,2)))
-                logging.info("Weekly Total Cost: $ {0}".format(round(total_cost,2)))
-
-                if rg.tags is not None and "Team" in rg.tags.keys():
-                    daily_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": rg.tags.get("Team"),
-                        "rgcost": round(avg_cost,2)
-                    })
-                    weekly_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": rg.tags.get("Team"),
-                        "rgcost": round(total_cost,2)
-                    })
-                else:
-                    daily_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": "NA",
-                        "rgcost": round(avg_cost,2)
-                    })
-                    weekly_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": "NA",
-                        "rgcost": round(total_cost,2)
-                    })
-
-                if rg.tags is not None and "Team" in rg.tags.keys():
-                    if rg.tags['Team'].lower() == "SQL Migration Factory".lower():
-                        daily_cost_dict["smfTotalCost"] = daily_cost_dict["smfTotalCost"] + avg_cost
-                        weekly_cost_dict["smfTotalCost"] = weekly_cost_dict["smfTotalCost"] + total_cost
-                    elif rg.tags['Team'].lower() == "Lakehouse Factory".lower():
-                        daily_cost_dict["lmfTotalCost"] = daily_cost_dict["lmfTotalCost"] + avg_cost
-                        weekly_cost_dict["lmfTotalCost"] = weekly_cost_dict["lmfTotalCost"] + total_cost
-                    elif rg.tags['Team'].lower() == "AI Factory".lower():
-                        daily_cost_dict["aifTotalCost"] = daily_cost_dict["aifTotalCost"] + avg_cost
-                        weekly_cost_dict["aifTotalCost"] = weekly_cost_dict["aifTotalCost"] + total_cost
-            else:
-                logging.info(f"Daily and Weekly cost data not available from {from_datetime.date()} to {to_datetime.date()} for RG - {rg.name}")
-
-            if(len(monthly_rows_of_cost) == 30): 
-                past_numDays_cost = list()
-                for row in monthly_rows_of_cost: 
-                    past_numDays_cost.append(row[0])
-                total_cost = float(sum(past_numDays_cost))
-
-                logging.info("Monthly Total Cost: $ {0}".format(round(total_cost,2)))
-
-                if rg.tags is not None and "Team" in rg.tags.keys():
-                    monthly_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": rg.tags.get("Team"),
-                        "rgcost": round(total_cost,2)
-                    })
-                else:
-                    monthly_cost_dict["resourceGroupCost"].append({
-                        "rgname": rg.name,
-                        "rgteam": "NA",
-                        "rgcost": round(total_cost,2)
-                    })
-
-                if rg.tags is not None and "Team" in rg.tags.keys():
-                    if rg.tags['Team'].lower() == "SQL Migration Factory".lower():
-                        monthly_cost_dict["smfTotalCost"] = monthly_cost_dict["smfTotalCost"] + total_cost
-                    elif rg.tags['Team'].lower() == "Lakehouse Factory".lower():
-                        monthly_cost_dict["lmfTotalCost"] = monthly_cost_dict["lmfTotalCost"] + total_cost
-                    elif rg.tags['Team'].lower() == "AI Factory".lower():
-                        monthly_cost_dict["aifTotalCost"] = monthly_cost_dict["aifTotalCost"] + total_cost
-            else:
-                logging.info(f"Monthly cost data not available from {from_datetime.date()} to {to_datetime.date()} for RG - {rg.name}")
-
-        logging.info(f"--------------------------------------{str(x)}--------------------------------------")
-
-        if x in range(1,100,5):
-            logging.info("++++++++++ Request throttled, waiting for 10 secs ++++++++++")
-            time.sleep(10)
-            logging.info("++++++++++ Continuing ++++++++++")
-
-    yesterday_cost_dict["smfTotalCost"] = round(yesterday_cost_dict["smfTotalCost"],2)            
-    yesterday_cost_dict["lmfTotalCost"] = round(yesterday_cost_dict["lmfTotalCost"],2)      
-    yesterday_cost_dict["aifTotalCost"] = round(yesterday_cost_dict["aifTotalCost"],2)      
-    yesterday_cost_dict["totalCost"] = round(yesterday_cost_dict["smfTotalCost"] + yesterday_cost_dict["lmfTotalCost"] + yesterday_cost_dict["aifTotalCost"],2)
-    yesterday_cost_dict["fromDate"] = str(to_datetime.date())
-    yesterday_cost_dict["toDate"] = str(to_datetime.date())
-
-    daily_cost_dict["smfTotalCost"] = round(daily_cost_dict["smfTotalCost"],2)            
-    daily_cost_dict["lmfTotalCost"] = round(daily_cost_dict["lmfTotalCost"],2)      
-    daily_cost_dict["aifTotalCost"] = round(daily_cost_dict["aifTotalCost"],2)      
-    daily_cost_dict["totalCost"] = round(daily_cost_dict["smfTotalCost"] + daily_cost_dict["lmfTotalCost"] + daily_cost_dict["aifTotalCost"],2)
-    daily_cost_dict["fromDate"] = str((to_datetime - timedelta(days=7)).date())
-    daily_cost_dict["toDate"] = str((to_datetime - timedelta(days=1)).date())
-
-    weekly_cost_dict["smfTotalCost"] = round(weekly_cost_dict["smfTotalCost"],2)            
-    weekly_cost_dict["lmfTotalCost"] = round(weekly_cost_dict["lmfTotalCost"],2)      
-    weekly_cost_dict["aifTotalCost"] = round(weekly_cost_dict["aifTotalCost"],2)      
-    weekly_cost_dict["totalCost"] = round(weekly_cost_dict["smfTotalCost"] + weekly_cost_dict["lmfTotalCost"] + weekly_cost_dict["aifTotalCost"],2)
-    weekly_cost_dict["fromDate"] = str((to_datetime - timedelta(days=7)).date())
-    weekly_cost_dict["toDate"] = str((to_datetime - timedelta(days=1)).date())
-
-    monthly_cost_dict["smfTotalCost"] = round(monthly_cost_dict["smfTotalCost"],2)            
-    monthly_cost_dict["lmfTotalCost"] = round(monthly_cost_dict["lmfTotalCost"],2)      
-    monthly_cost_dict["aifTotalCost"] = round(monthly_cost_dict["aifTotalCost"],2)      
-    monthly_cost_dict["totalCost"] = round(monthly_cost_dict["smfTotalCost"] + monthly_cost_dict["lmfTotalCost"] + monthly_cost_dict["aifTotalCost"],2)
-    monthly_cost_dict["fromDate"] = str((to_datetime - timedelta(days=30)).date())
-    monthly_cost_dict["toDate"] = str((to_datetime - timedelta(days=1)).date())
-
-    return yesterday_cost_dict, daily_cost_dict, weekly_cost_dict, monthly_cost_dict
-
-def get_estimation(monthly_cost_dict):
-
-    estimation_cost_dict = {}
-
-    estimation_cost_dict["resourceGroupCost"] = list()
-    estimation_cost_dict["smfTotalCost"] = float(0)
-    estimation_cost_dict["lmfTotalCost"] = float(0)
-    estimation_cost_dict["aifTotalCost"] = float(0)
-    estimation_cost_dict["totalCost"] = float(0)
-
-    estimation_cost_dict["smfTotalCost"] = monthly_cost_dict["smfTotalCost"] * 12
-    estimation_cost_dict["lmfTotalCost"] = monthly_cost_dict["lmfTotalCost"] * 12
-    estimation_cost_dict["aifTotalCost"] = monthly_cost_dict["aifTotalCost"] * 12
-    estimation_cost_dict["totalCost"] = monthly_cost_dict["totalCost"] * 12
-
-    return estimation_cost_dict
-
-def main(req: func.HttpRequest) -> func.HttpResponse:
-    logging.info('Python HTTP trigger function processed a request.')
-
-    try:
-        req_body = req.get_json() 
+async def collect_rgs_cost(req_body, progress=None):
+    # The whole cost run of one request, shared by the synchronous response
+    # and the background jobs
 
-        scope = req_body.get('scope')
-        
-        toDate = datetime.strptime(datetime.utcnow().strftime("%Y-%m-%d 0:0"), "%Y-%m-%d 0:0").replace(tzinfo = timezone.utc)
+    start_time = time.perf_counter()
 
-        yesterday_from_datetime = (toDate - timedelta(days=1)) 
-        yesterday_to_datetime = (toDate - timedelta(minutes=1)) 
+    scope = req_body.get('scope')
+    query_mode = req_body.get('queryMode', os.environ.get("COST_QUERY_MODE", cost_query.QUERY_MODE_RESOURCE_GROUP))
+    max_concurrency = req_body.get('maxConcurrency')
 
-        daily_and_weekly_from_datetime =  (toDate - timedelta(days = 7 + 1)) 
-        daily_and_weekly_to_datetime = (toDate - timedelta(days = 1, minutes=1))
+    toDate = datetime.strptime(datetime.utcnow().strftime("%Y-%m-%d 0:0"), "%Y-%m-%d 0:0").replace(tzinfo = timezone.utc)
 
-        monthly_from_datetime =  (toDate - timedelta(days = 30 + 1)) 
-        monthly_to_datetime = (toDate - timedelta(days = 1, minutes=1))
+    from_datetime =  (toDate - timedelta(days = rgs_cost.get_num_days_to_fetch())) 
+    to_datetime = (toDate - timedelta(minutes=1))
 
-        from_datetime =  (toDate - timedelta(days = 30 + 1)) 
-        to_datetime = (toDate - timedelta(minutes=1))
+    # {"subscriptions": [...]} or a management group runs every subscription
+    # in one report, otherwise only the RGs of scope
+    subscription_ids, management_group_id = subscriptions.get_requested_subscriptions(req_body)
 
-        cred = DefaultAzureCredential( 
-            exclude_environment_credential = True,
-            exclude_powershell_credential = True,
-            exclude_visual_studio_code_credential = True,
-            exclude_shared_token_cache_credential = True,
-            exclude_interactive_browser_credential = True,
-        )  
+    # RG listing and cost queries run concurrently on the aio clients,
+    # get_rgs_cost then only aggregates the prefetched rows
+    if subscription_ids is not None or management_group_id is not None:
+        rows_of_cost_by_subscription = await aio_cost_query.collect_subscriptions_rows_of_cost(subscription_ids, management_group_id, query_mode, from_datetime, to_datetime, max_concurrency, progress)
 
-        subscription_id = scope.split("/")[2]
+        rgs_cost_dict = cost_merge.merge_subscriptions_rgs_cost([
+            (subscription_id, get_rgs_cost(resource_groups_list, cost_query.get_resource_groups_scope(subscription_id), from_datetime, to_datetime, rows_of_cost_by_rg, round_totals=False, breakdown_by_rg=breakdown_by_rg))
+            for subscription_id, (resource_groups_list, rows_of_cost_by_rg, breakdown_by_rg) in rows_of_cost_by_subscription.items()
+        ])
+    else:
+        resource_groups_list, rows_of_cost_by_rg, breakdown_by_rg = await aio_cost_query.collect_rows_of_cost(scope, query_mode, from_datetime, to_datetime, max_concurrency, progress)
 
-        cost_mgmt_client = CostManagementClient(cred, 'https://management.azure.com')
+        rgs_cost_dict = get_rgs_cost(resource_groups_list, scope, from_datetime, to_datetime, rows_of_cost_by_rg, breakdown_by_rg=breakdown_by_rg)
 
-        resource_mgmt_client = ResourceManagementClient(cred, subscription_id)
+    forecast.add_forecast(rgs_cost_dict)
 
-        resource_groups = resource_mgmt_client.resource_groups.list()
-        resource_groups_list = list(resource_groups)
+    # One notification per run, the sinks block so they run off the loop
+    await asyncio.to_thread(budget_alerts.alert, rgs_cost_dict, budget_alerts.get_alert_scope(req_body, cost_query.get_default_scope()))
 
-        rgs_cost_dict = {}
+    rgs_cost_dict["wallClockSecs"] = round(time.perf_counter() - start_time, 2)
 
-        rgs_cost_dict["yesterday"] = {}
-        rgs_cost_dict["daily"] = {}
-        rgs_cost_dict["weekly"] = {}
-        rgs_cost_dict["monthly"] = {}
-        rgs_cost_dict["estimation"] = {}
+    return rgs_cost_dict
 
-        # rgs_cost_dict["yesterday"] = get_yesterday_cost(resource_groups_list, scope, yesterday_from_datetime, yesterday_to_datetime, cost_mgmt_client)
+# Background jobs of this worker, kept referenced until they are done
+_running_jobs = {}
 
-        # rgs_cost_dict["daily"], rgs_cost_dict["weekly"] = get_daily_and_weekly_cost(resource_groups_list, scope, daily_and_weekly_from_datetime, daily_and_weekly_to_datetime, cost_mgmt_client)
-        
-        # rgs_cost_dict["monthly"] = get_monthly_cost(resource_groups_list, scope, monthly_from_datetime, monthly_to_datetime, cost_mgmt_client)
-        
-        rgs_cost_dict["yesterday"], rgs_cost_dict["daily"], rgs_cost_dict["weekly"], rgs_cost_dict["monthly"] = get_rgs_cost(resource_groups_list, scope, from_datetime, to_datetime, cost_mgmt_client)
+def get_job_request(req_body):
+    # What identifies a run besides its day
+    subscription_ids, management_group_id = subscriptions.get_requested_subscriptions(req_body)
+    return {
+        "scope": req_body.get('scope'),
+        "subscriptions": sorted(subscription_ids) if subscription_ids is not None else None,
+        "managementGroup": management_group_id,
+        "queryMode": req_body.get('queryMode', os.environ.get("COST_QUERY_MODE", cost_query.QUERY_MODE_RESOURCE_GROUP)),
+        "payloadFormat": cost_payload.get_payload_format(req_body.get('payloadFormat'))
+    }
 
-        rgs_cost_dict["estimation"] = get_estimation(rgs_cost_dict["monthly"])
+def get_request_body(req):
+    # The JSON body with its settings checked up front, any ValueError raised
+    # here is answered with a 400
+    try:
+        req_body = req.get_json()
+    except ValueError:
+        raise ValueError("The request body must be JSON")
+    if not isinstance(req_body, dict):
+        raise ValueError("The request body must be a JSON object")
+
+    cost_payload.get_payload_format(req_body.get('payloadFormat'))
+
+    query_mode = req_body.get('queryMode')
+    if query_mode is not None and query_mode not in (cost_query.QUERY_MODE_RESOURCE_GROUP, cost_query.QUERY_MODE_SUBSCRIPTION):
+        raise ValueError(f"Unknown queryMode {query_mode}, expected {cost_query.QUERY_MODE_RESOURCE_GROUP} or {cost_query.QUERY_MODE_SUBSCRIPTION}")
+
+    max_concurrency = req_body.get('maxConcurrency')
+    if max_concurrency is not None and (not isinstance(max_concurrency, int) or isinstance(max_concurrency, bool) or max_concurrency < 1):
+        raise ValueError(f"maxConcurrency must be a positive integer, got {max_concurrency}")
+
+    subscription_ids = req_body.get('subscriptions')
+    if subscription_ids is not None and (not isinstance(subscription_ids, list) or not all(isinstance(subscription_id, str) for subscription_id in subscription_ids)):
+        raise ValueError("subscriptions must be a list of subscription ids")
+
+    management_group_id = req_body.get('managementGroup')
+    if management_group_id is not None and not isinstance(management_group_id, str):
+        raise ValueError("managementGroup must be a management group id")
+
+    scope = req_body.get('scope')
+    if scope is not None and not isinstance(scope, str):
+        raise ValueError("scope must be a string")
+
+    # Without subscriptions or a management group (in the request or the app
+    # settings) the run is over the RGs of scope
+    if not subscriptions.is_multi_subscription(req_body) and not cost_query.is_resource_groups_scope(scope):
+        raise ValueError(f"scope must be /subscriptions/{{id}}/resourceGroups/ unless subscriptions or a managementGroup are given, got {scope}")
+
+    return req_body
+
+def get_error_response(e):
+    # Errors of the Azure SDK carry the status code of the upstream call, not
+    # of this request: a throttled (429) or unavailable (503) service is passed
+    # on with its Retry-After, any other upstream status is a 502. Anything
+    # else is a 500.
+
+    status_code = rp.get_status_code(e)
+    if status_code is None:
+        return func.HttpResponse(str(e), status_code=500)
+
+    if status_code in (429, 503):
+        _, retry_after = rl.parse_ratelimit_headers(rp.get_response_headers(e))
+        headers = {"Retry-After": str(math.ceil(retry_after))} if retry_after is not None else None
+        return func.HttpResponse(str(e), status_code=status_code, headers=headers)
+
+    return func.HttpResponse(f"Upstream call failed with {status_code}: {e}", status_code=502)
+
+def is_async_request(req, req_body):
+    # POST {"async": true}, ?async=true, or COST_TRACKER_HTTP_ASYNC=true for every call.
+    # The polls must reach the instance holding the job unless
+    # JOB_STORE_BACKEND=table, see job_store.get_backend_name
+    async_param = req_body.get('async', req.params.get('async', os.environ.get("COST_TRACKER_HTTP_ASYNC", "false")))
+    return str(async_param).lower() == "true"
+
+def get_status_query_uri(req, job_id):
+    return req.url.split("?")[0] + "?jobId=" + job_id
+
+async def run_job(job, req_body, store):
+    progress = job_store.JobProgress(job, store)
+    try:
+        rgs_cost_dict = await collect_rgs_cost(req_body, progress)
+        with telemetry.phase(telemetry.PHASE_SERIALIZE):
+            job["result"] = cost_payload.dumps(rgs_cost_dict, req_body.get('payloadFormat'))
+        job["status"] = job_store.STATUS_SUCCEEDED
+    except Exception as e:
+        logging.exception("[ERROR]: Something went wrong in the cost job")
+        job["error"] = str(e)
+        job["status"] = job_store.STATUS_FAILED
+    finally:
+        # After the last progress write, which would overwrite the status
+        await progress.wait()
+        await asyncio.to_thread(store.save_job, job)
+        _running_jobs.pop(job["jobId"], None)
+
+def get_job_response(req, job):
+    # 200 with the cost JSON once done, 202 with the progress until then
+
+    if job["status"] == job_store.STATUS_SUCCEEDED:
+        return func.HttpResponse(job["result"], status_code=200, mimetype="application/json")
+
+    status_query_uri = get_status_query_uri(req, job["jobId"])
+    job_status = {
+        "jobId": job["jobId"],
+        "status": job["status"],
+        "rgsDone": job["rgsDone"],
+        "rgsTotal": job["rgsTotal"],
+        "error": job["error"],
+        "createdAt": job["createdAt"],
+        "updatedAt": job["updatedAt"],
+        "statusQueryUri": status_query_uri
+    }
+
+    if job["status"] == job_store.STATUS_FAILED:
+        return func.HttpResponse(json.dumps(job_status), status_code=500, mimetype="application/json")
+
+    return func.HttpResponse(json.dumps(job_status), status_code=202, mimetype="application/json",
+                             headers={"Location": status_query_uri, "Retry-After": "10"})
+
+async def start_job(req, req_body):
+    # Same scope and day as an earlier call: served from its job, unless that
+    # job failed or was lost with a recycled worker. The store calls are
+    # blocking, they run off the event loop.
+
+    store = await asyncio.to_thread(job_store.get_job_store)
+    job_request = get_job_request(req_body)
+    job_id = job_store.get_job_id(job_request, datetime.utcnow().date())
+
+    job = await asyncio.to_thread(store.get_job, job_id)
+    if job is not None and (job["status"] == job_store.STATUS_SUCCEEDED or (job["status"] == job_store.STATUS_RUNNING and (job_id in _running_jobs or not job_store.is_stale(job)))):
+        logging.info(f"[INFO]: Serving job {job_id} ({job['status']})")
+        return get_job_response(req, job)
+
+    job = job_store.new_job(job_id, job_request)
+    await asyncio.to_thread(store.save_job, job)
+    _running_jobs[job_id] = asyncio.get_running_loop().create_task(run_job(job, req_body, store))
+
+    logging.info(f"[INFO]: Started job {job_id}")
+
+    return get_job_response(req, job)
+
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
 
-        rgs_cost_json = json.dumps(rgs_cost_dict)
+    try:
+        # Status polls of a background job
+        job_id = req.params.get('jobId')
+        if job_id:
+            store = await asyncio.to_thread(job_store.get_job_store)
+            job = await asyncio.to_thread(store.get_job, job_id)
+            if job is None:
+                if job_store.get_backend_name() != job_store.BACKEND_TABLE:
+                    return func.HttpResponse(f"Job {job_id} not found on this instance, set JOB_STORE_BACKEND=table to poll jobs across instances", status_code=404)
+                return func.HttpResponse(f"Job {job_id} not found", status_code=404)
+            return get_job_response(req, job)
+
+        try:
+            req_body = get_request_body(req)
+        except ValueError as e:
+            return func.HttpResponse(str(e), status_code=400)
+
+        # Long runs go to a background job polled through the returned URL,
+        # away from the 230 secs limit of the HTTP front end
+        if is_async_request(req, req_body):
+            return await start_job(req, req_body)
+
+        rgs_cost_dict = await collect_rgs_cost(req_body)
+
+        with telemetry.phase(telemetry.PHASE_SERIALIZE):
+            # {"payloadFormat": "columnar"} or "columnar+gzip", see cost_payload.decode
+            rgs_cost_json = cost_payload.dumps(rgs_cost_dict, req_body.get('payloadFormat'))
 
         return func.HttpResponse(rgs_cost_json,status_code=200) 
 
     except Exception as e:
         logging.exception(e)
-        return func.HttpResponse(e,status_code=e.status_code)
\ No newline at end of file
+        return get_error_response(e)
\ No newline at end of file
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import time
+
+from shared_code import clients
+from shared_code import cost_breakdown
+from shared_code import cost_query
+from shared_code import cost_store
+from shared_code import rate_limiter as rl
+from shared_code import rg_inventory
+from shared_code import rgs_cost
+from shared_code import subscriptions
+from shared_code import telemetry
+
+def get_max_concurrency():
+    return int(os.environ.get("COST_QUERY_MAX_CONCURRENCY", "8"))
+
+async def iter_pages_of_cost(cost_mgmt_client, scope, query_def, rate_limiter=None, semaphore=None, to_rows=None):
+    # Same as cost_query.iter_pages_of_cost with the aio client, the semaphore
+    # held for each page request
+
+    skiptoken = None
+    while True:
+        async with semaphore or asyncio.Semaphore(1):
+            query_result = await rl.query_usage_async(cost_mgmt_client, scope, query_def, rate_limiter or rl.get_shared_rate_limiter(), skiptoken)
+        yield (to_rows or cost_query.to_cost_rows)(query_result)
+
+        next_link = getattr(query_result, "next_link", None)
+        skiptoken = cost_query.get_skiptoken(next_link) if next_link else None
+        if skiptoken is None:
+            return
+
+async def get_cost(scope_with_rg, from_datetime, to_datetime, cost_mgmt_client, semaphore, rate_limiter=None):
+
+    async def query_rows_of_cost(query_from_datetime, query_to_datetime):
+        query_def = cost_query.get_query_definition(query_from_datetime, query_to_datetime)
+        return [row async for page in iter_pages_of_cost(cost_mgmt_client, scope_with_rg, query_def, rate_limiter, semaphore) for row in page]
+
+    return await cost_store.get_rows_of_cost_async(scope_with_rg, from_datetime, to_datetime, query_rows_of_cost)
+
+async def get_rows_of_cost_by_rg(resource_groups, scope, from_datetime, to_datetime, cost_mgmt_client, max_concurrency=None, rate_limiter=None, semaphore=None, progress=None):
+    # Per-RG queries issued concurrently, at most max_concurrency in flight
+    # (or as many as a semaphore shared across subscriptions allows).
+    # The result plugs into get_rgs_cost as rows_of_cost_by_rg, with the
+    # exception in place of the rows of an RG that failed.
+    # progress.add_done(1) is called as each RG's rows arrive.
+
+    semaphore = semaphore or asyncio.Semaphore(max_concurrency or get_max_concurrency())
+    unmanaged_rgs = [rg for rg in resource_groups if rg.managed_by is None]
+
+    async def get_rg_cost(rg):
+        fetch_start = time.perf_counter()
+        try:
+            rows_of_cost = await get_cost('' + scope + str(rg.name), from_datetime, to_datetime, cost_mgmt_client, semaphore, rate_limiter)
+            # Raw Team tag, the team keys are only resolved by get_rgs_cost
+            telemetry.record_rg_fetch(rg.name, (rg.tags or {}).get("Team", "NA"), time.perf_counter() - fetch_start, len(rows_of_cost))
+        except Exception as e:
+            rows_of_cost = e
+        if progress is not None:
+            progress.add_done(1)
+        return rows_of_cost
+
+    rows_of_cost_list = await asyncio.gather(*[get_rg_cost(rg) for rg in unmanaged_rgs])
+
+    return {str(rg.name).lower(): rows_of_cost for rg, rows_of_cost in zip(unmanaged_rgs, rows_of_cost_list)}
+
+async def get_subscription_rows_of_cost_by_rg(subscription_scope, from_datetime, to_datetime, cost_mgmt_client, rate_limiter=None, semaphore=None, breakdown=None):
+
+    if breakdown is not None:
+        # Same single pass as cost_query.get_rows_of_cost_by_rg, one page at a time
+        query_def = cost_query.get_query_definition(from_datetime, to_datetime, breakdown_dimension=breakdown.dimension)
+        to_rows = lambda query_result: cost_query.to_breakdown_rows(query_result, breakdown.dimension)
+        pages = iter_pages_of_cost(cost_mgmt_client, subscription_scope, query_def, rate_limiter, semaphore, to_rows)
+        costs = {}
+        async for page in pages:
+            cost_query.add_breakdown_rows(page, breakdown, costs)
+        return cost_query.split_breakdown_costs_by_rg(costs)
+
+    async def query_rows_of_cost(query_from_datetime, query_to_datetime):
+        query_def = cost_query.get_query_definition(query_from_datetime, query_to_datetime)
+        return [row async for page in iter_pages_of_cost(cost_mgmt_client, subscription_scope, query_def, rate_limiter, semaphore) for row in page]
+
+    rows_of_cost = await cost_store.get_rows_of_cost_async(subscription_scope, from_datetime, to_datetime, query_rows_of_cost)
+
+    return cost_query.split_rows_of_cost_by_rg(rows_of_cost)
+
+async def collect_subscriptions_rows_of_cost(subscription_ids, management_group_id, query_mode, from_datetime, to_datetime, max_concurrency=None, progress=None):
+    # Lists the RGs and fetches their rows for every subscription (or every
+    # subscription under the management group) concurrently, over the pooled
+    # aiohttp session, credential and clients. At most max_concurrency cost
+    # queries are in flight across all the subscriptions.
+    # progress (e.g. a job_store.JobProgress) is told how many RGs there are
+    # and how many are done.
+    # Returns {subscription_id: (resource_groups_list, rows_of_cost_by_rg, breakdown_by_rg)},
+    # breakdown_by_rg being None unless a subscription query has a
+    # COST_BREAKDOWN_DIMENSION (see cost_breakdown).
+
+    cost_mgmt_client = clients.get_aio_cost_mgmt_client()
+    resource_graph_client = clients.get_aio_resource_graph_client()
+
+    subscription_ids = await subscriptions.resolve_subscription_ids_async(subscription_ids, management_group_id, resource_graph_client)
+
+    resource_groups_by_subscription = await rg_inventory.get_resource_groups_by_subscription_async(subscription_ids, clients.get_aio_resource_mgmt_client, resource_graph_client)
+
+    if progress is not None:
+        progress.add_total(sum(1 for resource_groups_list in resource_groups_by_subscription.values() for rg in resource_groups_list if rg.managed_by is None))
+
+    semaphore = asyncio.Semaphore(max_concurrency or get_max_concurrency())
+
+    if query_mode != cost_query.QUERY_MODE_SUBSCRIPTION:
+        cost_breakdown.log_ignored_dimension()
+
+    async def collect_subscription_rows_of_cost(subscription_id):
+        resource_groups_list = resource_groups_by_subscription[subscription_id]
+        scope = cost_query.get_resource_groups_scope(subscription_id)
+
+        breakdown = None
+        if query_mode == cost_query.QUERY_MODE_SUBSCRIPTION:
+            breakdown = cost_breakdown.new_accumulator(to_datetime, rgs_cost.get_extra_windows())
+            try:
+                rows_of_cost_by_rg = await get_subscription_rows_of_cost_by_rg(cost_query.get_subscription_scope(scope), from_datetime, to_datetime, cost_mgmt_client, semaphore=semaphore, breakdown=breakdown)
+            except Exception as e:
+                # Every RG of the subscription is reported as failed
+                logging.error(f"[ERROR]: Could not get the cost of subscription {subscription_id}: {e}")
+                rows_of_cost_by_rg = {str(rg.name).lower(): e for rg in resource_groups_list if rg.managed_by is None}
+            if progress is not None:
+                progress.add_done(sum(1 for rg in resource_groups_list if rg.managed_by is None))
+        else:
+            rows_of_cost_by_rg = await get_rows_of_cost_by_rg(resource_groups_list, scope, from_datetime, to_datetime, cost_mgmt_client, semaphore=semaphore, progress=progress)
+
+        logging.info(f"[INFO]: Fetched cost rows for {len(rows_of_cost_by_rg)} RGs of subscription {subscription_id}")
+
+        return resource_groups_list, rows_of_cost_by_rg, breakdown.get_breakdowns() if breakdown is not None else None
+
+    results = await asyncio.gather(*[collect_subscription_rows_of_cost(subscription_id) for subscription_id in subscription_ids])
+
+    return dict(zip(subscription_ids, results))
+
+async def collect_rows_of_cost(scope, query_mode, from_datetime, to_datetime, max_concurrency=None, progress=None):
+    # Single subscription run over the RGs of scope
+
+    subscription_id = scope.split("/")[2]
+
+    rows_of_cost_by_subscription = await collect_subscriptions_rows_of_cost([subscription_id], None, query_mode, from_datetime, to_datetime, max_concurrency, progress)
+
+    return rows_of_cost_by_subscription[subscription_id]
@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from shared_code import cost_store
+
+# Cost spikes in the daily series of each RG. Every RG keeps a running mean
+# and variance of its daily cost (Welford's running mean while it has fewer
+# than 1 / alpha days, an exponentially weighted one after that), stored
+# with the last day it has seen. A run only feeds the days after that one,
+# so a daily run checks one new day per RG without going over its history.
+
+BACKEND_NONE = "none"
+BACKEND_SQLITE = "sqlite"
+BACKEND_TABLE = "table"
+
+def get_alpha():
+    # COST_ANOMALY_ALPHA, weight of each new day once warmed up (~ 1 / days remembered)
+    return float(os.environ.get("COST_ANOMALY_ALPHA", "0.1"))
+
+def get_z_threshold():
+    return float(os.environ.get("COST_ANOMALY_Z", "3"))
+
+def get_min_days():
+    # Days seen before an RG is checked
+    return int(os.environ.get("COST_ANOMALY_MIN_DAYS", "7"))
+
+def get_min_delta():
+    # COST_ANOMALY_MIN_DELTA, smallest rise over the mean worth reporting,
+    # keeps near-zero RGs from flagging cents
+    return float(os.environ.get("COST_ANOMALY_MIN_DELTA", "1"))
+
+def get_min_ratio():
+    # COST_ANOMALY_MIN_RATIO, smallest rise relative to the mean, keeps very
+    # steady RGs from flagging their ordinary noise
+    return float(os.environ.get("COST_ANOMALY_MIN_RATIO", "0.25"))
+
+def get_report_days():
+    # Anomalies of the last COST_ANOMALY_REPORT_DAYS days are listed
+    return int(os.environ.get("COST_ANOMALY_REPORT_DAYS", "7"))
+
+def get_state_key(scope):
+    # One partition per subscription
+    return scope.split("/")[2] if scope.startswith("/subscriptions/") else scope.replace("/", "|")
+
+def new_state():
+    return {"lastDate": 0, "count": 0, "mean": 0.0, "variance": 0.0, "anomalies": []}
+
+class SqliteAnomalyStore:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS rg_stats (state_key TEXT, rg TEXT, state TEXT, saved_at TEXT, PRIMARY KEY (state_key, rg))")
+        self._conn.commit()
+
+    def get_states(self, state_key):
+        with self._lock:
+            cursor = self._conn.execute("SELECT rg, state FROM rg_stats WHERE state_key = ?", (state_key,))
+            return {rg: json.loads(state) for rg, state in cursor.fetchall()}
+
+    def save_states(self, state_key, states):
+        saved_at = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO rg_stats VALUES (?, ?, ?, ?)",
+                [(state_key, rg, json.dumps(state), saved_at) for rg, state in states.items()])
+            self._conn.commit()
+
+class TableAnomalyStore:
+    # Azure Table storage, one partition per subscription. Keys cannot hold "/".
+
+    def __init__(self, connection_string, table_name="costtrackeranomalies"):
+        from azure.data.tables import TableServiceClient
+
+        table_service_client = TableServiceClient.from_connection_string(connection_string)
+        self._table = table_service_client.create_table_if_not_exists(table_name)
+
+    def get_states(self, state_key):
+        entities = self._table.query_entities("PartitionKey eq @pk", parameters={"pk": state_key})
+        return {entity["rg"]: json.loads(entity["state"]) for entity in entities}
+
+    def save_states(self, state_key, states):
+        for rg, state in states.items():
+            self._table.upsert_entity({
+                "PartitionKey": state_key,
+                "RowKey": rg.replace("/", "|"),
+                "rg": rg,
+                "state": json.dumps(state)
+            })
+
+_anomaly_store = None
+_anomaly_store_lock = threading.Lock()
+
+def get_anomaly_store():
+    # ANOMALY_STORE_BACKEND: none (default, no anomalies), sqlite (local to
+    # the instance) or table (shared by every instance). A lost state only
+    # means the next run warms up again over its whole window.
+    global _anomaly_store
+
+    with _anomaly_store_lock:
+        if _anomaly_store is None:
+            backend = os.environ.get("ANOMALY_STORE_BACKEND", BACKEND_NONE).lower()
+            if backend == BACKEND_SQLITE:
+                _anomaly_store = SqliteAnomalyStore(os.environ.get("ANOMALY_STORE_PATH", os.path.join(tempfile.gettempdir(), "anomaly_store.sqlite3")))
+            elif backend == BACKEND_TABLE:
+                _anomaly_store = TableAnomalyStore(os.environ.get("ANOMALY_STORE_CONNECTION_STRING", os.environ.get("AzureWebJobsStorage")))
+            else:
+                return None
+        return _anomaly_store
+
+def update_stats(series, usage_dates, last_dates, counts, means, variances, alpha, z_threshold, min_days, min_delta, min_ratio):
+    # Feeds the days of series (RG x day, one usage date per column) that are
+    # newer than each RG's last date, one day at a time across every RG.
+    # Updates the state arrays in place and returns the (RG index, day index,
+    # expected cost, z-score) of each spike.
+
+    spikes = []
+    for day, usage_date in enumerate(usage_dates):
+        is_new = usage_date > last_dates
+        if not is_new.any():
+            continue
+
+        costs = series[:, day]
+        std = np.maximum(np.sqrt(variances), 0.01)
+        z_scores = (costs - means) / std
+
+        is_checked = is_new & (counts >= min_days)
+        is_spike = is_checked & (z_scores >= z_threshold) & (costs - means >= np.maximum(min_delta, min_ratio * means))
+        for i in np.flatnonzero(is_spike):
+            spikes.append((int(i), day, float(means[i]), float(z_scores[i])))
+
+        # A spike is fed capped at the threshold, so it does not inflate the
+        # variance enough to hide the next one
+        fed_costs = np.where(is_checked, np.minimum(costs, means + z_threshold * std), costs)
+
+        new_counts = counts + is_new
+        weights = np.where(is_new, np.maximum(alpha, 1 / np.maximum(new_counts, 1)), 0)
+        diffs = fed_costs - means
+        increments = weights * diffs
+        variances[:] = np.where(is_new, (1 - weights) * (variances + diffs * increments), variances)
+        means += increments
+        counts[:] = new_counts
+        last_dates[:] = np.where(is_new, usage_date, last_dates)
+
+    return spikes
+
+def detect_anomalies(scope, cost_matrix, from_date, rg_names, teams, store=None):
+    # Feeds the new days of the RGs of a get_rgs_cost run to their stored
+    # statistics and returns their anomalies of the last report days. The
+    # last column (yesterday, still settling) is left for the next run.
+
+    store = store or get_anomaly_store()
+    if store is None or len(rg_names) == 0:
+        return []
+
+    series = cost_matrix[:, :-1]
+    usage_dates = np.array([cost_store.to_usage_date(from_date + timedelta(days=day)) for day in range(series.shape[1])], dtype=np.int64)
+
+    state_key = get_state_key(scope)
+    stored_states = store.get_states(state_key)
+    states = [stored_states.get(str(rg_name).lower()) or new_state() for rg_name in rg_names]
+
+    last_dates = np.array([state["lastDate"] for state in states], dtype=np.int64)
+    counts = np.array([state["count"] for state in states], dtype=np.int64)
+    means = np.array([state["mean"] for state in states], dtype=float)
+    variances = np.array([state["variance"] for state in states], dtype=float)
+
+    spikes = update_stats(series, usage_dates, last_dates, counts, means, variances, get_alpha(), get_z_threshold(), get_min_days(), get_min_delta(), get_min_ratio())
+
+    for i, day, expected_cost, z_score in spikes:
+        states[i]["anomalies"].append({
+            "date": str(from_date + timedelta(days=day)),
+            "cost": round(float(series[i, day]), 2),
+            "expectedCost": round(expected_cost, 2),
+            "zScore": round(z_score, 2)
+        })
+
+    report_from_date = str(from_date + timedelta(days=series.shape[1] - get_report_days()))
+
+    changed_states = {}
+    anomalies = []
+    for i, state in enumerate(states):
+        recent_anomalies = [anomaly for anomaly in state["anomalies"] if anomaly["date"] >= report_from_date]
+        if last_dates[i] != state["lastDate"] or len(recent_anomalies) != len(state["anomalies"]):
+            changed_states[str(rg_names[i]).lower()] = {
+                "lastDate": int(last_dates[i]),
+                "count": int(counts[i]),
+                "mean": float(means[i]),
+                "variance": float(variances[i]),
+                "anomalies": recent_anomalies
+            }
+        for anomaly in recent_anomalies:
+            anomalies.append({"rgname": rg_names[i], "rgteam": teams[i], **anomaly})
+
+    if len(changed_states) > 0:
+        store.save_states(state_key, changed_states)
+
+    if len(spikes) > 0:
+        logging.info(f"[INFO]: {len(spikes)} new cost anomalies in {scope}")
+
+    return sorted(anomalies, key=lambda anomaly: (anomaly["date"], anomaly["zScore"]), reverse=True)
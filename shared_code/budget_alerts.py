@@ -0,0 +1,359 @@
+import json
+import logging
+import os
+import smtplib
+import sqlite3
+import tempfile
+import threading
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+
+from shared_code import cost_merge
+from shared_code import subscriptions
+from shared_code.team_aggregator import normalize_team
+
+# Budgets per team and per RG, checked against the cost of every period:
+#
+#   COST_BUDGETS (JSON) or COST_BUDGETS_PATH (a JSON file), e.g.
+#   {
+#     "thresholds": [0.8, 1.0],
+#     "teams": {"AI Factory": {"monthly": 5000, "daily": 200}, "infraTotalCost": {"weekly": 900}},
+#     "resourceGroups": {"rg-data": {"monthly": 300}}
+#   }
+#
+# Teams are matched on their rgteam tag, or on their cost key. A breach is the
+# highest threshold reached by one budget. All new breaches of a run go out in
+# one notification, through every sink in COST_ALERT_SINKS; a breach that is
+# still there on the next runs is not sent again until it clears, crosses a
+# higher threshold or COST_ALERT_REALERT_HOURS pass.
+
+LEVEL_TEAM = "team"
+LEVEL_RG = "resourceGroup"
+
+SINK_LOG = "log"
+SINK_FILE = "file"
+SINK_WEBHOOK = "webhook"
+SINK_TEAMS = "teams"
+SINK_EMAIL = "email"
+
+BACKEND_NONE = "none"
+BACKEND_SQLITE = "sqlite"
+BACKEND_TABLE = "table"
+
+DEFAULT_THRESHOLDS = [1.0]
+
+_budgets = None
+_budgets_lock = threading.Lock()
+
+def get_budgets():
+    # Loaded once per worker, {} without any budget
+    global _budgets
+
+    with _budgets_lock:
+        if _budgets is None:
+            budgets = os.environ.get("COST_BUDGETS")
+            budgets_path = os.environ.get("COST_BUDGETS_PATH")
+            if budgets:
+                _budgets = json.loads(budgets)
+            elif budgets_path:
+                with open(budgets_path) as budgets_file:
+                    _budgets = json.load(budgets_file)
+            else:
+                _budgets = {}
+        return _budgets
+
+def set_budgets(budgets):
+    # None reloads them from the app settings
+    global _budgets
+
+    with _budgets_lock:
+        _budgets = budgets
+
+def get_breach(level, name, period, budget, cost, thresholds):
+    # The highest threshold reached, None under all of them
+    if not budget or budget <= 0:
+        return None
+    usage = cost / budget
+    reached = [threshold for threshold in thresholds if usage >= threshold]
+    if len(reached) == 0:
+        return None
+    return {"level": level, "name": name, "period": period, "budget": budget, "cost": round(cost, 2), "usage": round(usage, 3), "threshold": max(reached)}
+
+def has_budgets():
+    return len(get_budgets().get("teams", {})) + len(get_budgets().get("resourceGroups", {})) > 0
+
+def get_rg_breaches(cost_dicts, budgets=None):
+    # RG budgets of one get_rgs_cost run, checked while its periods are built
+    budgets = get_budgets() if budgets is None else budgets
+    rg_budgets = {str(rg_name).lower(): rg_budget for rg_name, rg_budget in budgets.get("resourceGroups", {}).items()}
+    if len(rg_budgets) == 0:
+        return []
+
+    thresholds = budgets.get("thresholds", DEFAULT_THRESHOLDS)
+    breaches = []
+    for period in cost_merge.get_periods(cost_dicts):
+        for rg_cost in cost_dicts[period]["resourceGroupCost"]:
+            rg_budget = rg_budgets.get(str(rg_cost["rgname"]).lower())
+            if rg_budget is None or period not in rg_budget:
+                continue
+            breach = get_breach(LEVEL_RG, rg_cost["rgname"], period, rg_budget[period], rg_cost["rgcost"], thresholds)
+            if breach is not None:
+                breach["team"] = rg_cost["rgteam"]
+                breaches.append(breach)
+    return breaches
+
+def add_team_breaches(rgs_cost_dict, budgets=None):
+    # Team budgets need the merged totals, they are checked once the batches
+    # (or subscriptions) are merged. The estimation counts as a period.
+    budgets = get_budgets() if budgets is None else budgets
+    thresholds = budgets.get("thresholds", DEFAULT_THRESHOLDS)
+    periods = cost_merge.get_periods(rgs_cost_dict)
+    breaches = rgs_cost_dict.setdefault(cost_merge.BUDGET_BREACHES, [])
+
+    for team, team_budget in budgets.get("teams", {}).items():
+        for period, budget in team_budget.items():
+            if period not in periods:
+                continue
+            cost_dict = rgs_cost_dict[period]
+            if not isinstance(cost_dict, dict) or "resourceGroupCost" not in cost_dict:
+                continue
+            if team in cost_dict:
+                cost = cost_dict[team]
+            else:
+                cost = sum(rg_cost["rgcost"] for rg_cost in cost_dict["resourceGroupCost"] if normalize_team(rg_cost["rgteam"]) == normalize_team(team))
+            breach = get_breach(LEVEL_TEAM, team, period, budget, cost, thresholds)
+            if breach is not None:
+                breaches.append(breach)
+
+    return rgs_cost_dict
+
+def get_breach_key(breach):
+    return "|".join([breach["level"], str(breach.get("subscriptionId", "")), str(breach["name"]).lower(), breach["period"], str(breach["threshold"])])
+
+def get_alert_scope(request=None, default_scope=None):
+    # Dedup partition of a run: its subscriptions, management group or scope
+    subscription_ids, management_group_id = subscriptions.get_requested_subscriptions(request)
+    if management_group_id is not None:
+        return f"managementGroups/{management_group_id}"
+    if subscription_ids is not None:
+        return "subscriptions/" + ",".join(sorted(subscription_ids))
+    if isinstance(request, dict) and request.get("scope"):
+        return request["scope"]
+    return default_scope
+
+class SqliteAlertStateStore:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS alerted_breaches (alert_scope TEXT, breach_key TEXT, alerted_at TEXT, PRIMARY KEY (alert_scope, breach_key))")
+        self._conn.commit()
+
+    def get_alerted(self, alert_scope):
+        with self._lock:
+            cursor = self._conn.execute("SELECT breach_key, alerted_at FROM alerted_breaches WHERE alert_scope = ?", (alert_scope,))
+            return dict(cursor.fetchall())
+
+    def save_alerted(self, alert_scope, alerted, cleared_keys):
+        with self._lock:
+            self._conn.executemany("DELETE FROM alerted_breaches WHERE alert_scope = ? AND breach_key = ?", [(alert_scope, key) for key in cleared_keys])
+            self._conn.executemany("INSERT OR REPLACE INTO alerted_breaches VALUES (?, ?, ?)", [(alert_scope, key, alerted_at) for key, alerted_at in alerted.items()])
+            self._conn.commit()
+
+class TableAlertStateStore:
+    # Azure Table storage, one partition per alert scope. Keys cannot hold "/".
+
+    def __init__(self, connection_string, table_name="costtrackeralerts"):
+        from azure.data.tables import TableServiceClient
+
+        table_service_client = TableServiceClient.from_connection_string(connection_string)
+        self._table = table_service_client.create_table_if_not_exists(table_name)
+
+    @staticmethod
+    def _key(value):
+        return value.replace("/", "|")
+
+    def get_alerted(self, alert_scope):
+        entities = self._table.query_entities("PartitionKey eq @pk", parameters={"pk": self._key(alert_scope)})
+        return {entity["breachKey"]: entity["alertedAt"] for entity in entities}
+
+    def save_alerted(self, alert_scope, alerted, cleared_keys):
+        for key in cleared_keys:
+            self._table.delete_entity(partition_key=self._key(alert_scope), row_key=self._key(key))
+        for key, alerted_at in alerted.items():
+            self._table.upsert_entity({"PartitionKey": self._key(alert_scope), "RowKey": self._key(key), "breachKey": key, "alertedAt": alerted_at})
+
+_alert_state_store = None
+_alert_state_store_lock = threading.Lock()
+
+def get_alert_state_store():
+    # ALERT_STATE_STORE_BACKEND: sqlite (default, local to the instance), table
+    # or none (every run alerts)
+    global _alert_state_store
+
+    with _alert_state_store_lock:
+        if _alert_state_store is None:
+            backend = os.environ.get("ALERT_STATE_STORE_BACKEND", BACKEND_SQLITE).lower()
+            if backend == BACKEND_SQLITE:
+                _alert_state_store = SqliteAlertStateStore(os.environ.get("ALERT_STATE_STORE_PATH", os.path.join(tempfile.gettempdir(), "alert_state_store.sqlite3")))
+            elif backend == BACKEND_TABLE:
+                _alert_state_store = TableAlertStateStore(os.environ.get("ALERT_STATE_STORE_CONNECTION_STRING", os.environ.get("AzureWebJobsStorage")))
+            else:
+                return None
+        return _alert_state_store
+
+def get_notification_text(notification):
+    lines = [f"{len(notification['breaches'])} cost budget breaches in {notification['scope']}"]
+    for breach in notification["breaches"]:
+        subscription = f" ({breach['subscriptionId']})" if "subscriptionId" in breach else ""
+        lines.append(f"- {breach['level']} {breach['name']}{subscription}, {breach['period']}: {breach['cost']:.2f} of {breach['budget']:.2f} ({breach['usage']:.0%})")
+    return "\n".join(lines)
+
+class LogSink:
+
+    def send(self, notification):
+        logging.info(f"[INFO]: {get_notification_text(notification)}")
+
+class FileSink:
+    # One JSON line per notification, for local runs and tests
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, notification):
+        with self._lock:
+            with open(self.path, "a") as notifications_file:
+                notifications_file.write(json.dumps(notification) + "\n")
+
+class WebhookSink:
+    # The notification as JSON, POSTed to url
+
+    def __init__(self, url, timeout_secs=10):
+        self.url = url
+        self.timeout_secs = timeout_secs
+
+    def get_body(self, notification):
+        return notification
+
+    def send(self, notification):
+        request = urllib.request.Request(self.url, data=json.dumps(self.get_body(notification)).encode(), headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout_secs) as response:
+            response.read()
+
+class TeamsSink(WebhookSink):
+    # Teams incoming webhook, a plain text card
+
+    def get_body(self, notification):
+        return {"text": get_notification_text(notification).replace("\n", "\n\n")}
+
+class EmailSink:
+
+    def __init__(self, host, port, sender, recipients, username=None, password=None):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = recipients
+        self.username = username
+        self.password = password
+
+    def send(self, notification):
+        message = EmailMessage()
+        message["Subject"] = f"Cost budget alert: {len(notification['breaches'])} breaches in {notification['scope']}"
+        message["From"] = self.sender
+        message["To"] = ", ".join(self.recipients)
+        message.set_content(get_notification_text(notification))
+
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.port == 587:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+_default_sink_factories = {
+    SINK_LOG: lambda: LogSink(),
+    SINK_FILE: lambda: FileSink(os.environ.get("COST_ALERT_FILE_PATH", os.path.join(tempfile.gettempdir(), "cost_alerts.jsonl"))),
+    SINK_WEBHOOK: lambda: WebhookSink(os.environ["COST_ALERT_WEBHOOK_URL"]),
+    SINK_TEAMS: lambda: TeamsSink(os.environ["COST_ALERT_TEAMS_WEBHOOK_URL"]),
+    SINK_EMAIL: lambda: EmailSink(
+        os.environ["COST_ALERT_SMTP_HOST"],
+        int(os.environ.get("COST_ALERT_SMTP_PORT", "587")),
+        os.environ["COST_ALERT_EMAIL_FROM"],
+        [recipient.strip() for recipient in os.environ["COST_ALERT_EMAIL_TO"].split(",") if recipient.strip()],
+        os.environ.get("COST_ALERT_SMTP_USERNAME"),
+        os.environ.get("COST_ALERT_SMTP_PASSWORD")
+    )
+}
+_sink_factories = dict(_default_sink_factories)
+
+def set_sink_factory(name, factory):
+    # Adds or replaces a sink, e.g. a fake one in tests
+    _sink_factories[name] = factory
+
+def get_sinks():
+    # COST_ALERT_SINKS, comma separated, e.g. "teams,file"
+    sink_names = [name.strip().lower() for name in os.environ.get("COST_ALERT_SINKS", SINK_LOG).split(",") if name.strip()]
+    return [(name, _sink_factories[name]()) for name in sink_names]
+
+def get_realert_hours():
+    # 0 never repeats a breach that has not cleared
+    return float(os.environ.get("COST_ALERT_REALERT_HOURS", "168"))
+
+def notify_breaches(alert_scope, breaches, store=None, sinks=None):
+    # Sends the breaches not alerted yet as one notification. Returns the
+    # notification, None when there is nothing new. Never raises: the report
+    # is returned whether the alert goes out or not.
+
+    try:
+        store = store or get_alert_state_store()
+        now = datetime.now(timezone.utc)
+
+        alerted = store.get_alerted(alert_scope) if store is not None else {}
+        breaches_by_key = {get_breach_key(breach): breach for breach in breaches}
+        cleared_keys = [key for key in alerted if key not in breaches_by_key]
+
+        realert_hours = get_realert_hours()
+        new_breaches = {
+            key: breach for key, breach in breaches_by_key.items()
+            if key not in alerted or (realert_hours > 0 and now - datetime.fromisoformat(alerted[key]) >= timedelta(hours=realert_hours))
+        }
+
+        notification = None
+        if len(new_breaches) > 0:
+            notification = {"scope": alert_scope, "generatedAt": now.isoformat(), "breaches": list(new_breaches.values())}
+
+            delivered = False
+            for name, sink in (sinks if sinks is not None else get_sinks()):
+                try:
+                    sink.send(notification)
+                    delivered = True
+                except Exception as e:
+                    logging.error(f"[ERROR]: Could not send the budget alert through {name}: {e}")
+
+            # Undelivered breaches are tried again on the next run
+            if not delivered:
+                new_breaches = {}
+
+        if store is not None and (len(new_breaches) > 0 or len(cleared_keys) > 0):
+            store.save_alerted(alert_scope, {key: now.isoformat() for key in new_breaches}, cleared_keys)
+
+        return notification
+    except Exception as e:
+        logging.error(f"[ERROR]: Could not process the budget alerts: {e}")
+        return None
+
+def alert(rgs_cost_dict, alert_scope):
+    # Team breaches and the notification of a whole run, once merged. Like
+    # notify_breaches it never raises, e.g. on a budgets file that cannot be
+    # read.
+    try:
+        if not has_budgets():
+            return None
+        add_team_breaches(rgs_cost_dict)
+    except Exception as e:
+        logging.error(f"[ERROR]: Could not check the team budgets: {e}")
+        return None
+    return notify_breaches(alert_scope, rgs_cost_dict[cost_merge.BUDGET_BREACHES])
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from shared_code import cost_query
+
+# Per-RG progress of an activity run. The rows of every RG fetched so far are
+# kept under the run id, so a retried or restarted run skips them and resumes
+# at the first unfinished RG. A run that returns clears its checkpoint, the
+# ones of runs that never do expire after CHECKPOINT_TTL_SECS.
+
+BACKEND_NONE = "none"
+BACKEND_SQLITE = "sqlite"
+BACKEND_TABLE = "table"
+
+def get_run_id(scope, from_datetime, to_datetime, resource_group_names):
+    # Same scope, window and RGs (i.e. the same activity input on the same day)
+    run_key = "|".join([scope, str(from_datetime), str(to_datetime)] + sorted(str(name).lower() for name in resource_group_names))
+    return hashlib.sha1(run_key.encode()).hexdigest()
+
+class SqliteCheckpointStore:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS checkpoints (run_id TEXT, rg TEXT, rows TEXT, saved_at TEXT, PRIMARY KEY (run_id, rg))")
+        self._conn.commit()
+
+    def get_rows_by_rg(self, run_id):
+        with self._lock:
+            cursor = self._conn.execute("SELECT rg, rows FROM checkpoints WHERE run_id = ?", (run_id,))
+            return {rg: json.loads(rows) for rg, rows in cursor.fetchall()}
+
+    def save_rows(self, run_id, rg_name, rows_of_cost):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+                (run_id, rg_name, json.dumps([list(row) for row in rows_of_cost]), datetime.now(timezone.utc).isoformat()))
+            self._conn.commit()
+
+    def clear(self, run_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoints WHERE run_id = ?", (run_id,))
+            self._conn.commit()
+
+    def purge_expired(self, saved_before):
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoints WHERE saved_at < ?", (saved_before.isoformat(),))
+            self._conn.commit()
+
+class TableCheckpointStore:
+    # Azure Table storage, one partition per run. Keys cannot hold "/".
+
+    def __init__(self, connection_string, table_name="costtrackercheckpoints"):
+        from azure.data.tables import TableServiceClient
+
+        table_service_client = TableServiceClient.from_connection_string(connection_string)
+        self._table = table_service_client.create_table_if_not_exists(table_name)
+
+    def get_rows_by_rg(self, run_id):
+        entities = self._table.query_entities("PartitionKey eq @pk", parameters={"pk": run_id})
+        return {entity["rg"]: json.loads(entity["rows"]) for entity in entities}
+
+    def save_rows(self, run_id, rg_name, rows_of_cost):
+        self._table.upsert_entity({
+            "PartitionKey": run_id,
+            "RowKey": rg_name.replace("/", "|"),
+            "rg": rg_name,
+            "rows": json.dumps([list(row) for row in rows_of_cost])
+        })
+
+    def clear(self, run_id):
+        for entity in self._table.query_entities("PartitionKey eq @pk", parameters={"pk": run_id}, select=["PartitionKey", "RowKey"]):
+            self._table.delete_entity(partition_key=entity["PartitionKey"], row_key=entity["RowKey"])
+
+    def purge_expired(self, saved_before):
+        # Timestamp is set by the service on every upsert
+        for entity in self._table.query_entities("Timestamp lt @before", parameters={"before": saved_before}, select=["PartitionKey", "RowKey"]):
+            self._table.delete_entity(partition_key=entity["PartitionKey"], row_key=entity["RowKey"])
+
+class RunCheckpoint:
+    # The checkpoint of one run, as used by get_rgs_cost
+
+    def __init__(self, store, run_id):
+        self.store = store
+        self.run_id = run_id
+        self._rows_by_rg = {rg: [cost_query.CostRow(*row) for row in rows] for rg, rows in store.get_rows_by_rg(run_id).items()}
+
+        if len(self._rows_by_rg) > 0:
+            logging.info(f"[INFO]: Resuming run {run_id}, {len(self._rows_by_rg)} RGs already fetched")
+
+    def get_rows(self, rg_name):
+        # None when the RG is not fetched yet
+        return self._rows_by_rg.get(str(rg_name).lower())
+
+    def save_rows(self, rg_name, rows_of_cost):
+        rows_of_cost = list(rows_of_cost)
+        self.store.save_rows(self.run_id, str(rg_name).lower(), rows_of_cost)
+        self._rows_by_rg[str(rg_name).lower()] = rows_of_cost
+
+    def clear(self):
+        self.store.clear(self.run_id)
+
+def get_ttl_secs():
+    # A run id only comes back within its day, so by default a checkpoint
+    # older than a day belongs to a run that was given up on
+    return int(os.environ.get("CHECKPOINT_TTL_SECS", "86400"))
+
+_checkpoint_store = None
+_checkpoint_store_lock = threading.Lock()
+_purged_at = None
+
+def get_checkpoint_store():
+    # CHECKPOINT_STORE_BACKEND: sqlite (default, local to the instance), table
+    # (survives a move to another instance) or none
+    global _checkpoint_store
+
+    with _checkpoint_store_lock:
+        if _checkpoint_store is None:
+            backend = os.environ.get("CHECKPOINT_STORE_BACKEND", BACKEND_SQLITE).lower()
+            if backend == BACKEND_SQLITE:
+                _checkpoint_store = SqliteCheckpointStore(os.environ.get("CHECKPOINT_STORE_PATH", os.path.join(tempfile.gettempdir(), "checkpoint_store.sqlite3")))
+            elif backend == BACKEND_TABLE:
+                _checkpoint_store = TableCheckpointStore(os.environ.get("CHECKPOINT_STORE_CONNECTION_STRING", os.environ.get("AzureWebJobsStorage")))
+            else:
+                return None
+        return _checkpoint_store
+
+def purge_expired(store, clock=time.time):
+    # At most once per TTL and worker, a failed purge is tried again next time
+    global _purged_at
+
+    ttl_secs = get_ttl_secs()
+    with _checkpoint_store_lock:
+        if _purged_at is not None and clock() - _purged_at < ttl_secs:
+            return
+        _purged_at = clock()
+
+    try:
+        store.purge_expired(datetime.now(timezone.utc) - timedelta(seconds=ttl_secs))
+    except Exception as e:
+        logging.error(f"[ERROR]: Could not purge the expired checkpoints: {e}")
+        with _checkpoint_store_lock:
+            _purged_at = None
+
+def get_run_checkpoint(scope, from_datetime, to_datetime, resource_groups):
+    # None when checkpoints are turned off
+    store = get_checkpoint_store()
+    if store is None:
+        return None
+    purge_expired(store)
+    return RunCheckpoint(store, get_run_id(scope, from_datetime, to_datetime, [rg.name for rg in resource_groups]))
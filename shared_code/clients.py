@@ -0,0 +1,196 @@
+import asyncio
+import threading
+import time
+
+import aiohttp
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.identity import DefaultAzureCredential
+from azure.identity.aio import DefaultAzureCredential as AioDefaultAzureCredential
+from azure.mgmt.costmanagement import CostManagementClient
+from azure.mgmt.costmanagement.aio import CostManagementClient as AioCostManagementClient
+from azure.mgmt.resource import ResourceManagementClient
+from azure.mgmt.resource.resources.aio import ResourceManagementClient as AioResourceManagementClient
+from azure.mgmt.resourcegraph import ResourceGraphClient
+from azure.mgmt.resourcegraph.aio import ResourceGraphClient as AioResourceGraphClient
+
+from shared_code import telemetry
+
+# Credential and clients kept at module level so warm invocations skip the
+# credential chain, reuse cached tokens and keep their HTTP connection pools.
+
+TOKEN_REFRESH_MARGIN_SECS = 300
+
+CREDENTIAL = "credential"
+COST_MGMT_CLIENT = "costMgmtClient"
+RESOURCE_MGMT_CLIENT = "resourceMgmtClient"
+RESOURCE_GRAPH_CLIENT = "resourceGraphClient"
+AIO_CREDENTIAL = "aioCredential"
+AIO_COST_MGMT_CLIENT = "aioCostMgmtClient"
+AIO_RESOURCE_MGMT_CLIENT = "aioResourceMgmtClient"
+AIO_RESOURCE_GRAPH_CLIENT = "aioResourceGraphClient"
+
+CREDENTIAL_OPTIONS = {
+    "exclude_environment_credential": True,
+    "exclude_powershell_credential": True,
+    "exclude_visual_studio_code_credential": True,
+    "exclude_shared_token_cache_credential": True,
+    "exclude_interactive_browser_credential": True,
+}
+
+class CachedTokenCredential:
+    # Serves the last token of each scope until TOKEN_REFRESH_MARGIN_SECS
+    # before it expires. Claims challenges always go to the credential.
+
+    def __init__(self, credential, clock=time.time):
+        self.credential = credential
+        self._clock = clock
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get_token(self, *scopes, **kwargs):
+        if kwargs.get("claims"):
+            return self.credential.get_token(*scopes, **kwargs)
+
+        key = (scopes, kwargs.get("tenant_id"))
+        with self._lock:
+            token = self._tokens.get(key)
+            if token is not None and token.expires_on - TOKEN_REFRESH_MARGIN_SECS > self._clock():
+                return token
+
+        with telemetry.phase(telemetry.PHASE_CREDENTIAL, scopes=list(scopes)):
+            token = self.credential.get_token(*scopes, **kwargs)
+        with self._lock:
+            self._tokens[key] = token
+        return token
+
+class AsyncCachedTokenCredential:
+    # Same as CachedTokenCredential for the azure.identity.aio credentials
+
+    def __init__(self, credential, clock=time.time):
+        self.credential = credential
+        self._clock = clock
+        self._tokens = {}
+
+    async def get_token(self, *scopes, **kwargs):
+        if kwargs.get("claims"):
+            return await self.credential.get_token(*scopes, **kwargs)
+
+        key = (scopes, kwargs.get("tenant_id"))
+        token = self._tokens.get(key)
+        if token is not None and token.expires_on - TOKEN_REFRESH_MARGIN_SECS > self._clock():
+            return token
+
+        with telemetry.phase(telemetry.PHASE_CREDENTIAL, scopes=list(scopes)):
+            token = await self.credential.get_token(*scopes, **kwargs)
+        self._tokens[key] = token
+        return token
+
+    async def close(self):
+        await self.credential.close()
+
+# Cost Management queries are retried by rate_limiter.query_usage, which
+# honours the throttling headers; the SDK's own retries would repeat every
+# attempt on top of it
+COST_MGMT_CLIENT_OPTIONS = {"retry_total": 0}
+
+# Factories building each pooled object. Tests swap them with set_factory,
+# e.g. set_factory(COST_MGMT_CLIENT, lambda credential: FakeCostClient()).
+_default_factories = {
+    CREDENTIAL: lambda: CachedTokenCredential(DefaultAzureCredential(**CREDENTIAL_OPTIONS)),
+    COST_MGMT_CLIENT: lambda credential: CostManagementClient(credential, 'https://management.azure.com', **COST_MGMT_CLIENT_OPTIONS),
+    RESOURCE_MGMT_CLIENT: lambda credential, subscription_id: ResourceManagementClient(credential, subscription_id),
+    RESOURCE_GRAPH_CLIENT: lambda credential: ResourceGraphClient(credential),
+    AIO_CREDENTIAL: lambda: AsyncCachedTokenCredential(AioDefaultAzureCredential(**CREDENTIAL_OPTIONS)),
+    AIO_COST_MGMT_CLIENT: lambda credential, transport: AioCostManagementClient(credential, 'https://management.azure.com', transport=transport, **COST_MGMT_CLIENT_OPTIONS),
+    AIO_RESOURCE_MGMT_CLIENT: lambda credential, subscription_id, transport: AioResourceManagementClient(credential, subscription_id, transport=transport),
+    AIO_RESOURCE_GRAPH_CLIENT: lambda credential, transport: AioResourceGraphClient(credential, transport=transport),
+}
+_factories = dict(_default_factories)
+
+_pool = {}
+_pool_lock = threading.RLock()
+
+# aiohttp sessions and aio clients belong to the event loop they were made on
+_aio_loop = None
+_aio_session = None
+
+def set_factory(name, factory):
+    with _pool_lock:
+        _factories[name] = factory
+        _pool.clear()
+
+def reset():
+    # Back to the real clients, dropping everything pooled
+    global _aio_loop, _aio_session
+
+    with _pool_lock:
+        _factories.clear()
+        _factories.update(_default_factories)
+        _pool.clear()
+        _aio_loop = None
+        _aio_session = None
+
+def _get_pooled(key, create):
+    with _pool_lock:
+        if key not in _pool:
+            _pool[key] = create()
+        return _pool[key]
+
+def get_credential():
+    return _get_pooled((CREDENTIAL,), lambda: _factories[CREDENTIAL]())
+
+def get_cost_mgmt_client():
+    return _get_pooled((COST_MGMT_CLIENT,), lambda: _factories[COST_MGMT_CLIENT](get_credential()))
+
+def get_resource_mgmt_client(subscription_id):
+    return _get_pooled((RESOURCE_MGMT_CLIENT, subscription_id), lambda: _factories[RESOURCE_MGMT_CLIENT](get_credential(), subscription_id))
+
+def get_resource_graph_client():
+    return _get_pooled((RESOURCE_GRAPH_CLIENT,), lambda: _factories[RESOURCE_GRAPH_CLIENT](get_credential()))
+
+def _get_aio_transport():
+    # One aiohttp session per event loop, shared by every aio client. Must be
+    # called from a coroutine.
+    global _aio_loop, _aio_session
+
+    loop = asyncio.get_running_loop()
+    with _pool_lock:
+        if _aio_loop is not loop:
+            for key in [key for key in _pool if key[0].startswith("aio")]:
+                del _pool[key]
+            _aio_loop = loop
+            _aio_session = None
+        if _aio_session is None:
+            _aio_session = aiohttp.ClientSession()
+        return AioHttpTransport(session=_aio_session, session_owner=False)
+
+async def close_aio_session():
+    # For scripts and tests running their own event loop; the function host
+    # keeps the session for the life of the worker
+    global _aio_loop, _aio_session
+
+    with _pool_lock:
+        session = _aio_session
+        for key in [key for key in _pool if key[0].startswith("aio")]:
+            del _pool[key]
+        _aio_loop = None
+        _aio_session = None
+
+    if session is not None:
+        await session.close()
+
+def get_aio_credential():
+    _get_aio_transport()
+    return _get_pooled((AIO_CREDENTIAL,), lambda: _factories[AIO_CREDENTIAL]())
+
+def get_aio_cost_mgmt_client():
+    transport = _get_aio_transport()
+    return _get_pooled((AIO_COST_MGMT_CLIENT,), lambda: _factories[AIO_COST_MGMT_CLIENT](get_aio_credential(), transport))
+
+def get_aio_resource_mgmt_client(subscription_id):
+    transport = _get_aio_transport()
+    return _get_pooled((AIO_RESOURCE_MGMT_CLIENT, subscription_id), lambda: _factories[AIO_RESOURCE_MGMT_CLIENT](get_aio_credential(), subscription_id, transport))
+
+def get_aio_resource_graph_client():
+    transport = _get_aio_transport()
+    return _get_pooled((AIO_RESOURCE_GRAPH_CLIENT,), lambda: _factories[AIO_RESOURCE_GRAPH_CLIENT](get_aio_credential(), transport))
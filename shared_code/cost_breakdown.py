@@ -0,0 +1,127 @@
+import logging
+import os
+from datetime import timedelta
+
+from shared_code import cost_store
+
+# Per-RG cost split by one more dimension (e.g. ServiceName, MeterCategory or
+# ResourceId), taken from the same subscription query as the RG totals: the
+# query groups by ResourceGroup and the dimension, the rows are summed back
+# per RG for the totals and accumulated per RG and dimension value for the
+# breakdown. Only the top COST_BREAKDOWN_TOP_N values of each RG are listed
+# per period, the rest is summed into "other".
+
+# Cost Management groups a query by at most two dimensions, ResourceGroup
+# being one of them
+MAX_BREAKDOWN_DIMENSIONS = 1
+
+OTHER = "other"
+# Rows without a value for the dimension
+UNASSIGNED = "unassigned"
+
+def get_breakdown_dimension():
+    # COST_BREAKDOWN_DIMENSION app setting, e.g. "ServiceName". None (no
+    # breakdown) when unset. Only the subscription query mode has a breakdown,
+    # the per-RG queries of resourceGroup mode are not grouped by it.
+    dimensions = [dimension.strip() for dimension in os.environ.get("COST_BREAKDOWN_DIMENSION", "").split(",") if dimension.strip()]
+    if len(dimensions) > MAX_BREAKDOWN_DIMENSIONS:
+        raise ValueError(f"COST_BREAKDOWN_DIMENSION takes one dimension, the query is already grouped by ResourceGroup: {', '.join(dimensions)}")
+    return dimensions[0] if dimensions else None
+
+def get_top_n():
+    return int(os.environ.get("COST_BREAKDOWN_TOP_N", "5"))
+
+def get_max_tracked():
+    # COST_BREAKDOWN_MAX_TRACKED, dimension values kept per RG while the rows
+    # stream in. Past that the cheapest half is folded into "other", which
+    # bounds the memory of high-cardinality dimensions such as ResourceId.
+    return int(os.environ.get("COST_BREAKDOWN_MAX_TRACKED", "100"))
+
+def get_period_windows(to_datetime, extra_windows=()):
+    # (first, last) usage date of each period, as in get_rgs_cost. daily is
+    # the weekly figure over 7 and is left out.
+    to_date = to_datetime.date()
+    last_date = cost_store.to_usage_date(to_date - timedelta(days=1))
+
+    period_windows = {"yesterday": (cost_store.to_usage_date(to_date), cost_store.to_usage_date(to_date))}
+    for period, period_num_days in [("weekly", 7), ("monthly", 30)] + [(f"last{extra_num_days}Days", extra_num_days) for extra_num_days in extra_windows]:
+        period_windows[period] = (cost_store.to_usage_date(to_date - timedelta(days=period_num_days)), last_date)
+
+    return period_windows
+
+class BreakdownAccumulator:
+    # Sums the cost of every (RG, dimension value) per period, one row at a
+    # time, without keeping the rows
+
+    def __init__(self, dimension, period_windows, top_n=None, max_tracked=None):
+        self.dimension = dimension
+        self.periods = list(period_windows.keys())
+        self.windows = list(period_windows.values())
+        self.top_n = get_top_n() if top_n is None else top_n
+        self.max_tracked = get_max_tracked() if max_tracked is None else max_tracked
+        # The longest window ranks the values when they are folded
+        self.rank_index = max(range(len(self.windows)), key=lambda i: self.windows[i][1] - self.windows[i][0])
+        self.costs_by_rg = {}
+
+    def add(self, rg_name, value, usage_date, cost):
+        period_indexes = [i for i, (from_date, to_date) in enumerate(self.windows) if from_date <= usage_date <= to_date]
+        if len(period_indexes) == 0:
+            return
+
+        rg_costs = self.costs_by_rg.setdefault(str(rg_name).lower(), {})
+        value = str(value) if value else UNASSIGNED
+
+        costs = rg_costs.get(value)
+        if costs is None:
+            if len(rg_costs) >= self.max_tracked:
+                self.fold(rg_costs)
+            costs = rg_costs.setdefault(value, [0.0] * len(self.windows))
+
+        for i in period_indexes:
+            costs[i] += float(cost)
+
+    def fold(self, rg_costs):
+        values = sorted([value for value in rg_costs if value != OTHER], key=lambda value: rg_costs[value][self.rank_index])
+        other_costs = rg_costs.setdefault(OTHER, [0.0] * len(self.windows))
+        for value in values[:len(values) // 2]:
+            for i, cost in enumerate(rg_costs.pop(value)):
+                other_costs[i] += cost
+
+    def get_breakdowns(self):
+        # {rg: {period: [{"name": value, "cost": cost}, ..., {"name": "other", "cost": cost}]}},
+        # most expensive first, zero costs left out
+        breakdowns = {}
+        for rg_name, rg_costs in self.costs_by_rg.items():
+            rg_breakdown = {}
+            for i, period in enumerate(self.periods):
+                values = sorted([value for value in rg_costs if value != OTHER and rg_costs[value][i] != 0], key=lambda value: rg_costs[value][i], reverse=True)
+                breakdown = [{"name": value, "cost": round(rg_costs[value][i], 2)} for value in values[:self.top_n]]
+                other_cost = sum(rg_costs[value][i] for value in values[self.top_n:]) + (rg_costs[OTHER][i] if OTHER in rg_costs else 0)
+                if round(other_cost, 2) != 0:
+                    breakdown.append({"name": OTHER, "cost": round(other_cost, 2)})
+                if len(breakdown) > 0:
+                    rg_breakdown[period] = breakdown
+            breakdowns[rg_name] = rg_breakdown
+        return breakdowns
+
+def new_accumulator(to_datetime, extra_windows=()):
+    # None when COST_BREAKDOWN_DIMENSION is not set
+    dimension = get_breakdown_dimension()
+    if dimension is None:
+        return None
+    return BreakdownAccumulator(dimension, get_period_windows(to_datetime, extra_windows))
+
+def log_ignored_dimension():
+    # For the resourceGroup query mode, so a configured dimension does not go
+    # missing from the output silently. Not validated, the run does not use it.
+    dimension = os.environ.get("COST_BREAKDOWN_DIMENSION", "").strip()
+    if dimension:
+        logging.warning(f"[WARNING]: COST_BREAKDOWN_DIMENSION {dimension} is ignored in resourceGroup query mode, set COST_QUERY_MODE to subscription for a breakdown")
+
+def add_breakdowns(cost_dicts, breakdown_by_rg):
+    # Nests each RG's breakdown in its entry of every period it has one for
+    for period, cost_dict in cost_dicts.items():
+        for rg_cost in cost_dict.get("resourceGroupCost", []):
+            breakdown = breakdown_by_rg.get(str(rg_cost["rgname"]).lower(), {}).get(period)
+            if breakdown is not None:
+                rg_cost["breakdown"] = breakdown
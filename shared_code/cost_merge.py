@@ -0,0 +1,121 @@
+PERIODS = ["yesterday", "daily", "weekly", "monthly"]
+
+# RGs whose cost could not be fetched, listed next to the periods
+FAILED_RESOURCE_GROUPS = "failedResourceGroups"
+
+# Per-RG projections and team daily series, see forecast.add_forecast
+FORECAST = "forecast"
+
+# Daily cost spikes of the RGs, see anomaly_detection
+ANOMALIES = "anomalies"
+
+# Team and RG budgets reached, see budget_alerts
+BUDGET_BREACHES = "budgetBreaches"
+
+def get_team_total_keys(cost_dict):
+    return [key for key in cost_dict.keys() if key.endswith("TotalCost")]
+
+def round_cost_dict(cost_dict):
+    team_total_keys = get_team_total_keys(cost_dict)
+
+    for key in team_total_keys:
+        cost_dict[key] = round(cost_dict[key],2)
+    cost_dict["totalCost"] = round(sum(cost_dict[key] for key in team_total_keys),2)
+
+    return cost_dict
+
+def get_periods(rgs_cost_dict):
+    return [key for key in rgs_cost_dict.keys() if key not in (FAILED_RESOURCE_GROUPS, FORECAST, ANOMALIES, BUDGET_BREACHES)]
+
+def merge_forecasts(forecast_dicts):
+    # Batches share the same window, their team series add up day by day
+    team_daily_cost = {}
+    for forecast_dict in forecast_dicts:
+        for cost_key, daily_cost in forecast_dict["teamDailyCost"].items():
+            team_daily_cost[cost_key] = [x + y for x, y in zip(team_daily_cost[cost_key], daily_cost)] if cost_key in team_daily_cost else list(daily_cost)
+
+    return {
+        "fromDate": forecast_dicts[0]["fromDate"],
+        "resourceGroupForecast": [rg_forecast for forecast_dict in forecast_dicts for rg_forecast in forecast_dict["resourceGroupForecast"]],
+        "teamDailyCost": team_daily_cost
+    }
+
+def merge_rgs_cost(batches_rgs_cost):
+    # Fan-in of the unrounded per-batch results returned by the cost activity.
+    # Team totals are summed before rounding, so the merged output matches a
+    # single activity walking every RG.
+
+    rgs_cost_dict = {}
+
+    for period in get_periods(batches_rgs_cost[0]):
+        period_cost_dict = None
+
+        for batch_rgs_cost in batches_rgs_cost:
+            batch_cost_dict = batch_rgs_cost[period]
+
+            if period_cost_dict is None:
+                period_cost_dict = dict(batch_cost_dict)
+                period_cost_dict["resourceGroupCost"] = list(batch_cost_dict["resourceGroupCost"])
+                continue
+
+            period_cost_dict["resourceGroupCost"].extend(batch_cost_dict["resourceGroupCost"])
+            for key in get_team_total_keys(batch_cost_dict):
+                period_cost_dict[key] = period_cost_dict.get(key, float(0)) + batch_cost_dict[key]
+
+        rgs_cost_dict[period] = round_cost_dict(period_cost_dict)
+
+    rgs_cost_dict[FAILED_RESOURCE_GROUPS] = [failed_rg for batch_rgs_cost in batches_rgs_cost for failed_rg in batch_rgs_cost.get(FAILED_RESOURCE_GROUPS, [])]
+    rgs_cost_dict[BUDGET_BREACHES] = [breach for batch_rgs_cost in batches_rgs_cost for breach in batch_rgs_cost.get(BUDGET_BREACHES, [])]
+    rgs_cost_dict[ANOMALIES] = sorted(
+        [anomaly for batch_rgs_cost in batches_rgs_cost for anomaly in batch_rgs_cost.get(ANOMALIES, [])],
+        key=lambda anomaly: (anomaly["date"], anomaly["zScore"]), reverse=True)
+
+    forecast_dicts = [batch_rgs_cost[FORECAST] for batch_rgs_cost in batches_rgs_cost if FORECAST in batch_rgs_cost]
+    if len(forecast_dicts) > 0:
+        rgs_cost_dict[FORECAST] = merge_forecasts(forecast_dicts)
+
+    return rgs_cost_dict
+
+def merge_subscriptions_rgs_cost(subscription_batches_rgs_cost):
+    # (subscription_id, unrounded result) pairs, several per subscription when
+    # batched. Merged like merge_rgs_cost, with each RG tagged with its
+    # subscription and the rounded team totals of every subscription.
+
+    batches_rgs_cost_by_subscription = {}
+    for subscription_id, batch_rgs_cost in subscription_batches_rgs_cost:
+        for period in get_periods(batch_rgs_cost):
+            for rg_cost in batch_rgs_cost[period]["resourceGroupCost"]:
+                rg_cost["subscriptionId"] = subscription_id
+        for failed_rg in batch_rgs_cost.get(FAILED_RESOURCE_GROUPS, []):
+            failed_rg["subscriptionId"] = subscription_id
+        for rg_forecast in batch_rgs_cost.get(FORECAST, {}).get("resourceGroupForecast", []):
+            rg_forecast["subscriptionId"] = subscription_id
+        for anomaly in batch_rgs_cost.get(ANOMALIES, []):
+            anomaly["subscriptionId"] = subscription_id
+        for breach in batch_rgs_cost.get(BUDGET_BREACHES, []):
+            breach["subscriptionId"] = subscription_id
+        batches_rgs_cost_by_subscription.setdefault(subscription_id, []).append(batch_rgs_cost)
+
+    rgs_cost_dict = merge_rgs_cost([batch_rgs_cost for _, batch_rgs_cost in subscription_batches_rgs_cost])
+
+    rgs_cost_dict["subscriptions"] = {}
+    for subscription_id, batches_rgs_cost in batches_rgs_cost_by_subscription.items():
+        subscription_rgs_cost = merge_rgs_cost(batches_rgs_cost)
+        rgs_cost_dict["subscriptions"][subscription_id] = {
+            period: {key: value for key, value in subscription_rgs_cost[period].items() if key != "resourceGroupCost"}
+            for period in get_periods(subscription_rgs_cost)
+        }
+
+    return rgs_cost_dict
+
+def get_estimation(monthly_cost_dict):
+    # Run rate of the last 30 days, for results without a forecast
+
+    estimation_cost_dict = {}
+    estimation_cost_dict["resourceGroupCost"] = list()
+
+    for key in get_team_total_keys(monthly_cost_dict):
+        estimation_cost_dict[key] = round(monthly_cost_dict[key] * 12, 2)
+    estimation_cost_dict["totalCost"] = round(monthly_cost_dict["totalCost"] * 12, 2)
+
+    return estimation_cost_dict
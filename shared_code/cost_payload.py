@@ -0,0 +1,147 @@
+import base64
+import gzip
+import json
+import os
+
+# Output formats of the cost dicts. "json" is the current shape, with one
+# {"rgname", "rgteam", "rgcost"} object per RG in every period. "columnar"
+# keeps the RG names and teams once and a cost array per period, and
+# "columnar+gzip" wraps that in base64 gzip. decode() turns any of them back
+# into the current shape, so consumers opt in by decoding.
+
+FORMAT_JSON = "json"
+FORMAT_COLUMNAR = "columnar"
+FORMAT_COLUMNAR_GZIP = "columnar+gzip"
+
+COLUMNAR_VERSION = 1
+
+def get_payload_format(requested_format=None):
+    # From the request or orchestration input, else COST_TRACKER_PAYLOAD_FORMAT
+    payload_format = (requested_format or os.environ.get("COST_TRACKER_PAYLOAD_FORMAT", FORMAT_JSON)).lower()
+    if payload_format not in (FORMAT_JSON, FORMAT_COLUMNAR, FORMAT_COLUMNAR_GZIP):
+        raise ValueError(f"Unknown payload format {payload_format}")
+    return payload_format
+
+def is_period(value):
+    return isinstance(value, dict) and isinstance(value.get("resourceGroupCost"), list)
+
+def to_columnar(rgs_cost_dict):
+    # Every period lists the same RGs in the same order; a period that does
+    # not (e.g. the empty estimation) keeps its resourceGroupCost as is
+
+    periods = [key for key, value in rgs_cost_dict.items() if is_period(value)]
+    reference_rg_costs = max([rgs_cost_dict[period]["resourceGroupCost"] for period in periods], key=len, default=[])
+
+    rg_names = [rg_cost["rgname"] for rg_cost in reference_rg_costs]
+    rg_teams = [rg_cost["rgteam"] for rg_cost in reference_rg_costs]
+    rg_subscription_ids = [rg_cost.get("subscriptionId") for rg_cost in reference_rg_costs]
+    has_subscription_ids = any(subscription_id is not None for subscription_id in rg_subscription_ids)
+    rg_keys = ["rgname", "rgteam", "rgcost", "subscriptionId"] if has_subscription_ids else ["rgname", "rgteam", "rgcost"]
+
+    columnar = {
+        "format": FORMAT_COLUMNAR,
+        "version": COLUMNAR_VERSION,
+        "keys": list(rgs_cost_dict.keys()),
+        "rgnames": rg_names,
+        "rgteams": rg_teams,
+        "periods": {},
+        "other": {}
+    }
+    if has_subscription_ids:
+        columnar["rgsubscriptionIds"] = rg_subscription_ids
+
+    for key, value in rgs_cost_dict.items():
+        if key not in periods:
+            columnar["other"][key] = value
+            continue
+
+        rg_costs = value["resourceGroupCost"]
+        period_columns = {field: field_value for field, field_value in value.items() if field != "resourceGroupCost"}
+
+        is_aligned = (
+            len(rg_costs) == len(rg_names) and len(rg_costs) > 0
+            and all(list(rg_cost.keys()) == rg_keys for rg_cost in rg_costs)
+            and [rg_cost["rgname"] for rg_cost in rg_costs] == rg_names
+            and [rg_cost["rgteam"] for rg_cost in rg_costs] == rg_teams
+            and (not has_subscription_ids or [rg_cost["subscriptionId"] for rg_cost in rg_costs] == rg_subscription_ids)
+        )
+        if is_aligned:
+            period_columns["rgcosts"] = [rg_cost["rgcost"] for rg_cost in rg_costs]
+        else:
+            period_columns["resourceGroupCost"] = rg_costs
+
+        # The position of resourceGroupCost among the period's fields
+        period_columns["fields"] = list(value.keys())
+        columnar["periods"][key] = period_columns
+
+    return columnar
+
+def from_columnar(columnar):
+    if columnar.get("version", COLUMNAR_VERSION) > COLUMNAR_VERSION:
+        raise ValueError(f"Unsupported columnar payload version {columnar['version']}")
+
+    rg_names = columnar["rgnames"]
+    rg_teams = columnar["rgteams"]
+    rg_subscription_ids = columnar.get("rgsubscriptionIds")
+
+    rgs_cost_dict = {}
+    for key in columnar["keys"]:
+        if key not in columnar["periods"]:
+            rgs_cost_dict[key] = columnar["other"][key]
+            continue
+
+        period_columns = columnar["periods"][key]
+
+        if "rgcosts" in period_columns:
+            rg_costs = []
+            for i, rg_cost in enumerate(period_columns["rgcosts"]):
+                rg_cost_dict = {"rgname": rg_names[i], "rgteam": rg_teams[i], "rgcost": rg_cost}
+                if rg_subscription_ids is not None:
+                    rg_cost_dict["subscriptionId"] = rg_subscription_ids[i]
+                rg_costs.append(rg_cost_dict)
+        else:
+            rg_costs = period_columns["resourceGroupCost"]
+
+        rgs_cost_dict[key] = {
+            field: rg_costs if field == "resourceGroupCost" else period_columns[field]
+            for field in period_columns["fields"]
+        }
+
+    return rgs_cost_dict
+
+def encode(rgs_cost_dict, payload_format=None):
+    # The dict to return or serialize, in payload_format
+    payload_format = get_payload_format(payload_format)
+
+    if payload_format == FORMAT_JSON:
+        return rgs_cost_dict
+
+    columnar = to_columnar(rgs_cost_dict)
+    if payload_format == FORMAT_COLUMNAR:
+        return columnar
+
+    compressed = gzip.compress(json.dumps(columnar, separators=(",", ":")).encode("utf-8"))
+    return {"format": FORMAT_COLUMNAR_GZIP, "version": COLUMNAR_VERSION, "data": base64.b64encode(compressed).decode("ascii")}
+
+def dumps(rgs_cost_dict, payload_format=None):
+    # json.dumps of the encoded payload, the json format is unchanged
+    payload = encode(rgs_cost_dict, payload_format)
+    if payload is rgs_cost_dict:
+        return json.dumps(rgs_cost_dict)
+    return json.dumps(payload, separators=(",", ":"))
+
+def decode(payload):
+    # Any payload (dict or JSON string) back to the current shape
+    if isinstance(payload, (str, bytes)):
+        payload = json.loads(payload)
+
+    payload_format = payload.get("format") if isinstance(payload, dict) else None
+
+    if payload_format == FORMAT_COLUMNAR_GZIP:
+        payload = json.loads(gzip.decompress(base64.b64decode(payload["data"])).decode("utf-8"))
+        payload_format = payload.get("format")
+
+    if payload_format == FORMAT_COLUMNAR:
+        return from_columnar(payload)
+
+    return payload
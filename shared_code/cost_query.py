@@ -0,0 +1,172 @@
+import logging
+import os
+from collections import namedtuple
+from urllib.parse import parse_qs, urlparse
+
+from azure.mgmt.costmanagement.models import (QueryDefinition, ExportType, TimeframeType, QueryTimePeriod, GranularityType, QueryDataset, QueryAggregation, QueryGrouping)
+
+from shared_code import cost_store
+from shared_code import rate_limiter as rl
+
+QUERY_MODE_RESOURCE_GROUP = "resourceGroup"
+QUERY_MODE_SUBSCRIPTION = "subscription"
+
+# One cost row, in the [PreTaxCost, UsageDate, ResourceGroup, Currency] layout
+# of cost_store so it still indexes like the raw rows
+CostRow = namedtuple("CostRow", ["cost", "usage_date", "resource_group", "currency"])
+
+DIMENSION_COLUMNS = {"usagedate": "usage_date", "resourcegroup": "resource_group", "currency": "currency"}
+
+def get_default_scope():
+    return os.environ.get("COST_TRACKER_SCOPE", "/subscriptions/edf6dd9d-7c4a-4bca-a997-945f3d60cf4e/resourceGroups/")
+
+def get_resource_groups_scope(subscription_id):
+    return f"/subscriptions/{subscription_id}/resourceGroups/"
+
+def is_resource_groups_scope(scope):
+    # /subscriptions/{id}/resourceGroups/, which the RG names are appended to
+    scope_parts = scope.split("/") if isinstance(scope, str) else []
+    return len(scope_parts) == 5 and scope_parts[0] == "" and scope_parts[1].lower() == "subscriptions" and scope_parts[2] != "" and scope_parts[3].lower() == "resourcegroups" and scope_parts[4] == ""
+
+def get_subscription_scope(scope):
+    return "/subscriptions/" + scope.split("/")[2]
+
+def get_query_definition(from_datetime, to_datetime, resource_group_names=None, breakdown_dimension=None):
+    # resource_group_names narrows the query server-side to a batch of RGs,
+    # breakdown_dimension adds a second grouping (see cost_breakdown)
+
+    query_filter = None
+    if resource_group_names is not None:
+        query_filter = {"dimensions": {"name": "ResourceGroup", "operator": "In", "values": list(resource_group_names)}}
+
+    query_dataset = QueryDataset(
+        granularity=GranularityType("Daily"),
+        aggregation={"totalCost" : QueryAggregation(name="PreTaxCost", function ="Sum")},
+        grouping=[QueryGrouping(type="Dimension", name=dimension) for dimension in ["ResourceGroup", breakdown_dimension] if dimension is not None],
+        filter=query_filter
+    )
+
+    query_def = QueryDefinition(
+        type=ExportType("Usage"),
+        timeframe=TimeframeType("Custom"),
+        time_period=QueryTimePeriod(from_property=from_datetime, to=to_datetime),
+        dataset=query_dataset
+    )
+
+    return query_def
+
+def get_column_indexes(columns, breakdown_dimension=None):
+    # Where each CostRow field sits in the result rows, the aggregated cost
+    # being the column that is not a dimension, and the breakdown dimension
+    # under "breakdown". Positional without columns.
+
+    column_indexes = {field: i for i, field in enumerate(CostRow._fields + ("breakdown",))}
+    if not columns:
+        return column_indexes
+
+    dimension_columns = dict(DIMENSION_COLUMNS)
+    if breakdown_dimension is not None:
+        dimension_columns[breakdown_dimension.lower()] = "breakdown"
+
+    for i, column in enumerate(columns):
+        column_name = column.get("name") if isinstance(column, dict) else getattr(column, "name", None)
+        column_indexes[dimension_columns.get(str(column_name).lower(), "cost")] = i
+
+    return column_indexes
+
+def to_cost_rows(query_result):
+    column_indexes = get_column_indexes(getattr(query_result, "columns", None))
+    cost_index, date_index, rg_index, currency_index = [column_indexes[field] for field in CostRow._fields]
+
+    return [
+        CostRow(row[cost_index], int(row[date_index]), row[rg_index], row[currency_index])
+        for row in query_result.rows or []
+    ]
+
+def to_breakdown_rows(query_result, breakdown_dimension):
+    # (CostRow, dimension value) pairs of a query grouped by breakdown_dimension
+    column_indexes = get_column_indexes(getattr(query_result, "columns", None), breakdown_dimension)
+    cost_index, date_index, rg_index, currency_index, breakdown_index = [column_indexes[field] for field in CostRow._fields + ("breakdown",)]
+
+    return [
+        (CostRow(row[cost_index], int(row[date_index]), row[rg_index], row[currency_index]), row[breakdown_index])
+        for row in query_result.rows or []
+    ]
+
+def get_skiptoken(next_link):
+    query_params = {key.lower(): values for key, values in parse_qs(urlparse(next_link).query).items()}
+    return query_params.get("$skiptoken", [None])[0]
+
+def iter_pages_of_cost(cost_mgmt_client, scope, query_def, rate_limiter=None, to_rows=None):
+    # Yields the CostRows (or to_rows of the result) of one result page at a
+    # time, following next_link until the last page, so large scopes are
+    # neither truncated nor held in memory as a whole
+
+    skiptoken = None
+    while True:
+        query_result = rl.query_usage(cost_mgmt_client, scope, query_def, rate_limiter or rl.get_shared_rate_limiter(), skiptoken)
+        yield (to_rows or to_cost_rows)(query_result)
+
+        next_link = getattr(query_result, "next_link", None)
+        skiptoken = get_skiptoken(next_link) if next_link else None
+        if skiptoken is None:
+            return
+
+def iter_rows_of_cost(cost_mgmt_client, scope, query_def, rate_limiter=None):
+    for page in iter_pages_of_cost(cost_mgmt_client, scope, query_def, rate_limiter):
+        yield from page
+
+def split_rows_of_cost_by_rg(rows_of_cost):
+    # Same per-RG row lists a per-RG query would return, ordered by day.
+    # rows_of_cost may be a generator over the result pages.
+
+    rows_of_cost_by_rg = {}
+    for row in rows_of_cost:
+        rows_of_cost_by_rg.setdefault(str(row[cost_store.RG_INDEX]).lower(), []).append(row)
+
+    for rg_rows_of_cost in rows_of_cost_by_rg.values():
+        rg_rows_of_cost.sort(key=lambda row: row[cost_store.DATE_INDEX])
+
+    logging.info(f"[INFO]: Subscription query returned cost rows for {len(rows_of_cost_by_rg)} RGs")
+
+    return rows_of_cost_by_rg
+
+def add_breakdown_rows(breakdown_rows, breakdown, costs):
+    # Feeds every row to breakdown (cost_breakdown.BreakdownAccumulator) and
+    # sums it over the dimension values into costs, keyed by (RG, day, currency)
+
+    for row, value in breakdown_rows:
+        breakdown.add(row[cost_store.RG_INDEX], value, row[cost_store.DATE_INDEX], row[cost_store.COST_INDEX])
+
+        key = (str(row[cost_store.RG_INDEX]).lower(), row[cost_store.DATE_INDEX], row[cost_store.CURRENCY_INDEX])
+        if key in costs:
+            costs[key][0] += float(row[cost_store.COST_INDEX])
+        else:
+            costs[key] = [float(row[cost_store.COST_INDEX]), row[cost_store.RG_INDEX]]
+
+def split_breakdown_costs_by_rg(costs):
+    # The summed costs as the per-RG rows of split_rows_of_cost_by_rg
+    return split_rows_of_cost_by_rg(CostRow(cost, usage_date, rg_name, currency) for (_, usage_date, currency), (cost, rg_name) in costs.items())
+
+def get_rows_of_cost_by_rg(subscription_scope, from_datetime, to_datetime, cost_mgmt_client, rate_limiter=None, resource_group_names=None, breakdown=None):
+    # One query for the whole subscription, grouped by ResourceGroup and day,
+    # split locally into per-RG rows. With a breakdown the same query is also
+    # grouped by its dimension and fills it.
+
+    if breakdown is not None:
+        # Not through cost_store, which keeps one row per RG, day and currency
+        query_def = get_query_definition(from_datetime, to_datetime, resource_group_names, breakdown.dimension)
+        pages = iter_pages_of_cost(cost_mgmt_client, subscription_scope, query_def, rate_limiter, lambda query_result: to_breakdown_rows(query_result, breakdown.dimension))
+        costs = {}
+        for page in pages:
+            add_breakdown_rows(page, breakdown, costs)
+        return split_breakdown_costs_by_rg(costs)
+
+    def query_rows_of_cost(query_from_datetime, query_to_datetime):
+        query_def = get_query_definition(query_from_datetime, query_to_datetime, resource_group_names)
+        return iter_rows_of_cost(cost_mgmt_client, subscription_scope, query_def, rate_limiter)
+
+    query_scope = cost_store.get_query_scope(subscription_scope, resource_group_names)
+    rows_of_cost = cost_store.get_rows_of_cost(query_scope, from_datetime, to_datetime, query_rows_of_cost)
+
+    return split_rows_of_cost_by_rg(rows_of_cost)
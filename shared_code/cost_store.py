@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+
+from shared_code import run_log as rlog
+
+# Rows are kept in the layout returned by the cost query:
+# [PreTaxCost, UsageDate (yyyymmdd), ResourceGroup, Currency]
+COST_INDEX = 0
+DATE_INDEX = 1
+RG_INDEX = 2
+CURRENCY_INDEX = 3
+
+BACKEND_NONE = "none"
+BACKEND_SQLITE = "sqlite"
+BACKEND_TABLE = "table"
+
+def to_usage_date(day):
+    return int(day.strftime("%Y%m%d"))
+
+def get_query_scope(scope, resource_group_names=None):
+    # Filtered (batched) queries get their own cache entry per RG set
+    if resource_group_names is None:
+        return scope
+    digest = hashlib.sha1(",".join(sorted(name.lower() for name in resource_group_names)).encode()).hexdigest()
+    return f"{scope}?resourceGroups={digest}"
+
+class SqliteCostStore:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # An RG can have rows in several currencies on one day. A store from
+        # before currency was part of the key is dropped, the days refill from
+        # the query.
+        cost_rows_key = [row[1] for row in self._conn.execute("PRAGMA table_info(cost_rows)").fetchall() if row[5] > 0]
+        if cost_rows_key and "currency" not in cost_rows_key:
+            self._conn.execute("DROP TABLE cost_rows")
+            self._conn.execute("DROP TABLE IF EXISTS fetched_days")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cost_rows (scope TEXT, rg TEXT, usage_date INTEGER, cost REAL, currency TEXT, PRIMARY KEY (scope, rg, usage_date, currency))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS fetched_days (scope TEXT, usage_date INTEGER, fetched_at TEXT, PRIMARY KEY (scope, usage_date))")
+        self._conn.commit()
+
+    def get_fetched_dates(self, scope, from_date, to_date):
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT usage_date FROM fetched_days WHERE scope = ? AND usage_date BETWEEN ? AND ?",
+                (scope, from_date, to_date))
+            return set(row[0] for row in cursor.fetchall())
+
+    def get_rows(self, scope, from_date, to_date):
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT cost, usage_date, rg, currency FROM cost_rows WHERE scope = ? AND usage_date BETWEEN ? AND ? ORDER BY usage_date, rg, currency",
+                (scope, from_date, to_date))
+            return [list(row) for row in cursor.fetchall()]
+
+    def replace_rows(self, scope, from_date, to_date, rows_of_cost):
+        fetched_at = datetime.now(timezone.utc).isoformat()
+        fetched_dates = _get_dates_between(from_date, to_date)
+
+        with self._lock:
+            self._conn.execute("DELETE FROM cost_rows WHERE scope = ? AND usage_date BETWEEN ? AND ?", (scope, from_date, to_date))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cost_rows VALUES (?, ?, ?, ?, ?)",
+                [(scope, row[RG_INDEX], int(row[DATE_INDEX]), row[COST_INDEX], row[CURRENCY_INDEX]) for row in rows_of_cost])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO fetched_days VALUES (?, ?, ?)",
+                [(scope, usage_date, fetched_at) for usage_date in fetched_dates])
+            self._conn.commit()
+
+class TableCostStore:
+    # Azure Table storage, one partition per query scope. Keys cannot hold "/".
+
+    def __init__(self, connection_string, table_prefix="costtracker"):
+        from azure.data.tables import TableServiceClient
+
+        table_service_client = TableServiceClient.from_connection_string(connection_string)
+        self._rows_table = table_service_client.create_table_if_not_exists(table_prefix + "rows")
+        self._days_table = table_service_client.create_table_if_not_exists(table_prefix + "days")
+
+    @staticmethod
+    def _partition_key(scope):
+        return scope.replace("/", "|").replace("?", "|")
+
+    def _query(self, table, scope, from_date, to_date):
+        return table.query_entities(
+            "PartitionKey eq @pk and RowKey ge @from_key and RowKey lt @to_key",
+            parameters={"pk": self._partition_key(scope), "from_key": str(from_date), "to_key": str(to_date + 1)})
+
+    def get_fetched_dates(self, scope, from_date, to_date):
+        return set(int(entity["RowKey"]) for entity in self._query(self._days_table, scope, from_date, to_date))
+
+    def get_rows(self, scope, from_date, to_date):
+        rows_of_cost = [[entity["cost"], int(entity["usageDate"]), entity["rg"], entity["currency"]] for entity in self._query(self._rows_table, scope, from_date, to_date)]
+        return sorted(rows_of_cost, key=lambda row: (row[DATE_INDEX], row[RG_INDEX], row[CURRENCY_INDEX]))
+
+    def replace_rows(self, scope, from_date, to_date, rows_of_cost):
+        # Batched in transactions of TABLE_TRANSACTION_SIZE entities, each row
+        # only written once: the rows are upserted and the stored rows of the
+        # window that are not among them deleted
+        partition_key = self._partition_key(scope)
+        fetched_at = datetime.now(timezone.utc).isoformat()
+
+        entities = {}
+        for row in rows_of_cost:
+            row_key = f"{int(row[DATE_INDEX])}|{row[RG_INDEX]}|{row[CURRENCY_INDEX]}".replace("/", "|")
+            entities[row_key] = {
+                "PartitionKey": partition_key,
+                "RowKey": row_key,
+                "rg": row[RG_INDEX],
+                "usageDate": int(row[DATE_INDEX]),
+                "cost": float(row[COST_INDEX]),
+                "currency": row[CURRENCY_INDEX]
+            }
+
+        operations = [
+            ("delete", {"PartitionKey": entity["PartitionKey"], "RowKey": entity["RowKey"]})
+            for entity in self._query(self._rows_table, scope, from_date, to_date)
+            if entity["RowKey"] not in entities
+        ]
+        operations += [("upsert", entity) for entity in entities.values()]
+        _submit_transactions(self._rows_table, operations)
+
+        _submit_transactions(self._days_table, [
+            ("upsert", {"PartitionKey": partition_key, "RowKey": str(usage_date), "fetchedAt": fetched_at})
+            for usage_date in _get_dates_between(from_date, to_date)
+        ])
+
+# Entities per Table storage transaction, all of the same partition
+TABLE_TRANSACTION_SIZE = 100
+
+def _submit_transactions(table, operations):
+    for i in range(0, len(operations), TABLE_TRANSACTION_SIZE):
+        table.submit_transaction(operations[i:i + TABLE_TRANSACTION_SIZE])
+
+def _get_dates_between(from_date, to_date):
+    from_day = datetime.strptime(str(from_date), "%Y%m%d")
+    to_day = datetime.strptime(str(to_date), "%Y%m%d")
+    return [to_usage_date(from_day + timedelta(days=x)) for x in range((to_day - from_day).days + 1)]
+
+_cost_store = None
+_cost_store_lock = threading.Lock()
+
+def get_cost_store():
+    # COST_STORE_BACKEND: none (default), sqlite or table
+    global _cost_store
+
+    with _cost_store_lock:
+        if _cost_store is None:
+            backend = os.environ.get("COST_STORE_BACKEND", BACKEND_NONE).lower()
+            if backend == BACKEND_SQLITE:
+                _cost_store = SqliteCostStore(os.environ.get("COST_STORE_PATH", os.path.join(tempfile.gettempdir(), "cost_store.sqlite3")))
+            elif backend == BACKEND_TABLE:
+                _cost_store = TableCostStore(os.environ.get("COST_STORE_CONNECTION_STRING", os.environ.get("AzureWebJobsStorage")))
+            else:
+                return None
+        return _cost_store
+
+def get_settling_days():
+    return int(os.environ.get("COST_STORE_SETTLING_DAYS", "3"))
+
+def get_query_from_datetime(store, query_scope, from_datetime, to_datetime, settling_days):
+    # Earliest day that is missing from the store or still settling, None when
+    # the whole window can be served from the store
+
+    from_date = to_usage_date(from_datetime)
+    to_date = to_usage_date(to_datetime)
+    settled_to_date = to_usage_date(to_datetime - timedelta(days=settling_days))
+
+    fetched_dates = store.get_fetched_dates(query_scope, from_date, to_date)
+    window_dates = _get_dates_between(from_date, to_date)
+    dates_to_query = [usage_date for usage_date in window_dates if usage_date not in fetched_dates or usage_date > settled_to_date]
+
+    if len(dates_to_query) == 0:
+        return None
+    if dates_to_query[0] == from_date:
+        return from_datetime
+    return datetime.strptime(str(dates_to_query[0]), "%Y%m%d").replace(tzinfo = from_datetime.tzinfo)
+
+def get_rows_of_cost(query_scope, from_datetime, to_datetime, query_rows_of_cost, store=None, settling_days=None):
+    # query_rows_of_cost(from_datetime, to_datetime) runs the actual cost query.
+    # Without a configured store every call goes straight to the query, and
+    # whatever it returns (e.g. a generator over the result pages) is passed on.
+
+    store = store or get_cost_store()
+    if store is None:
+        return query_rows_of_cost(from_datetime, to_datetime)
+
+    settling_days = get_settling_days() if settling_days is None else settling_days
+    query_from_datetime = get_query_from_datetime(store, query_scope, from_datetime, to_datetime, settling_days)
+
+    if query_from_datetime is not None:
+        logging.log(rlog.get_detail_level(), f"[INFO]: Querying cost from {query_from_datetime.date()} to {to_datetime.date()} for {query_scope}")
+        rows_of_cost = list(query_rows_of_cost(query_from_datetime, to_datetime))
+        store.replace_rows(query_scope, to_usage_date(query_from_datetime), to_usage_date(to_datetime), rows_of_cost)
+
+    return store.get_rows(query_scope, to_usage_date(from_datetime), to_usage_date(to_datetime))
+
+async def get_rows_of_cost_async(query_scope, from_datetime, to_datetime, query_rows_of_cost_async, store=None, settling_days=None):
+    # Same as get_rows_of_cost with an awaitable query. The store calls are
+    # blocking, they run off the event loop so the other queries go on.
+
+    store = store or await asyncio.to_thread(get_cost_store)
+    if store is None:
+        return await query_rows_of_cost_async(from_datetime, to_datetime)
+
+    settling_days = get_settling_days() if settling_days is None else settling_days
+    query_from_datetime = await asyncio.to_thread(get_query_from_datetime, store, query_scope, from_datetime, to_datetime, settling_days)
+
+    if query_from_datetime is not None:
+        logging.log(rlog.get_detail_level(), f"[INFO]: Querying cost from {query_from_datetime.date()} to {to_datetime.date()} for {query_scope}")
+        rows_of_cost = await query_rows_of_cost_async(query_from_datetime, to_datetime)
+        await asyncio.to_thread(store.replace_rows, query_scope, to_usage_date(query_from_datetime), to_usage_date(to_datetime), rows_of_cost)
+
+    return await asyncio.to_thread(store.get_rows, query_scope, to_usage_date(from_datetime), to_usage_date(to_datetime))
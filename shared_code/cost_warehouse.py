@@ -0,0 +1,223 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+from shared_code import cost_store
+
+# Historical per-RG daily cost, appended by every run and queried from disk
+# without any Cost Management call. daily_cost is clustered by usage date, so
+# a date range is one contiguous scan; monthly_cost holds the same rows
+# summed per month and RG, rebuilt for the months a run touches. A query over
+# a long range reads the whole months from monthly_cost and only the partial
+# months at either end from daily_cost.
+
+BACKEND_NONE = "none"
+BACKEND_SQLITE = "sqlite"
+
+GROUP_BY_SUBSCRIPTION = "subscription"
+GROUP_BY_RG = "rg"
+GROUP_BY_TEAM = "team"
+GROUP_BY_YEAR = "year"
+GROUP_BY_MONTH = "month"
+GROUP_BY_DAY = "day"
+
+# Column of each group-by in daily_cost and monthly_cost
+DAILY_COLUMNS = {
+    GROUP_BY_SUBSCRIPTION: "subscription_id",
+    GROUP_BY_RG: "rg",
+    GROUP_BY_TEAM: "team",
+    GROUP_BY_YEAR: "usage_date / 10000",
+    GROUP_BY_MONTH: "usage_date / 100",
+    GROUP_BY_DAY: "usage_date"
+}
+MONTHLY_COLUMNS = {
+    GROUP_BY_SUBSCRIPTION: "subscription_id",
+    GROUP_BY_RG: "rg",
+    GROUP_BY_TEAM: "team",
+    GROUP_BY_YEAR: "usage_month / 100",
+    GROUP_BY_MONTH: "usage_month"
+}
+
+def get_subscription_id(scope):
+    # "" for scopes outside a subscription
+    scope_parts = scope.split("/")
+    if len(scope_parts) > 2 and scope_parts[1].lower() == "subscriptions":
+        return scope_parts[2]
+    return ""
+
+def to_usage_date(day):
+    # A date, datetime, "yyyy-mm-dd" or yyyymmdd
+    if isinstance(day, (date, datetime)):
+        return cost_store.to_usage_date(day)
+    day = str(day)
+    if "-" in day:
+        return cost_store.to_usage_date(datetime.strptime(day, "%Y-%m-%d"))
+    return int(day)
+
+def get_month_ranges(from_date, to_date):
+    # (whole months as yyyymm, partial days as yyyymmdd ranges) of a range
+    from_day = datetime.strptime(str(from_date), "%Y%m%d").date()
+    to_day = datetime.strptime(str(to_date), "%Y%m%d").date()
+
+    first_whole_month = from_day if from_day.day == 1 else (from_day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    next_day = to_day + timedelta(days=1)
+    end_whole_month = to_day.replace(day=1) if next_day.day != 1 else next_day
+
+    if first_whole_month >= end_whole_month:
+        return None, [(from_date, to_date)]
+
+    last_whole_month = end_whole_month - timedelta(days=1)
+    day_ranges = []
+    if from_day < first_whole_month:
+        day_ranges.append((from_date, cost_store.to_usage_date(first_whole_month - timedelta(days=1))))
+    if end_whole_month <= to_day:
+        day_ranges.append((cost_store.to_usage_date(end_whole_month), to_date))
+
+    month_range = (first_whole_month.year * 100 + first_whole_month.month, last_whole_month.year * 100 + last_whole_month.month)
+    return month_range, day_ranges
+
+def _get_in_filter(column, values):
+    return f"lower({column}) IN ({', '.join('?' for _ in values)})", [str(value).lower() for value in values]
+
+class SqliteCostWarehouse:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Several function hosts may share the file, writers wait on each other
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS daily_cost (usage_date INTEGER, subscription_id TEXT, rg TEXT, currency TEXT, team TEXT, cost REAL, loaded_at TEXT, "
+            "PRIMARY KEY (usage_date, subscription_id, rg, currency)) WITHOUT ROWID")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS monthly_cost (usage_month INTEGER, subscription_id TEXT, rg TEXT, currency TEXT, team TEXT, cost REAL, "
+            "PRIMARY KEY (usage_month, subscription_id, rg, currency, team)) WITHOUT ROWID")
+        self._conn.commit()
+
+    def append_rows(self, subscription_id, from_date, to_date, rg_names, teams, rows_of_cost_list):
+        # Replaces the from_date to to_date rows of the given RGs, a rerun of
+        # the same window (e.g. while the costs settle) overwrites its days
+        loaded_at = datetime.now(timezone.utc).isoformat()
+
+        daily_rows = {}
+        for rg_name, team, rows_of_cost in zip(rg_names, teams, rows_of_cost_list):
+            rg_name = str(rg_name).lower()
+            for row in rows_of_cost:
+                usage_date = int(row[cost_store.DATE_INDEX])
+                if from_date <= usage_date <= to_date:
+                    key = (usage_date, subscription_id, rg_name, row[cost_store.CURRENCY_INDEX])
+                    cost = daily_rows[key][1] if key in daily_rows else 0.0
+                    daily_rows[key] = (team, cost + float(row[cost_store.COST_INDEX]))
+
+        with self._lock:
+            with self._conn:
+                self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS loaded_rgs (rg TEXT PRIMARY KEY)")
+                self._conn.execute("DELETE FROM loaded_rgs")
+                self._conn.executemany("INSERT OR IGNORE INTO loaded_rgs VALUES (?)", [(str(rg_name).lower(),) for rg_name in rg_names])
+
+                self._conn.execute(
+                    "DELETE FROM daily_cost WHERE usage_date BETWEEN ? AND ? AND subscription_id = ? AND rg IN (SELECT rg FROM loaded_rgs)",
+                    (from_date, to_date, subscription_id))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO daily_cost VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(*key, team, cost, loaded_at) for key, (team, cost) in daily_rows.items()])
+
+                from_month, to_month = from_date // 100, to_date // 100
+                self._conn.execute(
+                    "DELETE FROM monthly_cost WHERE usage_month BETWEEN ? AND ? AND subscription_id = ?",
+                    (from_month, to_month, subscription_id))
+                self._conn.execute(
+                    "INSERT INTO monthly_cost SELECT usage_date / 100, subscription_id, rg, currency, team, SUM(cost) FROM daily_cost "
+                    "WHERE usage_date BETWEEN ? AND ? AND subscription_id = ? GROUP BY usage_date / 100, subscription_id, rg, currency, team",
+                    (from_month * 100 + 1, to_month * 100 + 31, subscription_id))
+
+        return len(daily_rows)
+
+    def query_cost(self, from_date, to_date, group_by=(GROUP_BY_TEAM,), teams=None, resource_groups=None, subscription_ids=None):
+        # Cost between from_date and to_date (inclusive, any form taken by
+        # to_usage_date) summed per group_by and currency, e.g.
+        #   query_cost("2026-07-01", "2026-09-30", ["team", "month"], teams=["AI"])
+        # returns [{"team": "AI", "month": 202607, "currency": "USD", "cost": 1234.56}, ...]
+
+        from_date, to_date = to_usage_date(from_date), to_usage_date(to_date)
+        group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+        for dimension in group_by:
+            if dimension not in DAILY_COLUMNS:
+                raise ValueError(f"Unknown group by {dimension}, expected one of {', '.join(DAILY_COLUMNS)}")
+        if from_date > to_date:
+            raise ValueError(f"From date {from_date} is after to date {to_date}")
+
+        filters, filter_params = [], []
+        for column, values in [("team", teams), ("rg", resource_groups), ("subscription_id", subscription_ids)]:
+            if values:
+                in_filter, in_params = _get_in_filter(column, values)
+                filters.append(in_filter)
+                filter_params.extend(in_params)
+
+        # Daily grouping needs the daily rows, anything else reads whole months
+        # from monthly_cost
+        if GROUP_BY_DAY in group_by:
+            month_range, day_ranges = None, [(from_date, to_date)]
+        else:
+            month_range, day_ranges = get_month_ranges(from_date, to_date)
+
+        selects, params = [], []
+        for day_from, day_to in day_ranges:
+            columns = [f"{DAILY_COLUMNS[dimension]} AS d{i}" for i, dimension in enumerate(group_by)]
+            selects.append(f"SELECT {', '.join(columns + ['currency', 'cost'])} FROM daily_cost WHERE {' AND '.join(['usage_date BETWEEN ? AND ?'] + filters)}")
+            params.extend([day_from, day_to] + filter_params)
+        if month_range is not None:
+            columns = [f"{MONTHLY_COLUMNS[dimension]} AS d{i}" for i, dimension in enumerate(group_by)]
+            selects.append(f"SELECT {', '.join(columns + ['currency', 'cost'])} FROM monthly_cost WHERE {' AND '.join(['usage_month BETWEEN ? AND ?'] + filters)}")
+            params.extend(list(month_range) + filter_params)
+
+        group_columns = [f"d{i}" for i in range(len(group_by))] + ["currency"]
+        sql = f"SELECT {', '.join(group_columns)}, SUM(cost) FROM ({' UNION ALL '.join(selects)}) GROUP BY {', '.join(group_columns)} ORDER BY {', '.join(group_columns)}"
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        return [
+            {**dict(zip(group_by, row[:len(group_by)])), "currency": row[len(group_by)], "cost": round(row[-1], 2)}
+            for row in rows
+        ]
+
+    def get_date_range(self):
+        # First and last usage dates held, None when empty
+        with self._lock:
+            return self._conn.execute("SELECT MIN(usage_date), MAX(usage_date) FROM daily_cost").fetchone()
+
+_cost_warehouse = None
+_cost_warehouse_lock = threading.Lock()
+
+def get_cost_warehouse():
+    # COST_WAREHOUSE_BACKEND: none (default) or sqlite, at COST_WAREHOUSE_PATH.
+    # The default path is local to the instance, point it at a mounted share
+    # to keep the history across instances.
+    global _cost_warehouse
+
+    with _cost_warehouse_lock:
+        if _cost_warehouse is None:
+            backend = os.environ.get("COST_WAREHOUSE_BACKEND", BACKEND_NONE).lower()
+            if backend == BACKEND_SQLITE:
+                _cost_warehouse = SqliteCostWarehouse(os.environ.get("COST_WAREHOUSE_PATH", os.path.join(tempfile.gettempdir(), "cost_warehouse.sqlite3")))
+            else:
+                return None
+        return _cost_warehouse
+
+def append_run(scope, from_datetime, to_datetime, rg_names, teams, rows_of_cost_list, warehouse=None):
+    # The rows of one run, never failing it: the totals are returned either way
+    warehouse = warehouse or get_cost_warehouse()
+    if warehouse is None:
+        return
+
+    try:
+        num_rows = warehouse.append_rows(get_subscription_id(scope), to_usage_date(from_datetime), to_usage_date(to_datetime), rg_names, teams, rows_of_cost_list)
+        logging.info(f"[INFO]: Appended {num_rows} daily cost rows of {len(rg_names)} RGs to the cost warehouse")
+    except Exception as e:
+        logging.error(f"[ERROR]: Could not append the cost rows to the cost warehouse: {e}")
@@ -0,0 +1,217 @@
+import os
+from datetime import date, timedelta
+from statistics import NormalDist
+
+import numpy as np
+
+from shared_code import cost_merge
+
+# Projections of the daily cost series, fitted on every series at once.
+# Each series (one per RG, one per team) gets the better, by AIC, of:
+#   linear   cost = a + b * day
+#   weekday  cost = a + b * day + one offset per weekday
+# The trend is damped past the last observed day, so a steep month does not
+# run away over a year, and negative days are clamped to zero. Intervals come
+# from the residual variance plus the uncertainty of the fitted trend.
+
+MODEL_LINEAR = "linear"
+MODEL_WEEKDAY = "weekday"
+MODELS = [MODEL_LINEAR, MODEL_WEEKDAY]
+
+# Days projected by the estimation, formerly the monthly cost x 12
+ANNUAL_DAYS = 365
+
+def get_trend_damping():
+    # COST_FORECAST_TREND_DAMPING, share of the daily trend kept from one
+    # projected day to the next
+    return float(os.environ.get("COST_FORECAST_TREND_DAMPING", "0.98"))
+
+def get_interval_z():
+    # COST_FORECAST_INTERVAL, coverage of the low/high bounds
+    return NormalDist().inv_cdf(0.5 + float(os.environ.get("COST_FORECAST_INTERVAL", "0.9")) / 2)
+
+def get_design_matrix(model, days, weekdays):
+    columns = [np.ones(len(days)), days]
+    if model == MODEL_WEEKDAY:
+        # Monday is the baseline
+        columns += [(weekdays == weekday).astype(float) for weekday in range(1, 7)]
+    return np.column_stack(columns)
+
+def get_horizons(as_of_date):
+    # Projected days per horizon, counted from the day after as_of_date: the
+    # rest of the month of that day, the rest of its year and a full year
+    first_day = as_of_date + timedelta(days=1)
+    next_month = (first_day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return {
+        "monthEnd": (next_month - first_day).days,
+        "restOfYear": (date(first_day.year + 1, 1, 1) - first_day).days,
+        "annual": ANNUAL_DAYS
+    }
+
+def fit_series(series, from_date, damping=None, interval_z=None):
+    # series: rows of daily costs starting at from_date, the last column being
+    # the last observed day. Returns the chosen model of each row and, per
+    # horizon, the projected cost and its low/high bounds (each an array with
+    # one value per row). monthEnd includes the observed days of that month.
+    # None when there is no row or too few days to fit even a line.
+
+    series = np.asarray(series, dtype=float)
+    damping = get_trend_damping() if damping is None else damping
+    interval_z = get_interval_z() if interval_z is None else interval_z
+
+    num_series, num_days = series.shape
+    if num_series == 0:
+        return None
+    as_of_date = from_date + timedelta(days=num_days - 1)
+    horizons = get_horizons(as_of_date)
+    num_future_days = max(horizons.values())
+
+    days = np.arange(num_days, dtype=float)
+    weekdays = np.array([(from_date + timedelta(days=day)).weekday() for day in range(num_days)])
+    future_weekdays = np.array([(as_of_date + timedelta(days=day)).weekday() for day in range(1, num_future_days + 1)])
+    # Damped trend: day n-1+h projects as n-1 + damping + ... + damping^h
+    future_days = (num_days - 1) + np.cumsum(damping ** np.arange(1, num_future_days + 1))
+
+    fits = {}
+    for model in MODELS:
+        design = get_design_matrix(model, days, weekdays)
+        num_params = design.shape[1]
+        if num_days <= num_params:
+            # Too short a series for weekday offsets
+            fits[model] = (np.full(num_series, np.inf), None)
+            continue
+
+        # One least squares solve for every series
+        xtx_inv = np.linalg.pinv(design.T @ design)
+        coefficients = series @ (design @ xtx_inv)
+        residuals = series - coefficients @ design.T
+        rss = np.einsum("ij,ij->i", residuals, residuals)
+        variance = rss / (num_days - num_params)
+
+        future_design = get_design_matrix(model, future_days, future_weekdays)
+        projected_days = np.maximum(coefficients @ future_design.T, 0)
+
+        horizon_fits = {}
+        for horizon, horizon_days in horizons.items():
+            # Var(sum) = variance * (days + v' (X'X)^-1 v), v the summed design rows
+            summed_design = future_design[:horizon_days].sum(axis=0)
+            variance_factor = horizon_days + summed_design @ xtx_inv @ summed_design
+            horizon_fits[horizon] = (projected_days[:, :horizon_days].sum(axis=1), variance * variance_factor)
+
+        aic = num_days * np.log(np.maximum(rss, 1e-12) / num_days) + 2 * num_params
+        fits[model] = (aic, horizon_fits)
+
+    if fits[MODEL_LINEAR][1] is None:
+        return None
+
+    # Per series, the weekday model only where it earns its extra parameters
+    use_weekday = fits[MODEL_WEEKDAY][0] < fits[MODEL_LINEAR][0]
+    models = np.where(use_weekday, MODEL_WEEKDAY, MODEL_LINEAR)
+    weekday_fits = fits[MODEL_WEEKDAY][1] or fits[MODEL_LINEAR][1]
+
+    # Observed days of the month of the first projected day
+    first_day = as_of_date + timedelta(days=1)
+    month_days = max(0, (as_of_date - first_day.replace(day=1)).days + 1)
+    month_to_date = series[:, num_days - month_days:].sum(axis=1) if month_days > 0 else np.zeros(num_series)
+
+    projections = {"asOfDate": as_of_date, "models": models, "monthToDate": month_to_date}
+    for horizon in horizons:
+        cost = np.where(use_weekday, weekday_fits[horizon][0], fits[MODEL_LINEAR][1][horizon][0])
+        variance = np.where(use_weekday, weekday_fits[horizon][1], fits[MODEL_LINEAR][1][horizon][1])
+        if horizon == "monthEnd":
+            cost = cost + month_to_date
+        margin = interval_z * np.sqrt(variance)
+        projections[horizon] = (cost, np.maximum(cost - margin, 0), cost + margin, variance)
+
+    return projections
+
+def get_projection_dict(projections, i):
+    projection_dict = {"model": str(projections["models"][i])}
+    for horizon in ["monthEnd", "restOfYear", "annual"]:
+        cost, low, high, _ = projections[horizon]
+        projection_dict[f"{horizon}Cost"] = round(float(cost[i]), 2)
+        projection_dict[f"{horizon}Low"] = round(float(low[i]), 2)
+        projection_dict[f"{horizon}High"] = round(float(high[i]), 2)
+    return projection_dict
+
+def get_rgs_forecast(cost_matrix, from_date, rg_names, teams, team_indexes, cost_keys):
+    # The forecast part of get_rgs_cost's result: the per-RG projections and
+    # the daily series of each team, summed across batches by cost_merge and
+    # fitted by add_forecast
+
+    # Yesterday is still settling, the series end the day before like the
+    # weekly and monthly figures
+    series = cost_matrix[:, :-1]
+
+    resource_group_forecast = []
+    projections = fit_series(series, from_date)
+    if projections is not None:
+        for i in range(len(rg_names)):
+            resource_group_forecast.append({"rgname": rg_names[i], "rgteam": teams[i], **get_projection_dict(projections, i)})
+
+    team_daily_cost = np.zeros((len(cost_keys), series.shape[1]))
+    tracked = team_indexes >= 0
+    np.add.at(team_daily_cost, team_indexes[tracked], series[tracked])
+
+    return {
+        "fromDate": str(from_date),
+        "resourceGroupForecast": resource_group_forecast,
+        "teamDailyCost": {cost_key: team_daily_cost[i].tolist() for i, cost_key in enumerate(cost_keys)}
+    }
+
+def add_forecast(rgs_cost_dict):
+    # Fits the team series of a (merged) result and fills its forecast and
+    # estimation. The team daily series are dropped from the result. Without
+    # a team or enough days the forecast is left empty and the estimation is
+    # the monthly cost x 12.
+
+    forecast_dict = rgs_cost_dict.get(cost_merge.FORECAST)
+    if forecast_dict is None:
+        rgs_cost_dict["estimation"] = cost_merge.get_estimation(rgs_cost_dict["monthly"])
+        return rgs_cost_dict
+
+    team_daily_cost = forecast_dict.pop("teamDailyCost")
+    from_date = date.fromisoformat(forecast_dict["fromDate"])
+    cost_keys = list(team_daily_cost.keys())
+
+    num_days = len(next(iter(team_daily_cost.values()), []))
+    team_series = np.array([team_daily_cost[cost_key] for cost_key in cost_keys]).reshape(len(cost_keys), num_days)
+    projections = fit_series(team_series, from_date)
+
+    if projections is None:
+        forecast_dict["teams"] = {}
+        forecast_dict["totalCost"] = {}
+        rgs_cost_dict["estimation"] = cost_merge.get_estimation(rgs_cost_dict["monthly"])
+        rgs_cost_dict[cost_merge.FORECAST] = rgs_cost_dict.pop(cost_merge.FORECAST)
+        return rgs_cost_dict
+
+    forecast_dict["asOfDate"] = str(projections["asOfDate"])
+    forecast_dict["teams"] = {cost_key: get_projection_dict(projections, i) for i, cost_key in enumerate(cost_keys)}
+
+    # Team sums, the bounds assuming independent teams
+    total_dict = {}
+    for horizon in ["monthEnd", "restOfYear", "annual"]:
+        cost, _, _, variance = projections[horizon]
+        margin = get_interval_z() * np.sqrt(variance.sum())
+        total_dict[f"{horizon}Cost"] = round(float(cost.sum()), 2)
+        total_dict[f"{horizon}Low"] = round(max(float(cost.sum() - margin), 0), 2)
+        total_dict[f"{horizon}High"] = round(float(cost.sum() + margin), 2)
+    forecast_dict["totalCost"] = total_dict
+
+    # Next year's cost, in the shape of the periods
+    estimation_cost_dict = {}
+    estimation_cost_dict["resourceGroupCost"] = list()
+    for rg_forecast in forecast_dict["resourceGroupForecast"]:
+        rg_cost_dict = {"rgname": rg_forecast["rgname"], "rgteam": rg_forecast["rgteam"], "rgcost": rg_forecast["annualCost"]}
+        if "subscriptionId" in rg_forecast:
+            rg_cost_dict["subscriptionId"] = rg_forecast["subscriptionId"]
+        estimation_cost_dict["resourceGroupCost"].append(rg_cost_dict)
+    for cost_key in cost_keys:
+        estimation_cost_dict[cost_key] = forecast_dict["teams"][cost_key]["annualCost"]
+    cost_merge.round_cost_dict(estimation_cost_dict)
+
+    # Ahead of the forecast, like before
+    rgs_cost_dict["estimation"] = estimation_cost_dict
+    rgs_cost_dict[cost_merge.FORECAST] = rgs_cost_dict.pop(cost_merge.FORECAST)
+
+    return rgs_cost_dict
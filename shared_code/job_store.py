@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+# Background cost runs started by the HTTP function. A job is keyed by its
+# request and day, so repeated calls for the same scope on the same day poll
+# (or are served from) the same job.
+
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+BACKEND_SQLITE = "sqlite"
+BACKEND_TABLE = "table"
+
+# Minimum secs between two progress writes of the same job
+PROGRESS_SAVE_INTERVAL_SECS = 2
+
+def get_job_id(job_request, day):
+    # job_request holds only what changes the result, e.g. scope and query mode
+    job_key = json.dumps(job_request, sort_keys=True) + "|" + str(day)
+    return hashlib.sha1(job_key.encode()).hexdigest()
+
+def get_stale_secs():
+    # A running job not updated for this long is assumed lost (worker recycled)
+    return int(os.environ.get("JOB_STALE_SECS", "900"))
+
+def new_job(job_id, job_request):
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "jobId": job_id,
+        "status": STATUS_RUNNING,
+        "request": job_request,
+        "rgsDone": 0,
+        "rgsTotal": 0,
+        "result": None,
+        "error": None,
+        "createdAt": now,
+        "updatedAt": now
+    }
+
+def is_stale(job, stale_secs=None):
+    stale_secs = get_stale_secs() if stale_secs is None else stale_secs
+    updated_at = datetime.fromisoformat(job["updatedAt"])
+    return job["status"] == STATUS_RUNNING and (datetime.now(timezone.utc) - updated_at).total_seconds() > stale_secs
+
+class SqliteJobStore:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, job TEXT)")
+        self._conn.commit()
+
+    def get_job(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT job FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def save_job(self, job):
+        job["updatedAt"] = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?)", (job["jobId"], json.dumps(job)))
+            self._conn.commit()
+
+class TableJobStore:
+    # Azure Table storage, shared by every instance of the function app. The
+    # job JSON is split over several properties as one holds at most 32K
+    # characters.
+
+    MAX_PROPERTY_CHARS = 32000
+
+    def __init__(self, connection_string, table_name="costtrackerjobs"):
+        from azure.data.tables import TableServiceClient
+
+        table_service_client = TableServiceClient.from_connection_string(connection_string)
+        self._table = table_service_client.create_table_if_not_exists(table_name)
+
+    def get_job(self, job_id):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            entity = self._table.get_entity(partition_key="job", row_key=job_id)
+        except ResourceNotFoundError:
+            return None
+
+        job_json = "".join(entity[f"job{x}"] for x in range(entity["numParts"]))
+        return json.loads(job_json)
+
+    def save_job(self, job):
+        job["updatedAt"] = datetime.now(timezone.utc).isoformat()
+        job_json = json.dumps(job)
+        parts = [job_json[x:x + self.MAX_PROPERTY_CHARS] for x in range(0, len(job_json), self.MAX_PROPERTY_CHARS)]
+
+        entity = {"PartitionKey": "job", "RowKey": job["jobId"], "numParts": len(parts)}
+        for x, part in enumerate(parts):
+            entity[f"job{x}"] = part
+        self._table.upsert_entity(entity, mode="replace")
+
+class JobProgress:
+    # Passed down the cost collection, counts the RGs whose rows are fetched
+    # and saves the counts to the job now and then. Called from the event
+    # loop, the writes go to a worker thread, one at a time: counts added
+    # while one is in flight go with the next write, or with the job's final
+    # save after wait().
+
+    def __init__(self, job, store, clock=time.monotonic):
+        self.job = job
+        self.store = store
+        self._clock = clock
+        self._saved_at = None
+        self._pending = None
+
+    def add_total(self, num_rgs):
+        self.job["rgsTotal"] += num_rgs
+        self._save()
+
+    def add_done(self, num_rgs):
+        self.job["rgsDone"] += num_rgs
+        self._save()
+
+    def _save(self):
+        now = self._clock()
+        if self._saved_at is None or now - self._saved_at >= PROGRESS_SAVE_INTERVAL_SECS or self.job["rgsDone"] >= self.job["rgsTotal"]:
+            if self._pending is not None and not self._pending.done():
+                return
+            self._saved_at = now
+            job = dict(self.job)
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._save_job(job)
+                return
+            self._pending = loop.run_in_executor(None, self._save_job, job)
+
+    def _save_job(self, job):
+        # A lost progress write only delays the counts a poll sees
+        try:
+            self.store.save_job(job)
+        except Exception as e:
+            logging.error(f"[ERROR]: Could not save the progress of job {job['jobId']}: {e}")
+
+    async def wait(self):
+        if self._pending is not None:
+            await self._pending
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+def get_backend_name():
+    # JOB_STORE_BACKEND: sqlite (default) or table. The sqlite file is in the
+    # instance's temp dir, so with sqlite the jobs only work on a single
+    # instance: a poll the front end routes to another instance of a scaled
+    # out app gets a 404. Use table whenever the app can scale out.
+    return os.environ.get("JOB_STORE_BACKEND", BACKEND_SQLITE).lower()
+
+def get_job_store():
+    global _job_store
+
+    with _job_store_lock:
+        if _job_store is None:
+            if get_backend_name() == BACKEND_TABLE:
+                _job_store = TableJobStore(os.environ.get("JOB_STORE_CONNECTION_STRING", os.environ.get("AzureWebJobsStorage")))
+            else:
+                _job_store = SqliteJobStore(os.environ.get("JOB_STORE_PATH", os.path.join(tempfile.gettempdir(), "job_store.sqlite3")))
+        return _job_store
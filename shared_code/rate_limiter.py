@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+
+from shared_code import retry_policy as rp
+from shared_code import run_log as rlog
+from shared_code import telemetry
+
+RATELIMIT_HEADER_PREFIX = "x-ms-ratelimit-microsoft.costmanagement-"
+DEFAULT_RETRY_AFTER_SECS = 10
+
+class RateLimiter:
+    # Token bucket shared by every Cost Management query. The throttling
+    # headers returned by the service block the bucket for exactly as long as
+    # the service asks. A rate of 0 (the default) leaves the calls unpaced
+    # until then; a positive rate also paces them locally, the headers then
+    # shrinking the bucket too.
+
+    def __init__(self, rate=0, capacity=1, clock=time.monotonic, sleep=time.sleep, async_sleep=asyncio.sleep):
+        if float(rate) < 0:
+            raise ValueError(f"Rate limiter rate must be 0 (no local pacing) or positive, got {rate}")
+        self.rate = float(rate)
+        self.capacity = float(capacity) if self.rate > 0 else float("inf")
+        self.tokens = self.capacity
+        self.blocked_until = 0.0
+        self.total_wait_secs = 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._async_sleep = async_sleep
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def _try_acquire(self):
+        # Takes a token and returns 0, or returns how long to wait before retrying
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if now >= self.blocked_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            time_to_wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate if self.tokens < 1 else 0)
+            self.total_wait_secs += time_to_wait
+
+        logging.log(rlog.get_detail_level(), f"[INFO]: Request throttled, waiting for {round(time_to_wait,2)} secs")
+        return time_to_wait
+
+    def acquire(self):
+        time_to_wait = self._try_acquire()
+        while time_to_wait > 0:
+            self._sleep(time_to_wait)
+            time_to_wait = self._try_acquire()
+
+    async def acquire_async(self):
+        time_to_wait = self._try_acquire()
+        while time_to_wait > 0:
+            await self._async_sleep(time_to_wait)
+            time_to_wait = self._try_acquire()
+
+    def backoff(self, secs):
+        # Retry delay of a failed call, counted with the throttling waits
+        with self._lock:
+            self.total_wait_secs += secs
+        self._sleep(secs)
+
+    async def backoff_async(self, secs):
+        with self._lock:
+            self.total_wait_secs += secs
+        await self._async_sleep(secs)
+
+    def update(self, headers, throttled=False):
+        remaining, retry_after = parse_ratelimit_headers(headers)
+
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+
+            if remaining is not None and self.rate > 0:
+                self.tokens = min(self.tokens, float(remaining))
+
+            # Without a rate nothing refills the bucket, an exhausted quota
+            # waits for the service's retry-after or the default one
+            if (throttled or (remaining == 0 and self.rate == 0)) and retry_after is None:
+                retry_after = DEFAULT_RETRY_AFTER_SECS
+
+            if retry_after is not None and (throttled or remaining == 0):
+                if self.rate > 0:
+                    self.tokens = 0.0
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+def parse_ratelimit_headers(headers):
+    remaining = None
+    retry_after = None
+
+    for name, value in (headers or {}).items():
+        name = name.lower()
+        if name == "retry-after" or (name.startswith(RATELIMIT_HEADER_PREFIX) and name.endswith("-retry-after")):
+            try:
+                seconds = float(value)
+            except (TypeError, ValueError):
+                continue
+            retry_after = seconds if retry_after is None else max(retry_after, seconds)
+        elif name.startswith(RATELIMIT_HEADER_PREFIX) and name.endswith("-remaining"):
+            # e.g. "QueryResource:12" or "12"; the tightest limit wins
+            counts = [int(count) for count in re.findall(r"\d+", str(value))]
+            if counts:
+                remaining = min(counts) if remaining is None else min([remaining] + counts)
+
+    return remaining, retry_after
+
+def on_response(response, rate_limiter, response_headers):
+    response_headers.update(response.http_response.headers)
+    rate_limiter.update(response.http_response.headers)
+
+def record_query(scope, start, status_code, query_result, response_headers, attempt):
+    remaining, retry_after = parse_ratelimit_headers(response_headers)
+    num_rows = len(query_result.rows or []) if query_result is not None else None
+    telemetry.record_query(scope, time.perf_counter() - start, status_code, num_rows, remaining, retry_after, attempt)
+
+def get_retry_delay(e, scope, attempt, rate_limiter, retry_policy):
+    # A 429 also blocks the shared bucket so the other queries hold off
+    headers = rp.get_response_headers(e)
+    _, retry_after = parse_ratelimit_headers(headers)
+
+    if rp.get_status_code(e) == 429:
+        rate_limiter.update(headers, throttled=True)
+
+    delay = retry_policy.get_delay(attempt, retry_after)
+    logging.log(rlog.get_detail_level(), f"[INFO]: Cost query failed ({rp.get_status_code(e) or type(e).__name__}) for {scope}, attempt {attempt}, retrying in {round(delay,2)} secs")
+    return delay
+
+def query_usage(cost_mgmt_client, scope, query_def, rate_limiter, skiptoken=None, retry_policy=None):
+    # skiptoken requests the next page of a result that had a next_link.
+    # Transient failures are retried as retry_policy says, then raised.
+    kwargs = {"params": {"$skiptoken": skiptoken}} if skiptoken else {}
+    retry_policy = retry_policy or rp.get_default_retry_policy()
+
+    attempt = 1
+    while True:
+        rate_limiter.acquire()
+        response_headers = {}
+        start = time.perf_counter()
+        try:
+            query_result = cost_mgmt_client.query.usage(
+                scope=scope,
+                parameters=query_def,
+                raw_response_hook=lambda response: on_response(response, rate_limiter, response_headers),
+                **kwargs
+            )
+        except Exception as e:
+            record_query(scope, start, rp.get_status_code(e), None, rp.get_response_headers(e), attempt)
+            if not retry_policy.should_retry(e, attempt):
+                raise
+            rate_limiter.backoff(get_retry_delay(e, scope, attempt, rate_limiter, retry_policy))
+        else:
+            record_query(scope, start, 200, query_result, response_headers, attempt)
+            return query_result
+        attempt += 1
+
+async def query_usage_async(cost_mgmt_client, scope, query_def, rate_limiter, skiptoken=None, retry_policy=None):
+    # Same as query_usage for the azure.mgmt.costmanagement.aio client
+    kwargs = {"params": {"$skiptoken": skiptoken}} if skiptoken else {}
+    retry_policy = retry_policy or rp.get_default_retry_policy()
+
+    attempt = 1
+    while True:
+        await rate_limiter.acquire_async()
+        response_headers = {}
+        start = time.perf_counter()
+        try:
+            query_result = await cost_mgmt_client.query.usage(
+                scope=scope,
+                parameters=query_def,
+                raw_response_hook=lambda response: on_response(response, rate_limiter, response_headers),
+                **kwargs
+            )
+        except Exception as e:
+            record_query(scope, start, rp.get_status_code(e), None, rp.get_response_headers(e), attempt)
+            if not retry_policy.should_retry(e, attempt):
+                raise
+            await rate_limiter.backoff_async(get_retry_delay(e, scope, attempt, rate_limiter, retry_policy))
+        else:
+            record_query(scope, start, 200, query_result, response_headers, attempt)
+            return query_result
+        attempt += 1
+
+_shared_rate_limiter = None
+_shared_rate_limiter_lock = threading.Lock()
+
+def get_shared_rate_limiter():
+    # COST_QUERY_RATE_PER_SEC (default 0, no local pacing) and COST_QUERY_BURST
+    global _shared_rate_limiter
+
+    with _shared_rate_limiter_lock:
+        if _shared_rate_limiter is None:
+            _shared_rate_limiter = RateLimiter(
+                rate=float(os.environ.get("COST_QUERY_RATE_PER_SEC", "0")),
+                capacity=float(os.environ.get("COST_QUERY_BURST", "12")),
+            )
+        return _shared_rate_limiter
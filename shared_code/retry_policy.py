@@ -0,0 +1,59 @@
+import os
+import random
+import threading
+
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+
+# Transient failures of a Cost Management query: throttling, timeouts, server
+# errors and dropped connections. Anything else (e.g. 403 or 404 on an RG)
+# fails at once.
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+class RetryPolicy:
+    # Exponential backoff with full jitter: attempt n waits a random time up to
+    # base_delay_secs * 2^(n-1), capped at max_delay_secs. A Retry-After sent
+    # by the service is waited out instead, it is never cut short.
+
+    def __init__(self, max_attempts, base_delay_secs, max_delay_secs, random=random.random):
+        self.max_attempts = int(max_attempts)
+        self.base_delay_secs = float(base_delay_secs)
+        self.max_delay_secs = float(max_delay_secs)
+        self._random = random
+
+    def is_retryable(self, e):
+        if isinstance(e, HttpResponseError) and e.status_code is not None:
+            return e.status_code in RETRYABLE_STATUS_CODES
+        return isinstance(e, (ServiceRequestError, ServiceResponseError))
+
+    def should_retry(self, e, attempt):
+        return attempt < self.max_attempts and self.is_retryable(e)
+
+    def get_delay(self, attempt, retry_after=None):
+        backoff = min(self.max_delay_secs, self.base_delay_secs * 2 ** (attempt - 1))
+        delay = self._random() * backoff
+        if retry_after is not None:
+            return max(float(retry_after), delay)
+        return delay
+
+def get_status_code(e):
+    return getattr(e, "status_code", None)
+
+def get_response_headers(e):
+    response = getattr(e, "response", None)
+    return response.headers if response is not None else {}
+
+_default_retry_policy = None
+_default_retry_policy_lock = threading.Lock()
+
+def get_default_retry_policy():
+    # COST_QUERY_MAX_ATTEMPTS, COST_QUERY_BACKOFF_BASE_SECS and COST_QUERY_BACKOFF_MAX_SECS
+    global _default_retry_policy
+
+    with _default_retry_policy_lock:
+        if _default_retry_policy is None:
+            _default_retry_policy = RetryPolicy(
+                max_attempts=int(os.environ.get("COST_QUERY_MAX_ATTEMPTS", "5")),
+                base_delay_secs=float(os.environ.get("COST_QUERY_BACKOFF_BASE_SECS", "1")),
+                max_delay_secs=float(os.environ.get("COST_QUERY_BACKOFF_MAX_SECS", "60")),
+            )
+        return _default_retry_policy
@@ -0,0 +1,389 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from azure.mgmt.resourcegraph.models import QueryRequest, QueryRequestOptions
+
+from shared_code import telemetry
+
+RESOURCE_GROUP_TYPE = "microsoft.resources/subscriptions/resourcegroups"
+
+BACKEND_ARM = "arm"
+BACKEND_RESOURCE_GRAPH = "resourcegraph"
+
+# Resource Graph keeps 14 days of change history, older inventories are relisted
+MAX_INCREMENTAL_AGE_SECS = 7 * 24 * 3600
+# Changes are read from a bit before the last refresh, they land in Resource
+# Graph with a delay and applying one twice is harmless
+CHANGES_OVERLAP_SECS = 300
+
+# Unmanaged RGs and their Team tag, across every subscription of the request
+UNMANAGED_RESOURCE_GROUPS_QUERY = """resourcecontainers
+| where type =~ '{resource_group_type}' and isempty(managedBy)
+| project subscriptionId, name, team = tostring(tags['Team'])"""
+
+# RGs created, updated or deleted since a point in time, joined with their
+# current state. Deleted RGs come back without a name.
+RESOURCE_GROUP_CHANGES_QUERY = """resourcecontainerchanges
+| extend targetResourceId = tolower(tostring(properties.targetResourceId)), changeTime = todatetime(properties.changeAttributes.timestamp)
+| where tostring(properties.targetResourceType) =~ '{resource_group_type}' and changeTime > datetime({since})
+| summarize by targetResourceId
+| join kind=leftouter (
+    resourcecontainers
+    | where type =~ '{resource_group_type}'
+    | project targetResourceId = tolower(id), name, team = tostring(tags['Team']), managedBy
+) on targetResourceId
+| project targetResourceId, name, team, managedBy"""
+
+class ResourceGroupRecord:
+    # What the cost functions need from an RG. tags and managed_by mirror the
+    # ARM model so records can be passed wherever RGs are.
+
+    __slots__ = ("subscription_id", "name", "team", "managed")
+
+    def __init__(self, subscription_id, name, team=None, managed=False):
+        self.subscription_id = subscription_id
+        self.name = name
+        self.team = team
+        self.managed = managed
+
+    @property
+    def key(self):
+        return get_record_key(self.subscription_id, self.name)
+
+    @property
+    def tags(self):
+        return {"Team": self.team} if self.team is not None else None
+
+    @property
+    def managed_by(self):
+        return True if self.managed else None
+
+def get_record_key(subscription_id, name):
+    return f"{subscription_id}/{name}".lower()
+
+def to_record(subscription_id, rg):
+    team = rg.tags.get("Team") if rg.tags is not None and "Team" in rg.tags.keys() else None
+    return ResourceGroupRecord(subscription_id, rg.name, team, rg.managed_by is not None)
+
+class ResourceGroupInventory:
+    # RG records by subscription and name. Served as is within the TTL, then
+    # refreshed from the changes since the last refresh when the backend has a
+    # changes feed, otherwise relisted. One refresh at a time: the callers
+    # waiting on it are served its records.
+
+    def __init__(self, ttl_secs, path=None, clock=time.time):
+        self.ttl_secs = ttl_secs
+        self.path = path
+        self.records = {}
+        self.refreshed_at = None
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # asyncio locks belong to the event loop they are used on
+        self._async_refresh_lock = None
+        self._async_refresh_loop = None
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    def is_fresh(self):
+        return self.refreshed_at is not None and self._clock() - self.refreshed_at < self.ttl_secs
+
+    def get_records(self, include_managed=False):
+        return [record for record in self.records.values() if include_managed or not record.managed]
+
+    def replace(self, records):
+        with self._lock:
+            self.records = {record.key: record for record in records}
+            self.refreshed_at = self._clock()
+            self._save()
+
+    def apply_changes(self, changes):
+        # changes: (key, record) pairs, record None for a deleted RG
+        with self._lock:
+            for key, record in changes:
+                self.records.pop(key, None)
+                if record is not None:
+                    self.records[key] = record
+            self.refreshed_at = self._clock()
+            self._save()
+
+    def _get_changes_since(self):
+        if self.refreshed_at is None or self._clock() - self.refreshed_at >= MAX_INCREMENTAL_AGE_SECS:
+            return None
+        return datetime.fromtimestamp(self.refreshed_at - CHANGES_OVERLAP_SECS, timezone.utc)
+
+    def refresh(self, backend):
+        with self._refresh_lock:
+            # Fresh again once the refresh this call waited for is done
+            if self.is_fresh():
+                return self.get_records()
+
+            since = self._get_changes_since()
+            changes = backend.list_changes(since) if since is not None else None
+
+            if changes is not None:
+                logging.info(f"[INFO]: Applying {len(changes)} resource group changes to the inventory")
+                self.apply_changes(changes)
+            else:
+                self.replace(backend.list_resource_groups())
+                logging.info(f"[INFO]: Listed {len(self.records)} resource groups into the inventory")
+
+            return self.get_records()
+
+    def _get_async_refresh_lock(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._async_refresh_loop is not loop:
+                self._async_refresh_lock = asyncio.Lock()
+                self._async_refresh_loop = loop
+            return self._async_refresh_lock
+
+    async def refresh_async(self, backend):
+        # Same as refresh with an async backend, for the collectors of one
+        # event loop
+        async with self._get_async_refresh_lock():
+            if self.is_fresh():
+                return self.get_records()
+
+            since = self._get_changes_since()
+            changes = await backend.list_changes(since) if since is not None else None
+
+            if changes is not None:
+                logging.info(f"[INFO]: Applying {len(changes)} resource group changes to the inventory")
+                self.apply_changes(changes)
+            else:
+                self.replace(await backend.list_resource_groups())
+                logging.info(f"[INFO]: Listed {len(self.records)} resource groups into the inventory")
+
+            return self.get_records()
+
+    def _save(self):
+        if self.path is None:
+            return
+        with open(self.path, "w") as f:
+            json.dump({
+                "refreshedAt": self.refreshed_at,
+                "resourceGroups": [[record.subscription_id, record.name, record.team, record.managed] for record in self.records.values()]
+            }, f)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                inventory = json.load(f)
+            for subscription_id, name, team, managed in inventory["resourceGroups"]:
+                record = ResourceGroupRecord(subscription_id, name, team, managed)
+                self.records[record.key] = record
+            self.refreshed_at = inventory["refreshedAt"]
+        except Exception as e:
+            logging.info(f"[INFO]: Ignoring unreadable resource group inventory {self.path}: {e}")
+            self.records = {}
+            self.refreshed_at = None
+
+def get_unmanaged_resource_groups_query():
+    return UNMANAGED_RESOURCE_GROUPS_QUERY.format(resource_group_type=RESOURCE_GROUP_TYPE)
+
+def get_changes_query(since):
+    return RESOURCE_GROUP_CHANGES_QUERY.format(resource_group_type=RESOURCE_GROUP_TYPE, since=since.strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+def to_records(rows):
+    return [ResourceGroupRecord(row["subscriptionId"], row["name"], row.get("team") or None) for row in rows]
+
+def to_changes(rows):
+    changes = []
+    for row in rows:
+        # /subscriptions/{subscription}/resourcegroups/{name}
+        resource_id_parts = row["targetResourceId"].split("/")
+        record = ResourceGroupRecord(resource_id_parts[2], row["name"], row.get("team") or None, bool(row.get("managedBy"))) if row.get("name") else None
+        changes.append((get_record_key(resource_id_parts[2], resource_id_parts[4]), record))
+    return changes
+
+def query_resource_graph(resource_graph_client, query, subscription_ids=None, management_group_ids=None):
+    rows = []
+    skip_token = None
+    while True:
+        response = resource_graph_client.resources(QueryRequest(
+            subscriptions=subscription_ids,
+            management_groups=management_group_ids,
+            query=query,
+            options=QueryRequestOptions(skip_token=skip_token, result_format="objectArray")
+        ))
+        rows.extend(response.data)
+        skip_token = response.skip_token
+        if not skip_token:
+            return rows
+
+async def query_resource_graph_async(resource_graph_client, query, subscription_ids=None, management_group_ids=None):
+    # Same as query_resource_graph for the azure.mgmt.resourcegraph.aio client
+    rows = []
+    skip_token = None
+    while True:
+        response = await resource_graph_client.resources(QueryRequest(
+            subscriptions=subscription_ids,
+            management_groups=management_group_ids,
+            query=query,
+            options=QueryRequestOptions(skip_token=skip_token, result_format="objectArray")
+        ))
+        rows.extend(response.data)
+        skip_token = response.skip_token
+        if not skip_token:
+            return rows
+
+# Inventory backends share one interface:
+#   key                        identifies the inventory the backend fills
+#   list_resource_groups()     every RG record
+#   list_changes(since)        (key, record) changes since a datetime, or None
+#                              when the backend cannot tell and a relist is needed
+# The Async* backends have the same methods as coroutines.
+
+class ArmInventoryBackend:
+    # resource_groups.list() of one subscription, with the Resource Graph
+    # changes feed when a resource_graph_client is given
+
+    def __init__(self, resource_mgmt_client, subscription_id, resource_graph_client=None):
+        self.key = subscription_id
+        self.subscription_id = subscription_id
+        self.resource_mgmt_client = resource_mgmt_client
+        self.resource_graph_client = resource_graph_client
+
+    def list_resource_groups(self):
+        return [to_record(self.subscription_id, rg) for rg in self.resource_mgmt_client.resource_groups.list()]
+
+    def list_changes(self, since):
+        if self.resource_graph_client is None or not is_incremental_enabled():
+            return None
+        return to_changes(query_resource_graph(self.resource_graph_client, get_changes_query(since), [self.subscription_id]))
+
+class AsyncArmInventoryBackend:
+
+    def __init__(self, resource_mgmt_client, subscription_id, resource_graph_client=None):
+        self.key = subscription_id
+        self.subscription_id = subscription_id
+        self.resource_mgmt_client = resource_mgmt_client
+        self.resource_graph_client = resource_graph_client
+
+    async def list_resource_groups(self):
+        return [to_record(self.subscription_id, rg) async for rg in self.resource_mgmt_client.resource_groups.list()]
+
+    async def list_changes(self, since):
+        if self.resource_graph_client is None or not is_incremental_enabled():
+            return None
+        return to_changes(await query_resource_graph_async(self.resource_graph_client, get_changes_query(since), [self.subscription_id]))
+
+class ResourceGraphInventoryBackend:
+    # One KQL query for the unmanaged RGs and their Team tag of any number of
+    # subscriptions, paged by skip token instead of the ARM list pages
+
+    def __init__(self, resource_graph_client, subscription_ids):
+        self.key = ",".join(sorted(subscription_ids))
+        self.subscription_ids = list(subscription_ids)
+        self.resource_graph_client = resource_graph_client
+
+    def list_resource_groups(self):
+        return to_records(query_resource_graph(self.resource_graph_client, get_unmanaged_resource_groups_query(), self.subscription_ids))
+
+    def list_changes(self, since):
+        if not is_incremental_enabled():
+            return None
+        return to_changes(query_resource_graph(self.resource_graph_client, get_changes_query(since), self.subscription_ids))
+
+class AsyncResourceGraphInventoryBackend:
+
+    def __init__(self, resource_graph_client, subscription_ids):
+        self.key = ",".join(sorted(subscription_ids))
+        self.subscription_ids = list(subscription_ids)
+        self.resource_graph_client = resource_graph_client
+
+    async def list_resource_groups(self):
+        return to_records(await query_resource_graph_async(self.resource_graph_client, get_unmanaged_resource_groups_query(), self.subscription_ids))
+
+    async def list_changes(self, since):
+        if not is_incremental_enabled():
+            return None
+        return to_changes(await query_resource_graph_async(self.resource_graph_client, get_changes_query(since), self.subscription_ids))
+
+class StaticInventoryBackend:
+    # Fixed records, e.g. a local fake in place of ARM or Resource Graph
+
+    def __init__(self, records, key="static"):
+        self.key = key
+        self.records = list(records)
+
+    def list_resource_groups(self):
+        return list(self.records)
+
+    def list_changes(self, since):
+        return None
+
+def is_incremental_enabled():
+    return os.environ.get("RG_INVENTORY_INCREMENTAL", "true").lower() == "true"
+
+def get_backend_name():
+    # RG_INVENTORY_BACKEND: arm (default) or resourcegraph
+    return os.environ.get("RG_INVENTORY_BACKEND", BACKEND_ARM).lower()
+
+def get_inventory_backend(resource_mgmt_client, resource_graph_client, subscription_ids):
+    if get_backend_name() == BACKEND_RESOURCE_GRAPH:
+        return ResourceGraphInventoryBackend(resource_graph_client, subscription_ids)
+    return ArmInventoryBackend(resource_mgmt_client, subscription_ids[0], resource_graph_client)
+
+def group_by_subscription(records, subscription_ids):
+    resource_groups_by_subscription = {subscription_id: [] for subscription_id in subscription_ids}
+    subscription_id_by_lower = {subscription_id.lower(): subscription_id for subscription_id in subscription_ids}
+    for record in records:
+        resource_groups_by_subscription.setdefault(subscription_id_by_lower.get(record.subscription_id.lower(), record.subscription_id), []).append(record)
+    return resource_groups_by_subscription
+
+def get_resource_groups(backend):
+    # Unmanaged RG records from the backend's shared inventory
+    with telemetry.phase(telemetry.PHASE_LIST_RESOURCE_GROUPS, backend=type(backend).__name__):
+        return get_inventory(backend.key).refresh(backend)
+
+async def get_resource_groups_async(backend):
+    with telemetry.phase(telemetry.PHASE_LIST_RESOURCE_GROUPS, backend=type(backend).__name__):
+        return await get_inventory(backend.key).refresh_async(backend)
+
+def get_resource_groups_by_subscription(subscription_ids, get_resource_mgmt_client, resource_graph_client):
+    # One Resource Graph query for every subscription with that backend,
+    # an ARM inventory per subscription otherwise
+
+    if get_backend_name() == BACKEND_RESOURCE_GRAPH:
+        return group_by_subscription(get_resource_groups(ResourceGraphInventoryBackend(resource_graph_client, subscription_ids)), subscription_ids)
+
+    return {
+        subscription_id: get_resource_groups(ArmInventoryBackend(get_resource_mgmt_client(subscription_id), subscription_id, resource_graph_client))
+        for subscription_id in subscription_ids
+    }
+
+async def get_resource_groups_by_subscription_async(subscription_ids, get_resource_mgmt_client, resource_graph_client):
+    # Same with the aio clients, the ARM inventories refreshed concurrently
+
+    if get_backend_name() == BACKEND_RESOURCE_GRAPH:
+        return group_by_subscription(await get_resource_groups_async(AsyncResourceGraphInventoryBackend(resource_graph_client, subscription_ids)), subscription_ids)
+
+    resource_groups_lists = await asyncio.gather(*[
+        get_resource_groups_async(AsyncArmInventoryBackend(get_resource_mgmt_client(subscription_id), subscription_id, resource_graph_client))
+        for subscription_id in subscription_ids
+    ])
+
+    return dict(zip(subscription_ids, resource_groups_lists))
+
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+def get_inventory(key):
+    # One inventory per backend key. RG_INVENTORY_TTL_SECS (default 3600) and
+    # optional RG_INVENTORY_DIR to keep the inventories across cold starts
+
+    with _inventories_lock:
+        if key not in _inventories:
+            inventory_dir = os.environ.get("RG_INVENTORY_DIR")
+            _inventories[key] = ResourceGroupInventory(
+                ttl_secs=float(os.environ.get("RG_INVENTORY_TTL_SECS", "3600")),
+                path=os.path.join(inventory_dir, f"rg_inventory_{key.replace(',', '_')}.json") if inventory_dir else None,
+            )
+        return _inventories[key]
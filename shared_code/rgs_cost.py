@@ -0,0 +1,208 @@
+import logging
+import os
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from shared_code import anomaly_detection
+from shared_code import budget_alerts
+from shared_code import cost_breakdown
+from shared_code import cost_merge
+from shared_code import cost_warehouse
+from shared_code import forecast
+from shared_code import rg_inventory
+from shared_code import rollups
+from shared_code import run_log as rlog
+from shared_code import telemetry
+from shared_code.team_aggregator import TeamAggregator
+
+def get_extra_windows():
+    # COST_EXTRA_WINDOWS app setting, e.g. "14,90" adds last14Days and last90Days
+    extra_windows = os.environ.get("COST_EXTRA_WINDOWS", "")
+    return [int(num_days) for num_days in extra_windows.split(",") if num_days.strip()]
+
+def get_num_days_to_fetch():
+    # Yesterday plus the longest window ending the day before yesterday
+    return max([30] + get_extra_windows()) + 1
+
+def fetch_rows_of_cost(rg, scope, from_datetime, to_datetime, get_cost, rows_of_cost_by_rg=None, checkpoint=None):
+    # Prefetched rows, else the checkpointed ones, else a new query. A failed
+    # prefetch holds the exception instead of the rows, it is raised here.
+
+    if rows_of_cost_by_rg is not None:
+        rows_of_cost = rows_of_cost_by_rg.get(str(rg.name).lower(), [])
+        if isinstance(rows_of_cost, Exception):
+            raise rows_of_cost
+        return rows_of_cost
+
+    rows_of_cost = checkpoint.get_rows(rg.name) if checkpoint is not None else None
+
+    if rows_of_cost is None:
+        scope_with_rg = '' + scope + str(rg.name)
+
+        rows_of_cost = get_cost(scope_with_rg, from_datetime, to_datetime)
+
+        if checkpoint is not None:
+            checkpoint.save_rows(rg.name, rows_of_cost)
+
+    return rows_of_cost
+
+def get_rgs_cost(resource_groups, scope, from_datetime, to_datetime, get_cost, team_cost_keys, rows_of_cost_by_rg=None, round_totals=True, catch_errors=True, inventory_backend=None, checkpoint=None, breakdown_by_rg=None):
+    # get_cost(scope_with_rg, from_datetime, to_datetime) returns the daily rows
+    # of one RG, it is only called for RGs missing from rows_of_cost_by_rg.
+    # With an inventory_backend the RGs come from its inventory instead of
+    # resource_groups. With a checkpoint (checkpoint_store.RunCheckpoint) the
+    # rows of each RG are saved as they are fetched and reused by a rerun, and
+    # cleared once the totals are returned. RGs whose rows cannot be fetched
+    # (after the query retries) are left out of the totals and listed in
+    # failedResourceGroups. breakdown_by_rg (cost_breakdown) is nested in the
+    # RG entries of the periods. Returns the cost dicts keyed by period.
+    # COST_TRACKER_LOG_MODE=summary trades the per-RG lines for one summary.
+
+    run_start = time.perf_counter()
+    run_log = rlog.RunLog()
+
+    if inventory_backend is not None:
+        resource_groups = rg_inventory.get_resource_groups(inventory_backend)
+
+    if not rlog.is_summary_mode():
+        logging.info("-----------------Yesterday, Daily, Weekly & Monthly Cost-----------------")
+
+    team_aggregator = TeamAggregator(team_cost_keys)
+
+    rg_names = list()
+    teams = list()
+    team_indexes = list()
+    rows_of_cost_list = list()
+    failed_resource_groups = list()
+
+    fetch_rows_start = time.perf_counter()
+    try:
+        with telemetry.phase(telemetry.PHASE_FETCH_ROWS, scope=scope):
+            for x,rg in enumerate(resource_groups, start=1):
+                run_log.detail(rg.name, f"--------------------------------------{str(x)}--------------------------------------")
+                run_log.add_rg(managed=rg.managed_by is not None)
+
+                if rg.managed_by is None:
+                    team, cost_key = team_aggregator.resolve_team(rg)
+
+                    fetch_start = time.perf_counter()
+                    try:
+                        rows_of_cost = fetch_rows_of_cost(rg, scope, from_datetime, to_datetime, get_cost, rows_of_cost_by_rg, checkpoint)
+                    except Exception as e:
+                        if not rlog.is_summary_mode():
+                            logging.error(f"[ERROR]: Could not get the cost of {rg.name}: {e}")
+                        failed_resource_groups.append({"rgname": rg.name, "error": str(e)})
+                        run_log.add_failed(rg.name)
+                        telemetry.record_rg_fetch(rg.name, team, time.perf_counter() - fetch_start, error=e)
+                        continue
+
+                    # Prefetched rows are timed where they are fetched
+                    if rows_of_cost_by_rg is None:
+                        telemetry.record_rg_fetch(rg.name, team, time.perf_counter() - fetch_start, len(rows_of_cost))
+
+                    run_log.detail(rg.name, len(rows_of_cost))
+                    run_log.add_fetched(rg.name, len(rows_of_cost))
+
+                    rg_names.append(rg.name)
+                    teams.append(team)
+                    team_indexes.append(team_aggregator.get_team_index(cost_key))
+                    rows_of_cost_list.append(rows_of_cost)
+
+                run_log.detail(rg.name, f"--------------------------------------{str(x)}--------------------------------------")
+    except Exception as e:
+        if not catch_errors:
+            raise
+        logging.exception("[ERROR]: Something went wrong while calculating the cost")
+        logging.exception(e)
+
+    run_log.add_timing("fetch", time.perf_counter() - fetch_rows_start)
+
+    # The daily rows of every fetched RG go to the history, when
+    # COST_WAREHOUSE_BACKEND is set
+    warehouse_start = time.perf_counter()
+    cost_warehouse.append_run(scope, from_datetime, to_datetime, rg_names, teams, rows_of_cost_list)
+    run_log.add_timing("warehouse", time.perf_counter() - warehouse_start)
+
+    num_days = (to_datetime.date() - from_datetime.date()).days + 1
+
+    aggregate_start = time.perf_counter()
+    with telemetry.phase(telemetry.PHASE_AGGREGATE, rgs=len(rg_names), days=num_days):
+        cost_matrix = rollups.build_cost_matrix(rows_of_cost_list, from_datetime.date(), num_days)
+        team_indexes = np.array(team_indexes, dtype=np.int64)
+
+        # Every window is a difference of two columns of the running sums
+        cumulative_cost = rollups.get_cumulative_cost(cost_matrix)
+        weekly_cost = rollups.get_window_cost(cumulative_cost, 7)
+
+        team_aggregator.add_costs("yesterday", rg_names, teams, team_indexes, rollups.get_yesterday_cost(cost_matrix))
+        team_aggregator.add_costs("daily", rg_names, teams, team_indexes, weekly_cost / 7)
+        team_aggregator.add_costs("weekly", rg_names, teams, team_indexes, weekly_cost)
+        team_aggregator.add_costs("monthly", rg_names, teams, team_indexes, rollups.get_window_cost(cumulative_cost, 30))
+
+        for extra_num_days in get_extra_windows():
+            if extra_num_days + 1 <= num_days:
+                team_aggregator.add_costs(f"last{extra_num_days}Days", rg_names, teams, team_indexes, rollups.get_window_cost(cumulative_cost, extra_num_days))
+
+    run_log.add_timing("aggregate", time.perf_counter() - aggregate_start)
+
+    num_rgs_without_rows = sum(1 for rows_of_cost in rows_of_cost_list if len(rows_of_cost) == 0)
+    if num_rgs_without_rows > 0 and not rlog.is_summary_mode():
+        logging.info(f"[INFO]: No cost rows from {from_datetime.date()} to {to_datetime.date()} for {num_rgs_without_rows} RGs, counted as zero")
+
+    cost_dicts = team_aggregator.cost_dicts
+
+    if round_totals:
+        for cost_dict in cost_dicts.values():
+            cost_merge.round_cost_dict(cost_dict)
+
+    if breakdown_by_rg is not None:
+        cost_breakdown.add_breakdowns(cost_dicts, breakdown_by_rg)
+
+    cost_dicts[cost_merge.FAILED_RESOURCE_GROUPS] = failed_resource_groups
+    if len(failed_resource_groups) > 0 and not rlog.is_summary_mode():
+        logging.error(f"[ERROR]: {len(failed_resource_groups)} RGs left out of the totals, see {cost_merge.FAILED_RESOURCE_GROUPS}")
+
+    # RG budgets against this run's periods, the team budgets are checked on
+    # the merged totals (budget_alerts.alert). A failure only costs the
+    # breaches of this run.
+    try:
+        cost_dicts[cost_merge.BUDGET_BREACHES] = budget_alerts.get_rg_breaches(cost_dicts)
+    except Exception as e:
+        logging.error(f"[ERROR]: Could not check the RG budgets: {e}")
+        cost_dicts[cost_merge.BUDGET_BREACHES] = []
+
+    # Per-RG projections from the same daily series, the team projections are
+    # fitted once the batches are merged (forecast.add_forecast)
+    forecast_start = time.perf_counter()
+    cost_dicts[cost_merge.FORECAST] = forecast.get_rgs_forecast(cost_matrix, from_datetime.date(), rg_names, teams, team_indexes, team_aggregator.cost_keys)
+    run_log.add_timing("forecast", time.perf_counter() - forecast_start)
+
+    # New days of each RG against its running statistics, a failure only
+    # costs the anomalies of this run
+    anomalies_start = time.perf_counter()
+    try:
+        cost_dicts[cost_merge.ANOMALIES] = anomaly_detection.detect_anomalies(scope, cost_matrix, from_datetime.date(), rg_names, teams)
+    except Exception as e:
+        logging.error(f"[ERROR]: Could not check the cost anomalies: {e}")
+        cost_dicts[cost_merge.ANOMALIES] = []
+    run_log.add_timing("anomalies", time.perf_counter() - anomalies_start)
+
+    cost_dicts["yesterday"]["fromDate"] = str(to_datetime.date())
+    cost_dicts["yesterday"]["toDate"] = str(to_datetime.date())
+
+    for period, period_num_days in [("daily", 7), ("weekly", 7), ("monthly", 30)] + [(f"last{extra_num_days}Days", extra_num_days) for extra_num_days in get_extra_windows()]:
+        if period in cost_dicts:
+            cost_dicts[period]["fromDate"] = str((to_datetime - timedelta(days=period_num_days)).date())
+            cost_dicts[period]["toDate"] = str((to_datetime - timedelta(days=1)).date())
+
+    # Only a run that raises is retried, so the checkpoint is of no more use
+    # once the totals are returned, failed RGs included
+    if checkpoint is not None:
+        checkpoint.clear()
+
+    run_log.add_timing("total", time.perf_counter() - run_start)
+    run_log.log_summary(scope)
+
+    return cost_dicts
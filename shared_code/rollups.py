@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+import numpy as np
+
+from shared_code import cost_store
+
+def build_cost_matrix(rows_of_cost_list, from_date, num_days):
+    # RG x day matrix indexed by the UsageDate of each row, column 0 being
+    # from_date. Days without a row stay at zero and rows outside the window
+    # are ignored.
+
+    window_usage_dates = np.array([cost_store.to_usage_date(from_date + timedelta(days=day)) for day in range(num_days)], dtype=np.int64)
+
+    lengths = [len(rows_of_cost) for rows_of_cost in rows_of_cost_list]
+    rg_indexes = np.repeat(np.arange(len(rows_of_cost_list)), lengths)
+    usage_dates = np.fromiter((row[cost_store.DATE_INDEX] for rows_of_cost in rows_of_cost_list for row in rows_of_cost), dtype=np.int64, count=len(rg_indexes))
+    costs = np.fromiter((row[cost_store.COST_INDEX] for rows_of_cost in rows_of_cost_list for row in rows_of_cost), dtype=float, count=len(rg_indexes))
+
+    days = np.minimum(np.searchsorted(window_usage_dates, usage_dates), num_days - 1)
+    in_window = window_usage_dates[days] == usage_dates
+
+    # add.at sums duplicate (RG, day) rows, e.g. one per currency
+    cost_matrix = np.zeros((len(rows_of_cost_list), num_days))
+    np.add.at(cost_matrix, (rg_indexes[in_window], days[in_window]), costs[in_window])
+
+    return cost_matrix
+
+def get_yesterday_cost(cost_matrix):
+    return cost_matrix[:, -1]
+
+def get_cumulative_cost(cost_matrix):
+    # Running sum of each RG over the days in one pass, column d holding days
+    # 0 to d-1, so every window is the difference of two columns. The
+    # difference can be off from a plain sum by float rounding, far below a
+    # cent.
+    cumulative_cost = np.zeros((cost_matrix.shape[0], cost_matrix.shape[1] + 1))
+    np.cumsum(cost_matrix, axis=1, out=cumulative_cost[:, 1:])
+    return cumulative_cost
+
+def sum_days(cumulative_cost, from_day, to_day):
+    # Cost of the days from_day to to_day - 1, from get_cumulative_cost
+    return cumulative_cost[:, to_day] - cumulative_cost[:, from_day]
+
+def get_window_cost(cumulative_cost, num_days):
+    # Sum of the num_days ending the day before yesterday, like the weekly and
+    # monthly figures
+    total_days = cumulative_cost.shape[1] - 1
+    return sum_days(cumulative_cost, max(total_days - num_days - 1, 0), total_days - 1)
+
+def get_team_totals(costs, team_indexes, num_teams):
+    # Group-by over the team column, untracked teams have index -1
+    tracked = team_indexes >= 0
+    return np.bincount(team_indexes[tracked], weights=costs[tracked], minlength=num_teams)
@@ -0,0 +1,93 @@
+import json
+import logging
+import os
+import zlib
+
+# COST_TRACKER_LOG_MODE:
+#   verbose  every RG logs its separators and row count (the default)
+#   summary  per-RG lines go to DEBUG, except for a sample of the RGs, and
+#            each run ends with one compact summary record
+LOG_MODE_VERBOSE = "verbose"
+LOG_MODE_SUMMARY = "summary"
+
+# RG names listed in a summary, the counts always cover every RG
+MAX_SUMMARY_RGS = 50
+
+def get_log_mode():
+    return os.environ.get("COST_TRACKER_LOG_MODE", LOG_MODE_VERBOSE).lower()
+
+def get_sample_rate():
+    # COST_TRACKER_LOG_SAMPLE_RATE, share of RGs keeping their detail in summary mode
+    return float(os.environ.get("COST_TRACKER_LOG_SAMPLE_RATE", "0"))
+
+def is_summary_mode():
+    return get_log_mode() == LOG_MODE_SUMMARY
+
+def get_detail_level():
+    # Level of the per-call lines of the hot path (throttling waits, retries,
+    # store queries)
+    return logging.DEBUG if is_summary_mode() else logging.INFO
+
+def is_sampled(name, sample_rate):
+    # Stable across runs, the same RGs are sampled every time
+    return zlib.crc32(str(name).lower().encode()) % 10000 < sample_rate * 10000
+
+class RunLog:
+    # Per-RG detail and the counts of one get_rgs_cost run
+
+    def __init__(self, log_mode=None, sample_rate=None):
+        self.log_mode = log_mode or get_log_mode()
+        self.sample_rate = get_sample_rate() if sample_rate is None else sample_rate
+        self.num_rgs = 0
+        self.num_managed = 0
+        self.num_fetched = 0
+        self.missing_rgs = []
+        self.failed_rgs = []
+        self.timings = {}
+
+    def get_level(self, rg_name):
+        if self.log_mode != LOG_MODE_SUMMARY or is_sampled(rg_name, self.sample_rate):
+            return logging.INFO
+        return logging.DEBUG
+
+    def detail(self, rg_name, message):
+        level = self.get_level(rg_name)
+        if logging.getLogger().isEnabledFor(level):
+            logging.log(level, message)
+
+    def add_rg(self, managed=False):
+        self.num_rgs += 1
+        if managed:
+            self.num_managed += 1
+
+    def add_fetched(self, rg_name, num_rows):
+        self.num_fetched += 1
+        if num_rows == 0:
+            self.missing_rgs.append(str(rg_name))
+
+    def add_failed(self, rg_name):
+        self.failed_rgs.append(str(rg_name))
+
+    def add_timing(self, name, secs):
+        self.timings[name] = round(self.timings.get(name, 0) + secs, 3)
+
+    def get_summary(self, scope):
+        return {
+            "scope": scope,
+            "logMode": self.log_mode,
+            "rgs": self.num_rgs,
+            "managedRgs": self.num_managed,
+            "fetchedRgs": self.num_fetched,
+            "rgsWithoutRows": len(self.missing_rgs),
+            "failedRgs": len(self.failed_rgs),
+            "rgsWithoutRowsNames": self.missing_rgs[:MAX_SUMMARY_RGS],
+            "failedRgsNames": self.failed_rgs[:MAX_SUMMARY_RGS],
+            "timingsSecs": self.timings
+        }
+
+    def log_summary(self, scope):
+        # One record per run, the fields also go to App Insights as custom dimensions
+        summary = self.get_summary(scope)
+        custom_dimensions = {key: json.dumps(value) if isinstance(value, (list, dict)) else value for key, value in summary.items()}
+        logging.info(f"[INFO]: Cost run summary {json.dumps(summary)}", extra={"custom_dimensions": custom_dimensions})
+        return summary
@@ -0,0 +1,59 @@
+import os
+
+from shared_code import cost_query
+from shared_code import rg_inventory
+
+MANAGEMENT_GROUP_SCOPE_PREFIX = "/providers/microsoft.management/managementgroups/"
+
+SUBSCRIPTIONS_QUERY = """resourcecontainers
+| where type =~ 'microsoft.resources/subscriptions'
+| project subscriptionId"""
+
+def get_management_group_id(scope):
+    # /providers/Microsoft.Management/managementGroups/{id}
+    if isinstance(scope, str) and scope.lower().startswith(MANAGEMENT_GROUP_SCOPE_PREFIX):
+        return scope.rstrip("/").split("/")[-1]
+    return None
+
+def get_request_scope(request=None):
+    return request.get("scope") if isinstance(request, dict) else None
+
+def is_valid_scope(scope):
+    # An RG scope or a management group scope, see cost_query.is_resource_groups_scope
+    return isinstance(scope, str) and (cost_query.is_resource_groups_scope(scope) or get_management_group_id(scope) is not None)
+
+def get_requested_subscriptions(request=None):
+    # A {"subscriptions": [...]} list, or a {"managementGroup": "<id>"} or
+    # management group "scope". Without any scope in the request, falls back to
+    # the COST_TRACKER_SUBSCRIPTIONS (comma separated) and
+    # COST_TRACKER_MANAGEMENT_GROUP app settings.
+    # Returns (subscription_ids, management_group_id), both None for a run
+    # over the single default scope.
+
+    request = request if isinstance(request, dict) else {}
+
+    subscription_ids = request.get("subscriptions")
+    management_group_id = request.get("managementGroup") or get_management_group_id(request.get("scope"))
+
+    if not subscription_ids and not management_group_id and not request.get("scope"):
+        subscription_ids = [subscription_id.strip() for subscription_id in os.environ.get("COST_TRACKER_SUBSCRIPTIONS", "").split(",") if subscription_id.strip()]
+        management_group_id = os.environ.get("COST_TRACKER_MANAGEMENT_GROUP")
+
+    return subscription_ids or None, management_group_id or None
+
+def is_multi_subscription(request=None):
+    subscription_ids, management_group_id = get_requested_subscriptions(request)
+    return subscription_ids is not None or management_group_id is not None
+
+def resolve_subscription_ids(subscription_ids, management_group_id, resource_graph_client):
+    # Every subscription under the management group when one is given
+    if management_group_id is None:
+        return list(subscription_ids)
+    rows = rg_inventory.query_resource_graph(resource_graph_client, SUBSCRIPTIONS_QUERY, management_group_ids=[management_group_id])
+    return sorted(set(row["subscriptionId"] for row in rows) | set(subscription_ids or []))
+
+async def resolve_subscription_ids_async(subscription_ids, management_group_id, resource_graph_client):
+    if management_group_id is None:
+        return list(subscription_ids)
+    rows = await rg_inventory.query_resource_graph_async(resource_graph_client, SUBSCRIPTIONS_QUERY, management_group_ids=[management_group_id])
+    return sorted(set(row["subscriptionId"] for row in rows) | set(subscription_ids or []))
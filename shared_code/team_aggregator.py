@@ -0,0 +1,58 @@
+import json
+import os
+
+from shared_code import rollups
+from shared_code.cost_merge import PERIODS
+
+def normalize_team(team):
+    return str(team).strip().lower()
+
+def get_team_cost_keys(default_team_cost_keys):
+    # TEAM_COST_KEYS app setting, e.g. {"AI": "aifTotalCost", "Infra": "infraTotalCost"}
+    team_cost_keys = os.environ.get("TEAM_COST_KEYS")
+    if team_cost_keys:
+        return json.loads(team_cost_keys)
+    return default_team_cost_keys
+
+class TeamAggregator:
+    # One accumulator per period, with the team of each RG resolved once
+    # through a dict of normalized team names
+
+    def __init__(self, team_cost_keys):
+        self.cost_keys = list(dict.fromkeys(team_cost_keys.values()))
+        self.cost_key_by_team = {normalize_team(team): cost_key for team, cost_key in team_cost_keys.items()}
+        self.team_index_by_key = {cost_key: i for i, cost_key in enumerate(self.cost_keys)}
+        self.cost_dicts = {period: self.new_cost_dict() for period in PERIODS}
+
+    def new_cost_dict(self):
+        cost_dict = {}
+        cost_dict["resourceGroupCost"] = list()
+        for cost_key in self.cost_keys:
+            cost_dict[cost_key] = float(0)
+        cost_dict["totalCost"] = float(0)
+        return cost_dict
+
+    def resolve_team(self, rg):
+        # Returns the rgteam label and the team's cost key (None for untracked teams)
+        if rg.tags is not None and "Team" in rg.tags.keys():
+            team = rg.tags.get("Team")
+            return team, self.cost_key_by_team.get(normalize_team(team))
+        return "NA", None
+
+    def get_team_index(self, cost_key):
+        return self.team_index_by_key.get(cost_key, -1)
+
+    def add_costs(self, period, rg_names, teams, team_indexes, costs):
+        # Vectorized: one entry per RG, team totals from a group-by
+        cost_dict = self.cost_dicts.setdefault(period, self.new_cost_dict())
+
+        for i in range(len(rg_names)):
+            cost_dict["resourceGroupCost"].append({
+                "rgname": rg_names[i],
+                "rgteam": teams[i],
+                "rgcost": round(float(costs[i]),2)
+            })
+
+        team_totals = rollups.get_team_totals(costs, team_indexes, len(self.cost_keys))
+        for cost_key, team_total in zip(self.cost_keys, team_totals):
+            cost_dict[cost_key] = cost_dict[cost_key] + float(team_total)
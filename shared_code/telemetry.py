@@ -0,0 +1,148 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from opentelemetry import metrics
+from opentelemetry import trace
+
+# Spans and metrics of the hot paths: credential, RG listing, every cost
+# query, the per-RG fetches, aggregation and serialization. They go to
+# Application Insights when APPLICATIONINSIGHTS_CONNECTION_STRING is set,
+# and to whatever providers set_providers installs otherwise (e.g. the
+# in-memory exporter and reader of opentelemetry.sdk in tests).
+
+INSTRUMENTATION_NAME = "cost_tracker"
+
+PHASE_CREDENTIAL = "credential"
+PHASE_LIST_RESOURCE_GROUPS = "list_resource_groups"
+PHASE_FETCH_ROWS = "fetch_rows"
+PHASE_AGGREGATE = "aggregate"
+PHASE_SERIALIZE = "serialize"
+
+_tracer_provider = None
+_meter_provider = None
+_instruments = None
+_lock = threading.Lock()
+_configured = False
+
+def is_enabled():
+    return os.environ.get("COST_TRACKER_TELEMETRY", "true").lower() == "true"
+
+def configure():
+    # Azure Monitor exporters, once per worker. The distro is only imported
+    # when a connection string is set.
+    global _configured
+
+    with _lock:
+        if _configured:
+            return
+        _configured = True
+
+    if not is_enabled() or not os.environ.get("APPLICATIONINSIGHTS_CONNECTION_STRING"):
+        return
+
+    try:
+        from azure.monitor.opentelemetry import configure_azure_monitor
+
+        configure_azure_monitor()
+    except Exception as e:
+        logging.error(f"[ERROR]: Telemetry export not configured: {e}")
+
+def set_providers(tracer_provider=None, meter_provider=None):
+    # None goes back to the global providers
+    global _tracer_provider, _meter_provider, _instruments, _configured
+
+    with _lock:
+        _tracer_provider = tracer_provider
+        _meter_provider = meter_provider
+        _instruments = None
+        _configured = True
+
+def get_tracer():
+    configure()
+    return (_tracer_provider or trace.get_tracer_provider()).get_tracer(INSTRUMENTATION_NAME)
+
+def _get_instruments():
+    global _instruments
+
+    configure()
+    with _lock:
+        if _instruments is None:
+            meter = (_meter_provider or metrics.get_meter_provider()).get_meter(INSTRUMENTATION_NAME)
+            _instruments = {
+                "phase_duration": meter.create_histogram("cost_tracker.phase.duration", unit="ms", description="Duration of a phase of the cost run"),
+                "query_duration": meter.create_histogram("cost_tracker.query.duration", unit="ms", description="Duration of one Cost Management query call"),
+                "query_calls": meter.create_counter("cost_tracker.query.calls", description="Cost Management query calls"),
+                "query_rows": meter.create_counter("cost_tracker.query.rows", description="Cost rows returned by the queries"),
+                "query_throttled": meter.create_counter("cost_tracker.query.throttled", description="Cost Management query calls answered with 429"),
+                "rg_fetch_duration": meter.create_histogram("cost_tracker.rg.fetch.duration", unit="ms", description="Time to get the cost rows of one RG"),
+                "rg_rows": meter.create_counter("cost_tracker.rg.rows", description="Cost rows of each RG"),
+                "rg_failed": meter.create_counter("cost_tracker.rg.failed", description="RGs left out of the totals"),
+            }
+        return _instruments
+
+@contextmanager
+def phase(name, **attributes):
+    # Span plus duration histogram of one phase, e.g.
+    #   with telemetry.phase(telemetry.PHASE_AGGREGATE, rgs=len(rg_names)):
+    if not is_enabled():
+        yield None
+        return
+
+    start = time.perf_counter()
+    with get_tracer().start_as_current_span(f"cost_tracker.{name}", attributes=attributes) as span:
+        try:
+            yield span
+        finally:
+            _get_instruments()["phase_duration"].record((time.perf_counter() - start) * 1000, {"phase": name})
+
+def get_resource_group(scope):
+    # RG name of a .../resourceGroups/<name> scope, "" for wider scopes
+    scope_parts = scope.rstrip("/").split("/")
+    if len(scope_parts) > 4 and scope_parts[3].lower() == "resourcegroups":
+        return scope_parts[4]
+    return ""
+
+def record_query(scope, duration_secs, status_code, num_rows=None, remaining=None, retry_after=None, attempt=1):
+    # One query.usage call, successful or not
+    if not is_enabled():
+        return
+
+    attributes = {"resource_group": get_resource_group(scope), "status_code": int(status_code or 0)}
+
+    instruments = _get_instruments()
+    instruments["query_duration"].record(duration_secs * 1000, attributes)
+    instruments["query_calls"].add(1, attributes)
+    if num_rows is not None:
+        instruments["query_rows"].add(num_rows, attributes)
+    if status_code == 429:
+        instruments["query_throttled"].add(1, attributes)
+
+    span_attributes = {"scope": scope, "attempt": attempt, "duration_ms": round(duration_secs * 1000, 2), **attributes}
+    if num_rows is not None:
+        span_attributes["rows"] = num_rows
+    if remaining is not None:
+        span_attributes["ratelimit_remaining"] = remaining
+    if retry_after is not None:
+        span_attributes["ratelimit_retry_after"] = retry_after
+
+    # Recorded after the call, so the span is backdated to its start
+    end_ns = time.time_ns()
+    span = get_tracer().start_span("cost_tracker.query_usage", attributes=span_attributes, start_time=end_ns - int(duration_secs * 1e9))
+    span.end(end_time=end_ns)
+
+def record_rg_fetch(rg_name, team, duration_secs, num_rows=None, error=None):
+    # Rows of one RG, from the store, a checkpoint or the queries
+    if not is_enabled():
+        return
+
+    attributes = {"resource_group": str(rg_name), "team": str(team)}
+
+    instruments = _get_instruments()
+    instruments["rg_fetch_duration"].record(duration_secs * 1000, attributes)
+    if num_rows is not None:
+        instruments["rg_rows"].add(num_rows, attributes)
+    if error is not None:
+        instruments["rg_failed"].add(1, attributes)
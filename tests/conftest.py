@@ -0,0 +1,16 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+# The local stand-ins of the Azure clients, shared with the benchmarks
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# Before the shared_code imports read them: nothing persisted outside the
+# stores a test builds itself
+os.environ.setdefault("COST_STORE_BACKEND", "none")
+os.environ.setdefault("CHECKPOINT_STORE_BACKEND", "none")
+os.environ.setdefault("ANOMALY_STORE_BACKEND", "none")
+os.environ.setdefault("ALERT_STATE_STORE_BACKEND", "none")
+os.environ.setdefault("COST_WAREHOUSE_BACKEND", "none")
+os.environ.setdefault("RG_INVENTORY_BACKEND", "arm")
@@ -0,0 +1,112 @@
+import importlib.util
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def load_function(folder):
+    # The function folders are not importable by name
+    spec = importlib.util.spec_from_file_location(folder.replace("-", "_"), os.path.join(ROOT, folder, "__init__.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class FakeClock:
+    # Clock and sleeps of the rate limiter, time only moves when slept
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.sleeps.append(secs)
+        self.now += secs
+
+    async def async_sleep(self, secs):
+        self.sleep(secs)
+
+class FakeActivityTask:
+
+    def __init__(self, result, started_at, duration):
+        self.result = result
+        self.started_at = started_at
+        self.finished_at = started_at + duration
+
+class FakeAnyTask:
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+
+class FakeDurableContext:
+    # Runs an orchestrator generator with the activities called in process.
+    # Activities finish in simulated time, get_duration(name, input) after
+    # they are scheduled, which is when task_any sees them complete.
+
+    def __init__(self, orchestration_input, activities, get_duration=lambda name, activity_input: 1):
+        self.orchestration_input = orchestration_input
+        self.activities = activities
+        self.get_duration = get_duration
+        self.now = 0
+        self.calls = []
+        self.max_running = 0
+        self._running = set()
+
+    def get_input(self):
+        return self.orchestration_input
+
+    def call_activity(self, name, activity_input=None):
+        self.calls.append((name, activity_input, self.now))
+        try:
+            result = self.activities[name](activity_input)
+        except Exception as e:
+            result = e
+        task = FakeActivityTask(result, self.now, self.get_duration(name, activity_input))
+        self._running.add(task)
+        self.max_running = max(self.max_running, len(self._running))
+        return task
+
+    def call_activity_with_retry(self, name, retry_options, activity_input=None):
+        return self.call_activity(name, activity_input)
+
+    def task_any(self, tasks):
+        return FakeAnyTask(tasks)
+
+    def task_all(self, tasks):
+        return list(tasks)
+
+    def resolve(self, yielded):
+        if isinstance(yielded, FakeAnyTask):
+            finished_task = min(yielded.tasks, key=lambda task: task.finished_at)
+            self.now = max(self.now, finished_task.finished_at)
+            self._running.discard(finished_task)
+            return finished_task
+        if isinstance(yielded, list):
+            self.now = max([self.now] + [task.finished_at for task in yielded])
+            self._running.difference_update(yielded)
+            results = [task.result for task in yielded]
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            return results
+        self.now = max(self.now, yielded.finished_at)
+        self._running.discard(yielded)
+        if isinstance(yielded.result, Exception):
+            raise yielded.result
+        return yielded.result
+
+def run_orchestrator(orchestrator_function, context):
+    # A failed activity is raised inside the orchestrator, like the host does
+    generator = orchestrator_function(context)
+    value, error = None, None
+    while True:
+        try:
+            yielded = generator.throw(error) if error is not None else generator.send(value)
+        except StopIteration as e:
+            return e.value
+        value, error = None, None
+        try:
+            value = context.resolve(yielded)
+        except Exception as e:
+            error = e
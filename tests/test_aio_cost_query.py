@@ -0,0 +1,147 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from azure.core.exceptions import HttpResponseError
+
+import fake_azure
+from shared_code import aio_cost_query
+from shared_code import clients
+from shared_code import cost_query
+
+# Not shared with the other tests, the RG inventories are kept per subscription
+SUBSCRIPTION_IDS = ["10000000-0000-0000-0000-000000000001", "10000000-0000-0000-0000-000000000002"]
+
+class Progress:
+
+    def __init__(self):
+        self.total = 0
+        self.done = 0
+
+    def add_total(self, num_rgs):
+        self.total += num_rgs
+
+    def add_done(self, num_rgs):
+        self.done += num_rgs
+
+class FailingQueryOperations(fake_azure.AioFakeQueryOperations):
+    # 403 for the scopes of the given RGs, which no retry gets past
+
+    def __init__(self, service, failing_rg_names):
+        super().__init__(service)
+        self.failing_rg_names = failing_rg_names
+
+    async def usage(self, scope, parameters, raw_response_hook=None, params=None, **kwargs):
+        if scope.rstrip("/").split("/")[-1] in self.failing_rg_names:
+            e = HttpResponseError(message="Fake error 403", response=fake_azure.FakeResponse(403, {}))
+            e.status_code = 403
+            raise e
+        return await super().usage(scope, parameters, raw_response_hook, params, **kwargs)
+
+@pytest.fixture
+def fake_clients():
+    # Three RGs per subscription (and a managed one), with their own names
+    resource_groups_by_subscription = {}
+    for s, subscription_id in enumerate(SUBSCRIPTION_IDS):
+        resource_groups = fake_azure.make_resource_groups(3, num_managed=1)
+        for rg in resource_groups:
+            rg.name = f"s{s}-{rg.name}"
+        resource_groups_by_subscription[subscription_id] = resource_groups
+
+    to_datetime = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    # The 31 days of the window, the last one being to_datetime
+    costs = fake_azure.make_costs([rg for resource_groups in resource_groups_by_subscription.values() for rg in resource_groups], to_datetime + timedelta(days=1), 31, sparsity=0.3)
+    service = fake_azure.FakeCostManagementService(costs, latency_secs=0.01)
+    fake = SimpleNamespace(service=service, costs=costs, to_datetime=to_datetime, from_datetime=to_datetime - timedelta(days=30), cost_mgmt_client=fake_azure.AioFakeCostManagementClient(service))
+
+    clients.set_factory(clients.AIO_CREDENTIAL, lambda: None)
+    clients.set_factory(clients.AIO_COST_MGMT_CLIENT, lambda credential, transport: fake.cost_mgmt_client)
+    clients.set_factory(clients.AIO_RESOURCE_MGMT_CLIENT, lambda credential, subscription_id, transport: fake_azure.AioFakeResourceManagementClient(resource_groups_by_subscription[subscription_id]))
+    clients.set_factory(clients.AIO_RESOURCE_GRAPH_CLIENT, lambda credential, transport: None)
+    yield fake
+
+    clients.reset()
+
+def collect(fake, query_mode, max_concurrency=None, progress=None):
+
+    async def run():
+        try:
+            return await aio_cost_query.collect_subscriptions_rows_of_cost(SUBSCRIPTION_IDS, None, query_mode, fake.from_datetime, fake.to_datetime, max_concurrency, progress)
+        finally:
+            await clients.close_aio_session()
+
+    return asyncio.run(run())
+
+def to_costs(rows_of_cost):
+    return {row[1]: row[0] for row in rows_of_cost}
+
+@pytest.mark.parametrize("query_mode", [cost_query.QUERY_MODE_RESOURCE_GROUP, cost_query.QUERY_MODE_SUBSCRIPTION])
+def test_collects_the_rows_of_every_unmanaged_rg(fake_clients, query_mode):
+    progress = Progress()
+
+    rows_of_cost_by_subscription = collect(fake_clients, query_mode, progress=progress)
+
+    assert list(rows_of_cost_by_subscription.keys()) == SUBSCRIPTION_IDS
+    for s, subscription_id in enumerate(SUBSCRIPTION_IDS):
+        resource_groups_list, rows_of_cost_by_rg, breakdown_by_rg = rows_of_cost_by_subscription[subscription_id]
+        rg_names = [f"s{s}-rg-{i}" for i in range(3)]
+        assert sorted(rg.name for rg in resource_groups_list if rg.managed_by is None) == rg_names
+        for rg_name in rg_names:
+            assert to_costs(rows_of_cost_by_rg.get(rg_name, [])) == fake_clients.costs[rg_name]
+        assert breakdown_by_rg is None
+
+    assert progress.total == 6
+    assert progress.done == 6
+
+@pytest.mark.parametrize("query_mode", [cost_query.QUERY_MODE_RESOURCE_GROUP, cost_query.QUERY_MODE_SUBSCRIPTION])
+def test_every_page_is_followed_and_every_row_returned_once(fake_clients, query_mode):
+    fake_clients.service.page_size = 4
+
+    rows_of_cost_by_subscription = collect(fake_clients, query_mode)
+
+    for s, subscription_id in enumerate(SUBSCRIPTION_IDS):
+        _, rows_of_cost_by_rg, _ = rows_of_cost_by_subscription[subscription_id]
+        for rg_name in [f"s{s}-rg-{i}" for i in range(3)]:
+            assert sorted((row[1], row[0]) for row in rows_of_cost_by_rg[rg_name]) == sorted(fake_clients.costs[rg_name].items())
+    # More than one query per RG, or per subscription
+    assert fake_clients.service.calls > (6 if query_mode == cost_query.QUERY_MODE_RESOURCE_GROUP else 2)
+
+def test_rg_queries_in_flight_stay_under_max_concurrency(fake_clients):
+    collect(fake_clients, cost_query.QUERY_MODE_RESOURCE_GROUP, max_concurrency=2)
+
+    assert fake_clients.service.calls == 6
+    assert fake_clients.service.peak_in_flight == 2
+
+def test_a_failed_rg_holds_its_error(fake_clients):
+    fake_clients.cost_mgmt_client.query = FailingQueryOperations(fake_clients.service, {"s0-rg-1"})
+    progress = Progress()
+
+    rows_of_cost_by_subscription = collect(fake_clients, cost_query.QUERY_MODE_RESOURCE_GROUP, progress=progress)
+
+    _, rows_of_cost_by_rg, _ = rows_of_cost_by_subscription[SUBSCRIPTION_IDS[0]]
+    assert isinstance(rows_of_cost_by_rg["s0-rg-1"], HttpResponseError)
+    assert to_costs(rows_of_cost_by_rg["s0-rg-0"]) == fake_clients.costs["s0-rg-0"]
+    # The failed RG counts as done
+    assert progress.done == 6
+
+def test_a_failed_subscription_query_fails_its_rgs_only(fake_clients):
+    fake_clients.cost_mgmt_client.query = FailingQueryOperations(fake_clients.service, {SUBSCRIPTION_IDS[1]})
+
+    rows_of_cost_by_subscription = collect(fake_clients, cost_query.QUERY_MODE_SUBSCRIPTION)
+
+    _, failed_rows_of_cost_by_rg, _ = rows_of_cost_by_subscription[SUBSCRIPTION_IDS[1]]
+    assert sorted(failed_rows_of_cost_by_rg.keys()) == [f"s1-rg-{i}" for i in range(3)]
+    assert all(isinstance(rows_of_cost, HttpResponseError) for rows_of_cost in failed_rows_of_cost_by_rg.values())
+    _, rows_of_cost_by_rg, _ = rows_of_cost_by_subscription[SUBSCRIPTION_IDS[0]]
+    assert to_costs(rows_of_cost_by_rg["s0-rg-2"]) == fake_clients.costs["s0-rg-2"]
+
+def test_breakdown_dimension_in_resource_group_mode_is_logged_once(fake_clients, caplog, monkeypatch):
+    monkeypatch.setenv("COST_BREAKDOWN_DIMENSION", "ServiceName")
+
+    with caplog.at_level(logging.WARNING):
+        rows_of_cost_by_subscription = collect(fake_clients, cost_query.QUERY_MODE_RESOURCE_GROUP)
+
+    assert len([record for record in caplog.records if "COST_BREAKDOWN_DIMENSION" in record.getMessage()]) == 1
+    assert all(breakdown_by_rg is None for _, _, breakdown_by_rg in rows_of_cost_by_subscription.values())
@@ -0,0 +1,161 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from shared_code import anomaly_detection
+
+SCOPE = "/subscriptions/s/resourceGroups/"
+FROM_DATE = date(2026, 9, 1)
+NUM_DAYS = 40
+SPIKE_DAY = 36
+SPIKE_COST = 30.0
+
+ALPHA = 0.1
+Z_THRESHOLD = 3.0
+MIN_DAYS = 7
+
+def new_series(spike_day=SPIKE_DAY):
+    # One steady RG around 10 with a single spike, and a flat one
+    series = np.vstack([10 + 0.5 * np.sin(np.arange(NUM_DAYS)), np.full(NUM_DAYS, 5.0)])
+    if spike_day is not None:
+        series[0, spike_day] = SPIKE_COST
+    return series
+
+def new_stats(num_rgs):
+    return np.zeros(num_rgs, dtype=np.int64), np.zeros(num_rgs, dtype=np.int64), np.zeros(num_rgs), np.zeros(num_rgs)
+
+def get_usage_dates(num_days):
+    return np.array([int((FROM_DATE + timedelta(days=day)).strftime("%Y%m%d")) for day in range(num_days)], dtype=np.int64)
+
+def update(series, stats=None, min_days=MIN_DAYS):
+    last_dates, counts, means, variances = stats or new_stats(series.shape[0])
+    spikes = anomaly_detection.update_stats(series, get_usage_dates(series.shape[1]), last_dates, counts, means, variances, ALPHA, Z_THRESHOLD, min_days, 1.0, 0.25)
+    return spikes, (last_dates, counts, means, variances)
+
+def test_running_mean_hands_over_to_the_ewma():
+    series = new_series(spike_day=None)[:1]
+    warmup_days = round(1 / ALPHA)
+
+    # Welford's exact mean and (population) variance while warming up
+    for num_days in range(1, warmup_days + 1):
+        _, (_, counts, means, variances) = update(series[:, :num_days])
+        assert counts[0] == num_days
+        assert means[0] == pytest.approx(series[0, :num_days].mean())
+        assert variances[0] == pytest.approx(series[0, :num_days].var())
+
+    # Then a fixed weight of alpha per day
+    _, (_, _, means, variances) = update(series[:, :warmup_days])
+    mean, variance = means[0], variances[0]
+    for cost in series[0, warmup_days:]:
+        diff = cost - mean
+        mean, variance = mean + ALPHA * diff, (1 - ALPHA) * (variance + ALPHA * diff * diff)
+    _, (_, _, means, variances) = update(series)
+    assert (means[0], variances[0]) == pytest.approx((mean, variance))
+
+def test_one_spike_is_flagged_and_fed_capped():
+    series = new_series()
+
+    spikes_before, (_, _, means, variances) = update(series[:, :SPIKE_DAY])
+    mean, std = means[0], np.sqrt(variances[0])
+    spikes, (_, _, means, _) = update(series[:, :SPIKE_DAY + 1])
+
+    assert spikes_before == []
+    assert len(spikes) == 1
+    i, day, expected_cost, z_score = spikes[0]
+    assert (i, day) == (0, SPIKE_DAY)
+    assert expected_cost == pytest.approx(mean)
+    assert z_score == pytest.approx((SPIKE_COST - mean) / std)
+    # The mean moves towards the threshold, not the spike
+    assert means[0] == pytest.approx(mean + ALPHA * Z_THRESHOLD * std)
+
+def test_a_capped_spike_does_not_hide_the_next_one():
+    series = new_series()
+    series[0, SPIKE_DAY + 2] = SPIKE_COST
+
+    spikes, _ = update(series)
+
+    assert [(i, day) for i, day, _, _ in spikes] == [(0, SPIKE_DAY), (0, SPIKE_DAY + 2)]
+
+def test_no_spike_before_the_minimum_history():
+    series = new_series(spike_day=MIN_DAYS - 1)
+
+    spikes, _ = update(series)
+    assert spikes == []
+
+    spikes, _ = update(series, min_days=MIN_DAYS - 1)
+    assert [(i, day) for i, day, _, _ in spikes] == [(0, MIN_DAYS - 1)]
+
+class MemoryAnomalyStore:
+
+    def __init__(self):
+        self.states = {}
+        self.saves = []
+
+    def get_states(self, state_key):
+        return {rg: dict(state) for rg, state in self.states.get(state_key, {}).items()}
+
+    def save_states(self, state_key, states):
+        self.saves.append(sorted(states.keys()))
+        self.states.setdefault(state_key, {}).update(states)
+
+def detect(store, series, from_date=FROM_DATE):
+    # The matrix of a run ends with yesterday, which is left for the next run
+    cost_matrix = np.hstack([series, np.zeros((series.shape[0], 1))])
+    return anomaly_detection.detect_anomalies(SCOPE, cost_matrix, from_date, ["RG-Steady", "rg-flat"], ["AI", "Infra"], store=store)
+
+@pytest.mark.parametrize("store_factory", [
+    lambda tmp_path: MemoryAnomalyStore(),
+    lambda tmp_path: anomaly_detection.SqliteAnomalyStore(str(tmp_path / "anomaly_store.sqlite3")),
+])
+def test_state_carries_over_between_runs(tmp_path, store_factory):
+    series = new_series()
+    store = store_factory(tmp_path)
+
+    # Daily runs over a 31 day window, a day later each time
+    anomalies_by_run = []
+    for run in range(NUM_DAYS - 30):
+        anomalies_by_run.append(detect(store, series[:, run:run + 31], FROM_DATE + timedelta(days=run)))
+
+    states = store.get_states("s")
+    one_run_store = MemoryAnomalyStore()
+    detect(one_run_store, series)
+    # The same statistics as one run over every day
+    for rg in ["rg-steady", "rg-flat"]:
+        assert {key: states[rg][key] for key in ["lastDate", "count"]} == {key: one_run_store.states["s"][rg][key] for key in ["lastDate", "count"]}
+        assert (states[rg]["mean"], states[rg]["variance"]) == pytest.approx((one_run_store.states["s"][rg]["mean"], one_run_store.states["s"][rg]["variance"]))
+    assert states["rg-steady"]["count"] == NUM_DAYS
+
+    # Reported from the run that first sees it, for the report days
+    assert [len(anomalies) for anomalies in anomalies_by_run] == [0] * 6 + [1] * 4
+    assert all(anomalies == anomalies_by_run[6] for anomalies in anomalies_by_run[6:])
+    anomaly = anomalies_by_run[6][0]
+    assert {key: anomaly[key] for key in ["rgname", "rgteam", "date", "cost"]} == {"rgname": "RG-Steady", "rgteam": "AI", "date": str(FROM_DATE + timedelta(days=SPIKE_DAY)), "cost": SPIKE_COST}
+    assert anomaly["expectedCost"] == pytest.approx(10, abs=0.5)
+    assert anomaly["zScore"] >= Z_THRESHOLD
+
+def test_a_rerun_of_the_same_window_feeds_nothing():
+    series = new_series()
+    store = MemoryAnomalyStore()
+    anomalies = detect(store, series)
+    num_saves = len(store.saves)
+    states = store.get_states("s")
+
+    assert detect(store, series) == anomalies
+    assert len(store.saves) == num_saves
+    assert store.get_states("s") == states
+
+def test_old_anomalies_age_out():
+    series = new_series(spike_day=20)
+    store = MemoryAnomalyStore()
+
+    assert [anomaly["date"] for anomaly in detect(store, series[:, :25])] == [str(FROM_DATE + timedelta(days=20))]
+    assert detect(store, series[:, 5:35], FROM_DATE + timedelta(days=5)) == []
+    assert store.get_states("s")["rg-steady"]["anomalies"] == []
+
+def test_no_store_is_no_anomalies(monkeypatch):
+    monkeypatch.delenv("ANOMALY_STORE_BACKEND", raising=False)
+    monkeypatch.setattr(anomaly_detection, "_anomaly_store", None)
+
+    assert anomaly_detection.get_anomaly_store() is None
+    assert detect(None, new_series()) == []
@@ -0,0 +1,122 @@
+import json
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from shared_code import budget_alerts
+from shared_code import cost_merge
+from shared_code import cost_query
+from shared_code import cost_store
+from shared_code import rgs_cost
+
+ALERT_SCOPE = "/subscriptions/s/resourceGroups/"
+BUDGETS = {
+    "thresholds": [0.8, 1.0],
+    "teams": {"AI": {"monthly": 100}},
+    "resourceGroups": {"rg-0": {"monthly": 50}},
+}
+
+@pytest.fixture
+def file_sink(tmp_path, monkeypatch):
+    # The notifications go to the file sink, the alerted breaches to a sqlite
+    # state store of the test's own
+    path = tmp_path / "cost_alerts.jsonl"
+    monkeypatch.setenv("COST_ALERT_SINKS", budget_alerts.SINK_FILE)
+    monkeypatch.setenv("COST_ALERT_FILE_PATH", str(path))
+    monkeypatch.setattr(budget_alerts, "_alert_state_store", budget_alerts.SqliteAlertStateStore(str(tmp_path / "alert_state_store.sqlite3")))
+    budget_alerts.set_budgets(BUDGETS)
+    yield SimpleNamespace(path=path, store=budget_alerts._alert_state_store)
+
+    budget_alerts.set_budgets(None)
+
+def get_notifications(file_sink):
+    if not file_sink.path.exists():
+        return []
+    return [json.loads(line) for line in file_sink.path.read_text().splitlines()]
+
+def new_rgs_cost_dict(ai_cost, rg_0_cost):
+    monthly = {
+        "resourceGroupCost": [{"rgname": "rg-0", "rgteam": "AI", "rgcost": rg_0_cost}, {"rgname": "rg-1", "rgteam": "AI", "rgcost": ai_cost - rg_0_cost}],
+        "aiTotalCost": ai_cost,
+        "totalCost": ai_cost,
+    }
+    rgs_cost_dict = {"monthly": monthly}
+    rgs_cost_dict[cost_merge.BUDGET_BREACHES] = budget_alerts.get_rg_breaches(rgs_cost_dict)
+    return rgs_cost_dict
+
+def alert(ai_cost, rg_0_cost):
+    return budget_alerts.alert(new_rgs_cost_dict(ai_cost, rg_0_cost), ALERT_SCOPE)
+
+def get_breaches(notification):
+    return sorted((breach["level"], breach["name"], breach["threshold"]) for breach in notification["breaches"])
+
+def test_breaches_go_out_once_until_they_change(file_sink):
+    alert(ai_cost=90, rg_0_cost=60)
+    alert(ai_cost=95, rg_0_cost=60)
+
+    notifications = get_notifications(file_sink)
+    assert len(notifications) == 1
+    assert get_breaches(notifications[0]) == [("resourceGroup", "rg-0", 1.0), ("team", "AI", 0.8)]
+    assert notifications[0]["scope"] == ALERT_SCOPE
+
+    # A higher threshold is a new breach, the ones already sent are not repeated
+    alert(ai_cost=120, rg_0_cost=60)
+    notifications = get_notifications(file_sink)
+    assert len(notifications) == 2
+    assert get_breaches(notifications[1]) == [("team", "AI", 1.0)]
+
+def test_cleared_breach_alerts_again_when_it_comes_back(file_sink):
+    alert(ai_cost=60, rg_0_cost=60)
+    alert(ai_cost=30, rg_0_cost=30)
+    alert(ai_cost=60, rg_0_cost=60)
+
+    notifications = get_notifications(file_sink)
+    assert [get_breaches(notification) for notification in notifications] == [[("resourceGroup", "rg-0", 1.0)]] * 2
+
+def test_breach_realerted_after_the_realert_hours(file_sink, monkeypatch):
+    monkeypatch.setenv("COST_ALERT_REALERT_HOURS", "24")
+    alert(ai_cost=60, rg_0_cost=60)
+
+    # Sent 23 hours ago: not yet
+    alerted = file_sink.store.get_alerted(ALERT_SCOPE)
+    file_sink.store.save_alerted(ALERT_SCOPE, {key: (datetime.now(timezone.utc) - timedelta(hours=23)).isoformat() for key in alerted}, [])
+    alert(ai_cost=60, rg_0_cost=60)
+    assert len(get_notifications(file_sink)) == 1
+
+    file_sink.store.save_alerted(ALERT_SCOPE, {key: (datetime.now(timezone.utc) - timedelta(hours=25)).isoformat() for key in alerted}, [])
+    alert(ai_cost=60, rg_0_cost=60)
+    assert len(get_notifications(file_sink)) == 2
+
+def test_undelivered_breaches_are_tried_again(file_sink, monkeypatch):
+    class BrokenSink:
+        def send(self, notification):
+            raise OSError("unreachable")
+    monkeypatch.setattr(budget_alerts, "_sink_factories", dict(budget_alerts._sink_factories))
+    budget_alerts.set_sink_factory("broken", BrokenSink)
+    monkeypatch.setenv("COST_ALERT_SINKS", "broken")
+
+    assert alert(ai_cost=60, rg_0_cost=60) is not None
+    assert file_sink.store.get_alerted(ALERT_SCOPE) == {}
+
+    monkeypatch.setenv("COST_ALERT_SINKS", budget_alerts.SINK_FILE)
+    alert(ai_cost=60, rg_0_cost=60)
+    assert len(get_notifications(file_sink)) == 1
+
+def test_unreadable_budgets_do_not_fail_the_run(monkeypatch, tmp_path):
+    budget_alerts.set_budgets(None)
+    monkeypatch.delenv("COST_BUDGETS", raising=False)
+    monkeypatch.setenv("COST_BUDGETS_PATH", str(tmp_path / "missing.json"))
+    to_datetime = datetime(2026, 10, 17, 23, 59, tzinfo=timezone.utc)
+    from_datetime = datetime(2026, 9, 17, tzinfo=timezone.utc)
+
+    def get_cost(scope_with_rg, query_from_datetime, query_to_datetime):
+        return [cost_query.CostRow(1.0, cost_store.to_usage_date(query_from_datetime + timedelta(days=day)), "rg-0", "USD") for day in range(31)]
+
+    try:
+        cost_dicts = rgs_cost.get_rgs_cost([SimpleNamespace(name="rg-0", managed_by=None, tags={"Team": "AI"})], ALERT_SCOPE, from_datetime, to_datetime, get_cost, {"AI": "aiTotalCost"})
+        assert cost_dicts[cost_merge.BUDGET_BREACHES] == []
+        assert cost_dicts["monthly"]["aiTotalCost"] == 30.0
+        assert budget_alerts.alert(cost_dicts, ALERT_SCOPE) is None
+    finally:
+        budget_alerts.set_budgets(None)
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from shared_code import checkpoint_store
+from shared_code import cost_merge
+from shared_code import cost_query
+from shared_code import cost_store
+from shared_code import rgs_cost
+from tests.helpers import FakeClock
+
+SCOPE = "/subscriptions/s/resourceGroups/"
+TEAM_COST_KEYS = {"AI": "aiTotalCost"}
+TO_DATETIME = datetime(2026, 10, 17, 23, 59, tzinfo=timezone.utc)
+FROM_DATETIME = datetime(2026, 9, 17, tzinfo=timezone.utc)
+RESOURCE_GROUPS = [SimpleNamespace(name=f"rg-{i}", managed_by=None, tags={"Team": "AI"}) for i in range(5)]
+
+class WorkerRecycled(BaseException):
+    # Stands for the host killing the activity, which nothing in the run catches
+    pass
+
+class CostQuery:
+    # get_cost of get_rgs_cost, one row a day worth i + 1 for rg-i
+
+    def __init__(self, recycle_at=None, failing_rg_names=()):
+        self.queried = []
+        self.recycle_at = recycle_at
+        self.failing_rg_names = failing_rg_names
+
+    def __call__(self, scope_with_rg, from_datetime, to_datetime):
+        rg_name = scope_with_rg.split("/")[-1]
+        if rg_name == self.recycle_at:
+            raise WorkerRecycled()
+        self.queried.append(rg_name)
+        if rg_name in self.failing_rg_names:
+            raise RuntimeError("Fake error 403")
+        num_days = (to_datetime.date() - from_datetime.date()).days + 1
+        return [cost_query.CostRow(float(rg_name.split("-")[1]) + 1, cost_store.to_usage_date(from_datetime + timedelta(days=day)), rg_name, "USD") for day in range(num_days)]
+
+@pytest.fixture
+def store(tmp_path):
+    return checkpoint_store.SqliteCheckpointStore(str(tmp_path / "checkpoint_store.sqlite3"))
+
+def new_checkpoint(store):
+    return checkpoint_store.RunCheckpoint(store, checkpoint_store.get_run_id(SCOPE, FROM_DATETIME, TO_DATETIME, [rg.name for rg in RESOURCE_GROUPS]))
+
+def get_rgs_cost(get_cost, checkpoint):
+    return rgs_cost.get_rgs_cost(RESOURCE_GROUPS, SCOPE, FROM_DATETIME, TO_DATETIME, get_cost, TEAM_COST_KEYS, catch_errors=False, checkpoint=checkpoint)
+
+def test_rerun_resumes_after_the_rgs_already_fetched(store):
+    first_query = CostQuery(recycle_at="rg-3")
+    with pytest.raises(WorkerRecycled):
+        get_rgs_cost(first_query, new_checkpoint(store))
+    assert first_query.queried == ["rg-0", "rg-1", "rg-2"]
+
+    second_query = CostQuery()
+    cost_dicts = get_rgs_cost(second_query, new_checkpoint(store))
+
+    assert second_query.queried == ["rg-3", "rg-4"]
+    # Same totals as a run without the restart
+    assert cost_dicts["monthly"]["aiTotalCost"] == pytest.approx(30 * (1 + 2 + 3 + 4 + 5))
+    assert store.get_rows_by_rg(new_checkpoint(store).run_id) == {}
+
+def test_checkpoint_cleared_when_the_totals_leave_rgs_out(store):
+    cost_dicts = get_rgs_cost(CostQuery(failing_rg_names={"rg-1"}), new_checkpoint(store))
+
+    assert [failed_rg["rgname"] for failed_rg in cost_dicts[cost_merge.FAILED_RESOURCE_GROUPS]] == ["rg-1"]
+    assert store.get_rows_by_rg(new_checkpoint(store).run_id) == {}
+
+def test_expired_checkpoints_are_purged(store, monkeypatch):
+    store.save_rows("old-run", "rg-0", [[1.0, 20261001, "rg-0", "USD"]])
+    store._conn.execute("UPDATE checkpoints SET saved_at = ?", ((datetime.now(timezone.utc) - timedelta(days=2)).isoformat(),))
+    store.save_rows("new-run", "rg-0", [[1.0, 20261017, "rg-0", "USD"]])
+    monkeypatch.setattr(checkpoint_store, "_purged_at", None)
+    clock = FakeClock()
+
+    checkpoint_store.purge_expired(store, clock=clock)
+
+    assert store.get_rows_by_rg("old-run") == {}
+    assert store.get_rows_by_rg("new-run") != {}
+
+    # Not before another TTL
+    store.save_rows("new-run", "rg-1", [[1.0, 20261017, "rg-1", "USD"]])
+    store._conn.execute("UPDATE checkpoints SET saved_at = ?", ((datetime.now(timezone.utc) - timedelta(days=2)).isoformat(),))
+    checkpoint_store.purge_expired(store, clock=clock)
+    assert len(store.get_rows_by_rg("new-run")) == 2
+    clock.sleep(checkpoint_store.get_ttl_secs())
+    checkpoint_store.purge_expired(store, clock=clock)
+    assert store.get_rows_by_rg("new-run") == {}
@@ -0,0 +1,110 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from shared_code import clients
+from tests.helpers import FakeClock
+
+class Factory:
+    # Counts the objects it builds, each one a new namespace of its arguments
+
+    def __init__(self):
+        self.built = []
+
+    def __call__(self, *args):
+        built = SimpleNamespace(args=args)
+        self.built.append(built)
+        return built
+
+@pytest.fixture
+def factories():
+    factories = {name: Factory() for name in [
+        clients.CREDENTIAL, clients.COST_MGMT_CLIENT, clients.RESOURCE_MGMT_CLIENT, clients.RESOURCE_GRAPH_CLIENT,
+        clients.AIO_CREDENTIAL, clients.AIO_COST_MGMT_CLIENT, clients.AIO_RESOURCE_MGMT_CLIENT, clients.AIO_RESOURCE_GRAPH_CLIENT,
+    ]}
+    for name, factory in factories.items():
+        clients.set_factory(name, factory)
+    yield factories
+
+    clients.reset()
+
+def test_clients_are_pooled_with_one_credential(factories):
+    cost_mgmt_client = clients.get_cost_mgmt_client()
+
+    assert clients.get_cost_mgmt_client() is cost_mgmt_client
+    assert clients.get_resource_graph_client() is clients.get_resource_graph_client()
+    assert len(factories[clients.COST_MGMT_CLIENT].built) == 1
+    assert len(factories[clients.CREDENTIAL].built) == 1
+    assert cost_mgmt_client.args == (factories[clients.CREDENTIAL].built[0],)
+
+def test_resource_mgmt_clients_are_pooled_per_subscription(factories):
+    first = clients.get_resource_mgmt_client("s1")
+
+    assert clients.get_resource_mgmt_client("s1") is first
+    assert clients.get_resource_mgmt_client("s2") is not first
+    assert [built.args[1] for built in factories[clients.RESOURCE_MGMT_CLIENT].built] == ["s1", "s2"]
+
+def test_set_factory_drops_the_pooled_objects(factories):
+    cost_mgmt_client = clients.get_cost_mgmt_client()
+
+    clients.set_factory(clients.COST_MGMT_CLIENT, lambda credential: "replaced")
+
+    assert clients.get_cost_mgmt_client() == "replaced"
+    assert clients.get_cost_mgmt_client() is not cost_mgmt_client
+    # The credential was dropped with the rest of the pool
+    assert len(factories[clients.CREDENTIAL].built) == 2
+
+def test_reset_restores_the_real_clients(factories):
+    clients.get_cost_mgmt_client()
+
+    clients.reset()
+
+    cost_mgmt_client = clients.get_cost_mgmt_client()
+    assert type(cost_mgmt_client).__name__ == "CostManagementClient"
+    assert isinstance(clients.get_credential(), clients.CachedTokenCredential)
+    # The Cost Management queries are only retried by rate_limiter.query_usage
+    assert cost_mgmt_client._config.retry_policy.total_retries == 0
+    # Only the client from before the reset came from the fake
+    assert len(factories[clients.COST_MGMT_CLIENT].built) == 1
+
+def test_aio_clients_are_pooled_per_event_loop(factories):
+
+    async def get_clients():
+        try:
+            return clients.get_aio_cost_mgmt_client(), clients.get_aio_cost_mgmt_client(), clients.get_aio_resource_mgmt_client("s1")
+        finally:
+            await clients.close_aio_session()
+
+    first, again, resource_mgmt_client = asyncio.run(get_clients())
+    second, _, _ = asyncio.run(get_clients())
+
+    assert again is first
+    assert second is not first
+    assert len(factories[clients.AIO_COST_MGMT_CLIENT].built) == 2
+    # Every aio client of a loop shares its credential
+    assert resource_mgmt_client.args[0] is first.args[0]
+
+class FakeCredential:
+
+    def __init__(self, clock, lifetime_secs):
+        self.clock = clock
+        self.lifetime_secs = lifetime_secs
+        self.calls = 0
+
+    def get_token(self, *scopes, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(token=f"token-{self.calls}", expires_on=self.clock() + self.lifetime_secs)
+
+def test_token_served_from_cache_until_close_to_expiry():
+    clock = FakeClock()
+    credential = FakeCredential(clock, lifetime_secs=3600)
+    cached_credential = clients.CachedTokenCredential(credential, clock=clock)
+
+    assert cached_credential.get_token("scope").token == "token-1"
+    clock.sleep(3600 - clients.TOKEN_REFRESH_MARGIN_SECS - 1)
+    assert cached_credential.get_token("scope").token == "token-1"
+    clock.sleep(1)
+    assert cached_credential.get_token("scope").token == "token-2"
+    # A claims challenge always asks the credential
+    assert cached_credential.get_token("scope", claims="{}").token == "token-3"
@@ -0,0 +1,111 @@
+import logging
+from datetime import datetime, timezone
+
+import pytest
+
+from shared_code import cost_breakdown
+
+TO_DATETIME = datetime(2026, 10, 17, 23, 59, tzinfo=timezone.utc)
+YESTERDAY = 20261017
+LAST_WEEK_DAY = 20261012
+LAST_MONTH_DAY = 20260920
+
+def new_accumulator(top_n=2, max_tracked=100):
+    return cost_breakdown.BreakdownAccumulator("ServiceName", cost_breakdown.get_period_windows(TO_DATETIME), top_n=top_n, max_tracked=max_tracked)
+
+def test_period_windows():
+    assert cost_breakdown.get_period_windows(TO_DATETIME, [90]) == {
+        "yesterday": (20261017, 20261017),
+        "weekly": (20261010, 20261016),
+        "monthly": (20260917, 20261016),
+        "last90Days": (20260719, 20261016),
+    }
+
+def test_top_n_values_and_the_rest_in_other():
+    accumulator = new_accumulator()
+    for value, cost in [("Storage", 1.0), ("Compute", 10.0), ("Network", 3.0), ("Databricks", 5.0)]:
+        accumulator.add("RG-A", value, LAST_MONTH_DAY, cost)
+        accumulator.add("rg-a", value, LAST_WEEK_DAY, cost)
+    accumulator.add("rg-a", "Storage", YESTERDAY, 0.5)
+    # Outside every window
+    accumulator.add("rg-a", "Compute", 20260101, 100.0)
+
+    assert accumulator.get_breakdowns() == {"rg-a": {
+        "yesterday": [{"name": "Storage", "cost": 0.5}],
+        "weekly": [{"name": "Compute", "cost": 10.0}, {"name": "Databricks", "cost": 5.0}, {"name": cost_breakdown.OTHER, "cost": 4.0}],
+        "monthly": [{"name": "Compute", "cost": 20.0}, {"name": "Databricks", "cost": 10.0}, {"name": cost_breakdown.OTHER, "cost": 8.0}],
+    }}
+
+def test_no_other_within_top_n_and_unassigned_values():
+    accumulator = new_accumulator()
+    accumulator.add("rg-a", "Compute", LAST_WEEK_DAY, 2.0)
+    accumulator.add("rg-a", None, LAST_WEEK_DAY, 1.0)
+    accumulator.add("rg-a", "", LAST_WEEK_DAY, 1.0)
+    accumulator.add("rg-a", "Refund", LAST_WEEK_DAY, 0.0)
+
+    breakdown = accumulator.get_breakdowns()["rg-a"]
+
+    assert breakdown["weekly"] == [{"name": "Compute", "cost": 2.0}, {"name": cost_breakdown.UNASSIGNED, "cost": 2.0}]
+    assert "yesterday" not in breakdown
+
+def test_values_past_max_tracked_fold_into_other():
+    accumulator = new_accumulator(top_n=3, max_tracked=4)
+    # Ranked by the longest window, the yesterday-only value ranks last
+    accumulator.add("rg-a", "Yesterday-Only", YESTERDAY, 50.0)
+    for i, cost in enumerate([8.0, 4.0, 2.0]):
+        accumulator.add("rg-a", f"Value-{i}", LAST_MONTH_DAY, cost)
+
+    accumulator.add("rg-a", "Value-3", LAST_MONTH_DAY, 1.0)
+
+    # The cheapest half (Yesterday-Only and Value-2) is folded
+    assert set(accumulator.costs_by_rg["rg-a"].keys()) == {"Value-0", "Value-1", "Value-3", cost_breakdown.OTHER}
+    breakdown = accumulator.get_breakdowns()["rg-a"]
+    assert breakdown["yesterday"] == [{"name": cost_breakdown.OTHER, "cost": 50.0}]
+    assert breakdown["monthly"] == [{"name": "Value-0", "cost": 8.0}, {"name": "Value-1", "cost": 4.0}, {"name": "Value-3", "cost": 1.0}, {"name": cost_breakdown.OTHER, "cost": 2.0}]
+
+def test_folds_keep_every_rg_bounded_and_the_totals_whole():
+    accumulator = new_accumulator(top_n=5, max_tracked=10)
+    for i in range(1000):
+        accumulator.add("rg-a", f"/resource/{i}", LAST_MONTH_DAY, 1.0 + i % 7)
+
+    assert len(accumulator.costs_by_rg["rg-a"]) <= 11
+    monthly = accumulator.get_breakdowns()["rg-a"]["monthly"]
+    assert len(monthly) == 6
+    assert monthly[-1]["name"] == cost_breakdown.OTHER
+    assert sum(value["cost"] for value in monthly) == pytest.approx(sum(1.0 + i % 7 for i in range(1000)))
+
+def test_breakdowns_nest_in_their_rg_costs():
+    cost_dicts = {
+        "monthly": {"resourceGroupCost": [{"rgname": "RG-A", "rgcost": 3.0}, {"rgname": "rg-b", "rgcost": 1.0}], "totalCost": 4.0},
+        "weekly": {"resourceGroupCost": [{"rgname": "RG-A", "rgcost": 1.0}], "totalCost": 1.0},
+    }
+
+    cost_breakdown.add_breakdowns(cost_dicts, {"rg-a": {"monthly": [{"name": "Compute", "cost": 3.0}]}})
+
+    assert cost_dicts["monthly"]["resourceGroupCost"][0]["breakdown"] == [{"name": "Compute", "cost": 3.0}]
+    assert "breakdown" not in cost_dicts["monthly"]["resourceGroupCost"][1]
+    assert "breakdown" not in cost_dicts["weekly"]["resourceGroupCost"][0]
+
+def test_more_than_one_dimension_is_rejected(monkeypatch):
+    monkeypatch.setenv("COST_BREAKDOWN_DIMENSION", "ServiceName, MeterCategory")
+
+    with pytest.raises(ValueError):
+        cost_breakdown.new_accumulator(TO_DATETIME)
+
+@pytest.mark.parametrize("dimension, expected_warnings", [
+    ("ServiceName", 1),
+    # Not validated when unused
+    ("ServiceName, MeterCategory", 1),
+    (" ", 0),
+    (None, 0),
+])
+def test_dimension_ignored_in_resource_group_mode_is_logged(caplog, monkeypatch, dimension, expected_warnings):
+    if dimension is None:
+        monkeypatch.delenv("COST_BREAKDOWN_DIMENSION", raising=False)
+    else:
+        monkeypatch.setenv("COST_BREAKDOWN_DIMENSION", dimension)
+
+    with caplog.at_level(logging.WARNING):
+        cost_breakdown.log_ignored_dimension()
+
+    assert len([record for record in caplog.records if "COST_BREAKDOWN_DIMENSION" in record.getMessage()]) == expected_warnings
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from shared_code import cost_merge
+from shared_code import cost_payload
+from shared_code import cost_query
+from shared_code import cost_store
+from shared_code import forecast
+from shared_code import rgs_cost
+
+SCOPE = "/subscriptions/s/resourceGroups/"
+TO_DATETIME = datetime(2026, 10, 17, 23, 59, tzinfo=timezone.utc)
+FROM_DATETIME = datetime(2026, 9, 17, tzinfo=timezone.utc)
+TEAM_COST_KEYS = {"Infra": "infraTotalCost", "AI": "aiTotalCost", "Network": "nwTotalCost"}
+
+PAYLOAD_FORMATS = [cost_payload.FORMAT_JSON, cost_payload.FORMAT_COLUMNAR, cost_payload.FORMAT_COLUMNAR_GZIP]
+
+def new_resource_groups():
+    teams = ["AI", "Infra", None, "AI", "Network", "Infra"]
+    resource_groups = [SimpleNamespace(name=f"rg-{i}", managed_by=None, tags={"Team": team} if team else None) for i, team in enumerate(teams)]
+    return resource_groups + [SimpleNamespace(name="rg-managed", managed_by="/subscriptions/s/providers/Microsoft.Databricks/workspaces/w", tags=None)]
+
+def get_cost(scope_with_rg, from_datetime, to_datetime):
+    # rg-3 fails, rg-5 has no rows, the others a growing daily cost
+    rg_name = scope_with_rg.split("/")[-1]
+    if rg_name == "rg-3":
+        raise RuntimeError("Fake error 403")
+    if rg_name == "rg-5":
+        return []
+    i = int(rg_name.split("-")[1])
+    return [cost_query.CostRow(round(1.5 * (i + 1) + 0.1 * day, 4), cost_store.to_usage_date(from_datetime + timedelta(days=day)), rg_name, "USD") for day in range(31)]
+
+def get_rgs_cost_dict(round_totals=True):
+    return rgs_cost.get_rgs_cost(new_resource_groups(), SCOPE, FROM_DATETIME, TO_DATETIME, get_cost, TEAM_COST_KEYS, round_totals=round_totals)
+
+def get_key_orders(value, path=()):
+    # The keys of every nested dict, in order
+    if isinstance(value, dict):
+        key_orders = {path: list(value.keys())}
+        for key, nested_value in value.items():
+            key_orders.update(get_key_orders(nested_value, path + (key,)))
+        return key_orders
+    if isinstance(value, list):
+        key_orders = {}
+        for i, nested_value in enumerate(value):
+            key_orders.update(get_key_orders(nested_value, path + (i,)))
+        return key_orders
+    return {}
+
+@pytest.fixture(scope="module")
+def rgs_cost_dict():
+    rgs_cost_dict = forecast.add_forecast(get_rgs_cost_dict())
+
+    # Realistic enough: failed RGs, a forecast and an estimation
+    assert rgs_cost_dict[cost_merge.FAILED_RESOURCE_GROUPS] == [{"rgname": "rg-3", "error": "Fake error 403"}]
+    assert rgs_cost_dict[cost_merge.FORECAST]["resourceGroupForecast"]
+    assert list(rgs_cost_dict["monthly"].keys())[:4] == ["resourceGroupCost", "infraTotalCost", "aiTotalCost", "nwTotalCost"]
+    return rgs_cost_dict
+
+@pytest.mark.parametrize("payload_format", PAYLOAD_FORMATS)
+def test_decode_of_encode_is_the_rgs_cost_dict(rgs_cost_dict, payload_format):
+    decoded = cost_payload.decode(cost_payload.encode(rgs_cost_dict, payload_format))
+
+    assert decoded == rgs_cost_dict
+    assert get_key_orders(decoded) == get_key_orders(rgs_cost_dict)
+
+@pytest.mark.parametrize("payload_format", PAYLOAD_FORMATS)
+def test_decode_of_dumps_is_the_rgs_cost_dict(rgs_cost_dict, payload_format):
+    decoded = cost_payload.decode(cost_payload.dumps(rgs_cost_dict, payload_format))
+
+    assert decoded == rgs_cost_dict
+    assert get_key_orders(decoded) == get_key_orders(rgs_cost_dict)
+
+@pytest.mark.parametrize("payload_format", PAYLOAD_FORMATS)
+def test_merged_subscriptions_round_trip(payload_format):
+    # The orchestrator's result, with a subscriptionId on every RG cost
+    rgs_cost_dict = cost_merge.merge_subscriptions_rgs_cost([("s1", get_rgs_cost_dict(round_totals=False)), ("s2", get_rgs_cost_dict(round_totals=False))])
+    payload = cost_payload.encode(rgs_cost_dict, payload_format)
+
+    decoded = cost_payload.decode(payload)
+
+    assert decoded == rgs_cost_dict
+    assert get_key_orders(decoded) == get_key_orders(rgs_cost_dict)
+    if payload_format == cost_payload.FORMAT_COLUMNAR:
+        assert payload["rgsubscriptionIds"][:2] == ["s1", "s1"]
+        assert "rgcosts" in payload["periods"]["monthly"]
+
+def test_unknown_payload_format_is_rejected():
+    with pytest.raises(ValueError):
+        cost_payload.encode({}, "xml")
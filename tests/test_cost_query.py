@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import fake_azure
+from shared_code import cost_merge
+from shared_code import cost_query
+from shared_code import rgs_cost
+from tests.helpers import FakeClock
+from tests.test_rate_limiter import new_rate_limiter
+
+SUBSCRIPTION_SCOPE = "/subscriptions/s"
+SCOPE = SUBSCRIPTION_SCOPE + "/resourceGroups/"
+TEAM_COST_KEYS = {"AI": "aiTotalCost", "Infra": "infraTotalCost"}
+TO_DATETIME = datetime(2026, 10, 17, 23, 59, tzinfo=timezone.utc)
+FROM_DATETIME = TO_DATETIME.replace(hour=0, minute=0) - timedelta(days=30)
+
+class UpperCaseRgService(fake_azure.FakeCostManagementService):
+    # Cost Management answers with its own casing of the RG names
+
+    def get_result(self, scope, parameters, params=None):
+        query_result = super().get_result(scope, parameters, params)
+        query_result.rows = [[cost, usage_date, rg_name.upper(), currency] for cost, usage_date, rg_name, currency in query_result.rows]
+        return query_result
+
+def new_resource_groups():
+    # Mixed case in the inventory, and one RG without any cost
+    resource_groups = [SimpleNamespace(name=f"Rg-{team}-{i}", managed_by=None, tags={"Team": team}) for team in TEAM_COST_KEYS for i in range(3)]
+    return resource_groups + [SimpleNamespace(name="Rg-Idle", managed_by=None, tags={"Team": "AI"})]
+
+def new_cost_mgmt_client(resource_groups, page_size=0):
+    costs = fake_azure.make_costs(resource_groups[:-1], TO_DATETIME + timedelta(days=1), 31, sparsity=0.3)
+    return fake_azure.FakeCostManagementClient(UpperCaseRgService(costs, latency_secs=0, page_size=page_size)), costs
+
+def get_rgs_cost(resource_groups, cost_mgmt_client, rows_of_cost_by_rg=None):
+    rate_limiter = new_rate_limiter(FakeClock())
+
+    def get_cost(scope_with_rg, from_datetime, to_datetime):
+        query_def = cost_query.get_query_definition(from_datetime, to_datetime)
+        return list(cost_query.iter_rows_of_cost(cost_mgmt_client, scope_with_rg, query_def, rate_limiter))
+
+    return rgs_cost.get_rgs_cost(resource_groups, SCOPE, FROM_DATETIME, TO_DATETIME, get_cost, TEAM_COST_KEYS, rows_of_cost_by_rg, catch_errors=False)
+
+def test_subscription_mode_gives_the_totals_of_the_rg_queries():
+    resource_groups = new_resource_groups()
+    cost_mgmt_client, _ = new_cost_mgmt_client(resource_groups)
+
+    by_rg = get_rgs_cost(resource_groups, cost_mgmt_client)
+    rows_of_cost_by_rg = cost_query.get_rows_of_cost_by_rg(SUBSCRIPTION_SCOPE, FROM_DATETIME, TO_DATETIME, cost_mgmt_client, new_rate_limiter(FakeClock()))
+    by_subscription = get_rgs_cost(resource_groups, cost_mgmt_client, rows_of_cost_by_rg)
+
+    assert by_subscription == by_rg
+    # Matched whatever the casing, the RGs keep their inventory names
+    monthly_rg_costs = {rg_cost["rgname"]: rg_cost["rgcost"] for rg_cost in by_subscription["monthly"]["resourceGroupCost"]}
+    assert sorted(monthly_rg_costs) == sorted(rg.name for rg in resource_groups)
+    assert monthly_rg_costs["Rg-Idle"] == 0
+    assert by_subscription["monthly"]["aiTotalCost"] > 0
+    assert by_subscription[cost_merge.FAILED_RESOURCE_GROUPS] == []
+
+def test_split_rows_are_keyed_by_lower_case_rg_and_ordered_by_day():
+    rows_of_cost = [
+        cost_query.CostRow(2.0, 20261002, "RG-A", "USD"),
+        cost_query.CostRow(1.0, 20261001, "rg-a", "USD"),
+        cost_query.CostRow(3.0, 20261001, "Rg-B", "EUR"),
+    ]
+
+    rows_of_cost_by_rg = cost_query.split_rows_of_cost_by_rg(iter(rows_of_cost))
+
+    assert rows_of_cost_by_rg == {"rg-a": [rows_of_cost[1], rows_of_cost[0]], "rg-b": [rows_of_cost[2]]}
+
+def test_every_page_is_followed_and_every_row_returned_once():
+    resource_groups = new_resource_groups()
+    cost_mgmt_client, costs = new_cost_mgmt_client(resource_groups, page_size=7)
+    query_def = cost_query.get_query_definition(FROM_DATETIME, TO_DATETIME)
+
+    pages = list(cost_query.iter_pages_of_cost(cost_mgmt_client, SUBSCRIPTION_SCOPE, query_def, new_rate_limiter(FakeClock())))
+
+    num_rows = sum(len(rg_costs) for rg_costs in costs.values())
+    assert num_rows > 7
+    assert len(pages) == -(-num_rows // 7)
+    assert all(len(page) == 7 for page in pages[:-1])
+    rows = [(row.resource_group.lower(), row.usage_date, row.cost) for page in pages for row in page]
+    assert sorted(rows) == sorted((rg_name, usage_date, cost) for rg_name, rg_costs in costs.items() for usage_date, cost in rg_costs.items())
+
+def test_paged_subscription_query_splits_like_a_single_page():
+    resource_groups = new_resource_groups()
+    cost_mgmt_client, _ = new_cost_mgmt_client(resource_groups)
+    paged_cost_mgmt_client, _ = new_cost_mgmt_client(resource_groups, page_size=5)
+
+    rows_of_cost_by_rg = cost_query.get_rows_of_cost_by_rg(SUBSCRIPTION_SCOPE, FROM_DATETIME, TO_DATETIME, cost_mgmt_client, new_rate_limiter(FakeClock()))
+    paged_rows_of_cost_by_rg = cost_query.get_rows_of_cost_by_rg(SUBSCRIPTION_SCOPE, FROM_DATETIME, TO_DATETIME, paged_cost_mgmt_client, new_rate_limiter(FakeClock()))
+
+    assert paged_rows_of_cost_by_rg == rows_of_cost_by_rg
+    assert paged_cost_mgmt_client.query.service.calls > 1
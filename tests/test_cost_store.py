@@ -0,0 +1,133 @@
+import asyncio
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+from shared_code import cost_store
+
+SCOPE = "/subscriptions/s/resourceGroups/rg-0"
+
+class FakeTable:
+    # The parts of azure.data.tables.TableClient used by TableCostStore
+
+    def __init__(self):
+        self.entities = {}
+        self.transactions = []
+
+    def query_entities(self, query_filter, parameters):
+        return [
+            dict(entity) for (partition_key, row_key), entity in sorted(self.entities.items())
+            if partition_key == parameters["pk"] and parameters["from_key"] <= row_key < parameters["to_key"]
+        ]
+
+    def submit_transaction(self, operations):
+        assert len(operations) <= cost_store.TABLE_TRANSACTION_SIZE
+        assert len(set(entity["PartitionKey"] for _, entity in operations)) == 1
+        row_keys = [entity["RowKey"] for _, entity in operations]
+        assert len(set(row_keys)) == len(row_keys), "an entity appears twice in one transaction"
+
+        self.transactions.append(operations)
+        for operation, entity in operations:
+            key = (entity["PartitionKey"], entity["RowKey"])
+            if operation == "delete":
+                del self.entities[key]
+            else:
+                self.entities[key] = dict(self.entities.get(key, {}), **entity)
+
+def new_table_store():
+    store = cost_store.TableCostStore.__new__(cost_store.TableCostStore)
+    store._rows_table = FakeTable()
+    store._days_table = FakeTable()
+    return store
+
+def make_rows(num_rgs, from_date, num_days, cost=1.0):
+    from_day = datetime.strptime(str(from_date), "%Y%m%d")
+    return [
+        [cost, cost_store.to_usage_date(from_day + timedelta(days=day)), f"rg-{i}", "USD"]
+        for day in range(num_days) for i in range(num_rgs)
+    ]
+
+def test_table_store_writes_in_transactions_of_at_most_100():
+    store = new_table_store()
+    rows_of_cost = make_rows(25, 20260901, 30)
+
+    store.replace_rows(SCOPE, 20260901, 20260930, rows_of_cost)
+
+    assert len(store._rows_table.transactions) == 8
+    assert sorted(store.get_rows(SCOPE, 20260901, 20260930)) == sorted(rows_of_cost)
+    assert store.get_fetched_dates(SCOPE, 20260901, 20260930) == set(range(20260901, 20260931))
+
+def test_table_store_replaces_the_window_only():
+    store = new_table_store()
+    store.replace_rows(SCOPE, 20260901, 20260910, make_rows(3, 20260901, 10))
+
+    # rg-2 has no rows any more from the 6th, rg-0 and rg-1 changed
+    new_rows = [row for row in make_rows(3, 20260906, 5, cost=2.0) if row[2] != "rg-2"]
+    store.replace_rows(SCOPE, 20260906, 20260910, new_rows)
+
+    rows_of_cost = store.get_rows(SCOPE, 20260901, 20260910)
+    assert [row for row in rows_of_cost if row[1] >= 20260906] == sorted(new_rows, key=lambda row: (row[1], row[2]))
+    assert len([row for row in rows_of_cost if row[1] < 20260906]) == 15
+
+def test_sqlite_store_only_queries_missing_and_settling_days(tmp_path):
+    store = cost_store.SqliteCostStore(str(tmp_path / "cost_store.sqlite3"))
+    to_datetime = datetime(2026, 10, 17, 23, 59, tzinfo=timezone.utc)
+    from_datetime = to_datetime - timedelta(days=30)
+    queried = []
+
+    def query_rows_of_cost(query_from_datetime, query_to_datetime):
+        queried.append((query_from_datetime.date(), query_to_datetime.date()))
+        num_days = (query_to_datetime.date() - query_from_datetime.date()).days + 1
+        return make_rows(2, cost_store.to_usage_date(query_from_datetime), num_days)
+
+    first = cost_store.get_rows_of_cost(SCOPE, from_datetime, to_datetime, query_rows_of_cost, store=store, settling_days=3)
+    second = cost_store.get_rows_of_cost(SCOPE, from_datetime, to_datetime, query_rows_of_cost, store=store, settling_days=3)
+
+    assert first == second
+    assert queried[1] == ((to_datetime - timedelta(days=2)).date(), to_datetime.date())
+
+def test_rows_of_one_rg_and_day_are_kept_per_currency(tmp_path):
+    rows_of_cost = [[1.0, 20261001, "rg-0", "EUR"], [2.0, 20261001, "rg-0", "USD"], [4.0, 20261002, "rg-0", "USD"]]
+
+    for store in [cost_store.SqliteCostStore(str(tmp_path / "cost_store.sqlite3")), new_table_store()]:
+        store.replace_rows(SCOPE, 20261001, 20261002, rows_of_cost)
+        assert store.get_rows(SCOPE, 20261001, 20261002) == rows_of_cost
+
+def test_sqlite_store_without_currency_in_its_key_starts_over(tmp_path):
+    path = str(tmp_path / "cost_store.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE cost_rows (scope TEXT, rg TEXT, usage_date INTEGER, cost REAL, currency TEXT, PRIMARY KEY (scope, rg, usage_date))")
+    conn.execute("CREATE TABLE fetched_days (scope TEXT, usage_date INTEGER, fetched_at TEXT, PRIMARY KEY (scope, usage_date))")
+    conn.execute("INSERT INTO fetched_days VALUES (?, 20261001, '')", (SCOPE,))
+    conn.commit()
+    conn.close()
+
+    store = cost_store.SqliteCostStore(path)
+
+    assert store.get_fetched_dates(SCOPE, 20261001, 20261001) == set()
+    store.replace_rows(SCOPE, 20261001, 20261001, [[1.0, 20261001, "rg-0", "EUR"], [2.0, 20261001, "rg-0", "USD"]])
+    assert len(store.get_rows(SCOPE, 20261001, 20261001)) == 2
+
+def test_async_store_calls_run_off_the_event_loop(tmp_path):
+    store = cost_store.SqliteCostStore(str(tmp_path / "cost_store.sqlite3"))
+    to_datetime = datetime(2026, 10, 17, 23, 59, tzinfo=timezone.utc)
+    from_datetime = to_datetime - timedelta(days=30)
+    threads = []
+
+    class RecordingStore:
+        def __getattr__(self, name):
+            def call(*args):
+                threads.append(threading.get_ident())
+                return getattr(store, name)(*args)
+            return call
+
+    async def query_rows_of_cost(query_from_datetime, query_to_datetime):
+        num_days = (query_to_datetime.date() - query_from_datetime.date()).days + 1
+        return make_rows(2, cost_store.to_usage_date(query_from_datetime), num_days)
+
+    rows_of_cost = asyncio.run(cost_store.get_rows_of_cost_async(SCOPE, from_datetime, to_datetime, query_rows_of_cost, store=RecordingStore(), settling_days=3))
+
+    assert len(rows_of_cost) == 62
+    # get_fetched_dates, replace_rows and get_rows
+    assert len(threads) == 3
+    assert threading.get_ident() not in threads
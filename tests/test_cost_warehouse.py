@@ -0,0 +1,164 @@
+import json
+from datetime import date, timedelta
+
+import azure.functions as func
+import pytest
+
+from shared_code import cost_query
+from shared_code import cost_store
+from shared_code import cost_warehouse
+from tests.helpers import load_function
+
+SUBSCRIPTION_ID = "s1"
+
+@pytest.fixture
+def warehouse(tmp_path):
+    return cost_warehouse.SqliteCostWarehouse(str(tmp_path / "cost_warehouse.sqlite3"))
+
+def new_rows(rg_name, from_day, num_days, cost, currency="USD"):
+    return [cost_query.CostRow(cost, cost_store.to_usage_date(from_day + timedelta(days=day)), rg_name, currency) for day in range(num_days)]
+
+def append(warehouse, from_day, to_day, rows_of_cost_by_rg, teams, subscription_id=SUBSCRIPTION_ID):
+    rg_names = list(rows_of_cost_by_rg.keys())
+    return warehouse.append_rows(subscription_id, cost_store.to_usage_date(from_day), cost_store.to_usage_date(to_day), rg_names, [teams[rg_name] for rg_name in rg_names], list(rows_of_cost_by_rg.values()))
+
+def get_table(warehouse, table):
+    return warehouse._conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2, 3, 4").fetchall()
+
+@pytest.mark.parametrize("from_date, to_date, expected", [
+    (20260901, 20260930, ((202609, 202609), [])),
+    (20260101, 20261231, ((202601, 202612), [])),
+    (20240201, 20240229, ((202402, 202402), [])),
+    (20260910, 20260920, (None, [(20260910, 20260920)])),
+    (20260915, 20261010, (None, [(20260915, 20261010)])),
+    (20260715, 20261010, ((202608, 202609), [(20260715, 20260731), (20261001, 20261010)])),
+    (20260801, 20261010, ((202608, 202609), [(20261001, 20261010)])),
+    (20261215, 20270228, ((202701, 202702), [(20261215, 20261231)])),
+])
+def test_month_ranges(from_date, to_date, expected):
+    assert cost_warehouse.get_month_ranges(from_date, to_date) == expected
+
+def test_rerun_overwrites_its_window_only(warehouse):
+    teams = {"rg-a": "AI", "rg-b": "Infra"}
+    append(warehouse, date(2026, 9, 1), date(2026, 9, 30), {"rg-a": new_rows("rg-a", date(2026, 9, 1), 30, 1.0), "rg-b": new_rows("rg-b", date(2026, 9, 1), 30, 2.0)}, teams)
+
+    # The last 10 days of rg-a settled to 3.0, rg-a's row of a day before the
+    # window is left out
+    num_rows = append(warehouse, date(2026, 9, 21), date(2026, 9, 30), {"rg-a": new_rows("rg-a", date(2026, 9, 20), 11, 3.0)}, teams)
+
+    assert num_rows == 10
+    assert warehouse.query_cost("2026-09-01", "2026-09-30", ["rg", "day"], resource_groups=["rg-a"])[19:21] == [
+        {"rg": "rg-a", "day": 20260920, "currency": "USD", "cost": 1.0},
+        {"rg": "rg-a", "day": 20260921, "currency": "USD", "cost": 3.0},
+    ]
+    assert warehouse.query_cost("2026-09-01", "2026-09-30", "rg") == [
+        {"rg": "rg-a", "currency": "USD", "cost": 50.0},
+        {"rg": "rg-b", "currency": "USD", "cost": 60.0},
+    ]
+    assert len(get_table(warehouse, "daily_cost")) == 60
+
+def test_monthly_rollup_sums_the_daily_rows(warehouse):
+    teams = {"RG-A": "AI", "rg-b": "Infra"}
+    rows_of_cost_by_rg = {
+        "RG-A": new_rows("RG-A", date(2026, 7, 1), 92, 1.0) + new_rows("RG-A", date(2026, 8, 1), 3, 5.0, currency="EUR"),
+        "rg-b": new_rows("rg-b", date(2026, 8, 15), 47, 2.0)
+    }
+    # RG names are kept lower case
+    append(warehouse, date(2026, 7, 1), date(2026, 9, 30), rows_of_cost_by_rg, teams)
+
+    assert get_table(warehouse, "monthly_cost") == [
+        (202607, SUBSCRIPTION_ID, "rg-a", "USD", "AI", 31.0),
+        (202608, SUBSCRIPTION_ID, "rg-a", "EUR", "AI", 15.0),
+        (202608, SUBSCRIPTION_ID, "rg-a", "USD", "AI", 31.0),
+        (202608, SUBSCRIPTION_ID, "rg-b", "USD", "Infra", 34.0),
+        (202609, SUBSCRIPTION_ID, "rg-a", "USD", "AI", 30.0),
+        (202609, SUBSCRIPTION_ID, "rg-b", "USD", "Infra", 60.0),
+    ]
+    # A rerun of September rebuilds its month only
+    append(warehouse, date(2026, 9, 1), date(2026, 9, 30), {"rg-b": new_rows("rg-b", date(2026, 9, 1), 30, 1.0)}, teams)
+    assert [row for row in get_table(warehouse, "monthly_cost") if row[2] == "rg-b"] == [
+        (202608, SUBSCRIPTION_ID, "rg-b", "USD", "Infra", 34.0),
+        (202609, SUBSCRIPTION_ID, "rg-b", "USD", "Infra", 30.0),
+    ]
+
+@pytest.fixture
+def history(warehouse):
+    append(warehouse, date(2026, 7, 1), date(2026, 9, 30), {
+        "rg-a": new_rows("rg-a", date(2026, 7, 1), 92, 1.0),
+        "rg-b": new_rows("rg-b", date(2026, 7, 1), 92, 2.0),
+        "rg-c": new_rows("rg-c", date(2026, 7, 1), 92, 4.0, currency="EUR"),
+    }, {"rg-a": "AI", "rg-b": "Infra", "rg-c": "AI"})
+    append(warehouse, date(2026, 7, 1), date(2026, 9, 30), {"rg-a": new_rows("rg-a", date(2026, 7, 1), 92, 8.0)}, {"rg-a": "AI"}, subscription_id="s2")
+    return warehouse
+
+def test_query_cost_by_team_and_month(history):
+    assert history.query_cost(date(2026, 7, 15), date(2026, 9, 10), ["team", "month"], teams=["ai"], subscription_ids=[SUBSCRIPTION_ID]) == [
+        {"team": "AI", "month": 202607, "currency": "EUR", "cost": 68.0},
+        {"team": "AI", "month": 202607, "currency": "USD", "cost": 17.0},
+        {"team": "AI", "month": 202608, "currency": "EUR", "cost": 124.0},
+        {"team": "AI", "month": 202608, "currency": "USD", "cost": 31.0},
+        {"team": "AI", "month": 202609, "currency": "EUR", "cost": 40.0},
+        {"team": "AI", "month": 202609, "currency": "USD", "cost": 10.0},
+    ]
+
+def test_query_cost_mixes_partial_and_whole_months(history):
+    # The monthly rows and the partial days add up to the daily rows
+    by_day = history.query_cost(20260715, 20260910, ["subscription", "day"])
+    by_subscription = history.query_cost(20260715, 20260910, ["subscription"])
+
+    assert by_subscription == [
+        {"subscription": SUBSCRIPTION_ID, "currency": "EUR", "cost": 4.0 * 58},
+        {"subscription": SUBSCRIPTION_ID, "currency": "USD", "cost": 3.0 * 58},
+        {"subscription": "s2", "currency": "USD", "cost": 8.0 * 58},
+    ]
+    assert round(sum(row["cost"] for row in by_day), 2) == round(sum(row["cost"] for row in by_subscription), 2)
+    assert history.query_cost("2026-01-01", "2026-12-31", ["year"], resource_groups=["RG-B"]) == [{"year": 2026, "currency": "USD", "cost": 184.0}]
+
+@pytest.mark.parametrize("group_by, from_date, to_date", [
+    (["team", "week"], "2026-07-01", "2026-07-31"),
+    ("team", "2026-07-31", "2026-07-01"),
+])
+def test_query_cost_rejects_bad_input(history, group_by, from_date, to_date):
+    with pytest.raises(ValueError):
+        history.query_cost(from_date, to_date, group_by)
+
+@pytest.fixture
+def cost_history():
+    return load_function("fn-http-cost-history")
+
+def get(cost_history, params):
+    return cost_history.main(func.HttpRequest(method="GET", url="http://localhost/api/fn-http-cost-history", body=b"", params=params))
+
+def test_history_without_a_warehouse_is_a_503(cost_history):
+    assert get(cost_history, {"from": "2026-07-01", "to": "2026-09-30"}).status_code == 503
+
+def test_history_totals_per_currency(cost_history, history, monkeypatch):
+    monkeypatch.setattr(cost_warehouse, "_cost_warehouse", history)
+
+    response = get(cost_history, {"from": "2026-08-01", "to": "2026-08-31", "groupBy": "team, subscription", "team": "AI"})
+
+    assert response.status_code == 200
+    assert json.loads(response.get_body()) == {
+        "fromDate": "2026-08-01",
+        "toDate": "2026-08-31",
+        "groupBy": ["team", "subscription"],
+        "totalCost": {"EUR": 124.0, "USD": 279.0},
+        "rows": [
+            {"team": "AI", "subscription": SUBSCRIPTION_ID, "currency": "EUR", "cost": 124.0},
+            {"team": "AI", "subscription": SUBSCRIPTION_ID, "currency": "USD", "cost": 31.0},
+            {"team": "AI", "subscription": "s2", "currency": "USD", "cost": 248.0},
+        ]
+    }
+
+@pytest.mark.parametrize("params", [
+    {"from": "2026-07-01"},
+    {"from": "2026-07-01", "to": "2026-07-31", "groupBy": "week"},
+    {"from": "2026-07-31", "to": "2026-07-01"},
+])
+def test_history_bad_params_are_a_400(cost_history, history, monkeypatch, params):
+    monkeypatch.setattr(cost_warehouse, "_cost_warehouse", history)
+
+    response = get(cost_history, params)
+
+    assert response.status_code == 400
+    assert response.get_body()
@@ -0,0 +1,49 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from shared_code import cost_merge
+from shared_code import forecast
+
+FROM_DATE = date(2026, 9, 16)
+
+def new_rgs_cost_dict(team_daily_cost, resource_group_forecast=()):
+    monthly = {"resourceGroupCost": [], "aiTotalCost": 100.0, "totalCost": 100.0}
+    return {
+        "monthly": monthly,
+        cost_merge.FORECAST: {"fromDate": str(FROM_DATE), "resourceGroupForecast": list(resource_group_forecast), "teamDailyCost": team_daily_cost},
+    }
+
+def test_fit_series_projects_a_flat_series():
+    projections = forecast.fit_series(np.full((2, 30), 10.0), FROM_DATE)
+
+    cost, low, high, _ = projections["annual"]
+    assert list(cost) == pytest.approx([10.0 * forecast.ANNUAL_DAYS] * 2)
+    assert list(low) == pytest.approx(list(high))
+
+def test_fit_series_without_series_or_days():
+    assert forecast.fit_series(np.zeros((0, 30)), FROM_DATE) is None
+    assert forecast.fit_series(np.zeros((3, 2)), FROM_DATE) is None
+
+def test_no_team_is_an_empty_forecast():
+    rgs_cost_dict = forecast.add_forecast(new_rgs_cost_dict({}))
+
+    assert rgs_cost_dict[cost_merge.FORECAST]["teams"] == {}
+    assert rgs_cost_dict[cost_merge.FORECAST]["totalCost"] == {}
+    assert "teamDailyCost" not in rgs_cost_dict[cost_merge.FORECAST]
+    # Back to the run rate of the month
+    assert rgs_cost_dict["estimation"]["aiTotalCost"] == 1200.0
+    assert list(rgs_cost_dict.keys()) == ["monthly", "estimation", cost_merge.FORECAST]
+
+def test_too_short_team_series_is_an_empty_forecast():
+    rgs_cost_dict = forecast.add_forecast(new_rgs_cost_dict({"aiTotalCost": [1.0, 2.0]}))
+
+    assert rgs_cost_dict[cost_merge.FORECAST]["teams"] == {}
+    assert rgs_cost_dict["estimation"]["totalCost"] == 1200.0
+
+def test_rgs_forecast_without_rgs():
+    rgs_forecast = forecast.get_rgs_forecast(np.zeros((0, 31)), FROM_DATE, [], [], np.zeros(0, dtype=np.int64), ["aiTotalCost"])
+
+    assert rgs_forecast["resourceGroupForecast"] == []
+    assert rgs_forecast["teamDailyCost"] == {"aiTotalCost": [0.0] * 30}
@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+import azure.functions as func
+import pytest
+
+from shared_code import job_store
+from tests.helpers import load_function
+from tests.test_rate_limiter import http_error
+
+@pytest.fixture
+def http():
+    return load_function("fn-http-cost-tracker")
+
+def new_request(body, params=None):
+    if body is None:
+        return func.HttpRequest(method="GET", url="http://localhost/api/fn-http-cost-tracker", body=b"", params=params or {})
+    return func.HttpRequest(method="POST", url="http://localhost/api/fn-http-cost-tracker", body=body if isinstance(body, bytes) else json.dumps(body).encode(), params=params or {})
+
+def post(http, body):
+    return asyncio.run(http.main(new_request(body)))
+
+@pytest.mark.parametrize("body", [
+    b"not json",
+    ["a", "list"],
+    {"payloadFormat": "xml"},
+    {"queryMode": "everything"},
+    {"maxConcurrency": "8"},
+    {"subscriptions": "s1,s2"},
+    {},
+    {"scope": 5},
+    {"scope": "/subscriptions/s"},
+    {"scope": "rg-0"},
+    {"scope": "/subscriptions/s/resourceGroups/", "managementGroup": ["mg"]},
+])
+def test_bad_request_input_is_a_400(http, body, monkeypatch):
+    monkeypatch.delenv("COST_TRACKER_SUBSCRIPTIONS", raising=False)
+    monkeypatch.delenv("COST_TRACKER_MANAGEMENT_GROUP", raising=False)
+
+    response = post(http, body)
+
+    assert response.status_code == 400
+    assert response.get_body()
+
+def test_error_without_status_code_is_a_500(http, monkeypatch):
+    async def collect_rgs_cost(req_body, progress=None):
+        raise RuntimeError("connection reset")
+    monkeypatch.setattr(http, "collect_rgs_cost", collect_rgs_cost)
+
+    response = post(http, {"scope": "/subscriptions/s/resourceGroups/"})
+
+    assert response.status_code == 500
+    assert response.get_body() == b"connection reset"
+
+@pytest.mark.parametrize("status_code, headers, expected_status_code, expected_headers", [
+    (403, {}, 502, {}),
+    (404, {}, 502, {}),
+    (429, {"x-ms-ratelimit-microsoft.costmanagement-qpu-retry-after": "7.5"}, 429, {"Retry-After": "8"}),
+    (503, {}, 503, {}),
+])
+def test_upstream_error_is_not_answered_as_its_own(http, monkeypatch, status_code, headers, expected_status_code, expected_headers):
+    async def collect_rgs_cost(req_body, progress=None):
+        raise http_error(status_code, headers)
+    monkeypatch.setattr(http, "collect_rgs_cost", collect_rgs_cost)
+
+    response = post(http, {"scope": "/subscriptions/s/resourceGroups/"})
+
+    assert response.status_code == expected_status_code
+    assert response.headers.get("Retry-After") == expected_headers.get("Retry-After")
+
+def test_scope_not_needed_with_subscriptions(http, monkeypatch):
+    requests = []
+    async def collect_rgs_cost(req_body, progress=None):
+        requests.append(req_body)
+        return {"yesterday": {"totalCost": 0}}
+    monkeypatch.setattr(http, "collect_rgs_cost", collect_rgs_cost)
+
+    assert post(http, {"subscriptions": ["s1", "s2"]}).status_code == 200
+    assert post(http, {"scope": "/providers/Microsoft.Management/managementGroups/mg"}).status_code == 200
+    assert len(requests) == 2
+
+def test_async_job_reports_progress_then_its_result(http, monkeypatch, tmp_path):
+    monkeypatch.setattr(job_store, "_job_store", job_store.SqliteJobStore(str(tmp_path / "job_store.sqlite3")))
+    monkeypatch.delenv("JOB_STORE_BACKEND", raising=False)
+    collect_started = asyncio.Event()
+    collect_may_finish = asyncio.Event()
+
+    async def collect_rgs_cost(req_body, progress=None):
+        progress.add_total(4)
+        progress.add_done(1)
+        collect_started.set()
+        await collect_may_finish.wait()
+        progress.add_done(3)
+        return {"yesterday": {"totalCost": 1.5}}
+    monkeypatch.setattr(http, "collect_rgs_cost", collect_rgs_cost)
+
+    async def run():
+        started = await http.main(new_request({"scope": "/subscriptions/s/resourceGroups/", "async": True}))
+        job_id = json.loads(started.get_body())["jobId"]
+        poll = new_request(None, params={"jobId": job_id})
+
+        await collect_started.wait()
+        await asyncio.sleep(0.1)
+        running = await http.main(poll)
+        collect_may_finish.set()
+        await asyncio.gather(*http._running_jobs.values())
+        done = await http.main(poll)
+        missing = await http.main(new_request(None, params={"jobId": "unknown"}))
+        return started, running, done, missing
+
+    started, running, done, missing = asyncio.run(run())
+
+    assert started.status_code == 202
+    assert running.status_code == 202
+    # The first RG done came within PROGRESS_SAVE_INTERVAL_SECS of the total
+    assert (json.loads(running.get_body())["rgsDone"], json.loads(running.get_body())["rgsTotal"]) == (0, 4)
+    assert done.status_code == 200
+    assert json.loads(done.get_body())["yesterday"]["totalCost"] == 1.5
+    # The sqlite jobs are only seen by their own instance
+    assert missing.status_code == 404
+    assert b"JOB_STORE_BACKEND=table" in missing.get_body()
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+
+from shared_code import job_store
+from tests.helpers import FakeClock
+
+class RecordingStore:
+    # Keeps a copy of every saved job and the thread it was saved from
+
+    def __init__(self, fail=False):
+        self.saved = []
+        self.threads = []
+        self.fail = fail
+
+    def save_job(self, job):
+        self.threads.append(threading.get_ident())
+        if self.fail:
+            raise OSError("disk full")
+        self.saved.append(dict(job))
+
+def new_progress(store, clock):
+    return job_store.JobProgress(job_store.new_job("job-1", {"scope": "s"}), store, clock=clock)
+
+def test_progress_saves_are_throttled():
+    clock = FakeClock()
+    store = RecordingStore()
+    progress = new_progress(store, clock)
+
+    progress.add_total(10)
+    for _ in range(3):
+        progress.add_done(1)
+    clock.sleep(job_store.PROGRESS_SAVE_INTERVAL_SECS)
+    progress.add_done(1)
+
+    assert [job["rgsDone"] for job in store.saved] == [0, 4]
+
+def test_progress_saves_run_off_the_event_loop():
+    clock = FakeClock()
+    store = RecordingStore()
+    progress = new_progress(store, clock)
+
+    async def collect():
+        progress.add_total(2)
+        await progress.wait()
+        progress.add_done(2)
+        await progress.wait()
+
+    asyncio.run(collect())
+
+    assert [(job["rgsDone"], job["rgsTotal"]) for job in store.saved] == [(0, 2), (2, 2)]
+    assert threading.get_ident() not in store.threads
+
+def test_progress_counts_added_during_a_write_wait_for_the_next_one():
+    clock = FakeClock()
+    store = RecordingStore()
+    progress = new_progress(store, clock)
+
+    async def collect():
+        progress.add_total(3)
+        # Every RG done while the first write is still in flight
+        progress.add_done(3)
+        await progress.wait()
+
+    asyncio.run(collect())
+
+    assert [job["rgsDone"] for job in store.saved] == [0]
+    assert progress.job["rgsDone"] == 3
+
+def test_failed_progress_write_does_not_fail_the_job():
+    clock = FakeClock()
+    progress = new_progress(RecordingStore(fail=True), clock)
+
+    async def collect():
+        progress.add_total(1)
+        await progress.wait()
+
+    asyncio.run(collect())
+
+    assert progress.job["rgsTotal"] == 1
+
+def test_sqlite_backend_by_default(monkeypatch):
+    monkeypatch.delenv("JOB_STORE_BACKEND", raising=False)
+    assert job_store.get_backend_name() == job_store.BACKEND_SQLITE
+
+    monkeypatch.setenv("JOB_STORE_BACKEND", "Table")
+    assert job_store.get_backend_name() == job_store.BACKEND_TABLE
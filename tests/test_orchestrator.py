@@ -0,0 +1,147 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+
+import azure.functions as func
+import pytest
+
+import fake_azure
+from shared_code import budget_alerts
+from shared_code import clients
+from shared_code import cost_payload
+from tests.helpers import FakeDurableContext, load_function, run_orchestrator
+
+SUBSCRIPTION_ID = "00000000-0000-0000-0000-000000000000"
+# Of the multi-subscription run, the RG inventories are kept per subscription
+SUBSCRIPTION_IDS = ["20000000-0000-0000-0000-000000000001", "20000000-0000-0000-0000-000000000002"]
+
+@pytest.fixture
+def functions():
+    resource_groups = fake_azure.make_resource_groups(12, num_managed=1)
+    to_date = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    service = fake_azure.FakeCostManagementService(fake_azure.make_costs(resource_groups, to_date, 31), latency_secs=0)
+
+    clients.set_factory(clients.CREDENTIAL, lambda: None)
+    clients.set_factory(clients.COST_MGMT_CLIENT, lambda credential: fake_azure.FakeCostManagementClient(service))
+    clients.set_factory(clients.RESOURCE_MGMT_CLIENT, lambda credential, subscription_id: fake_azure.FakeResourceManagementClient(resource_groups))
+    clients.set_factory(clients.RESOURCE_GRAPH_CLIENT, lambda credential: None)
+
+    activity = load_function("fn-drbl-cost-tracker-activity")
+    functions = {
+        "orchestrator": load_function("fn-drbl-cost-tracker-orchstr"),
+        "activities": {
+            "fn-drbl-cost-tracker-list-rgs": load_function("fn-drbl-cost-tracker-list-rgs").main,
+            "fn-drbl-cost-tracker-activity": activity.main,
+            "fn-drbl-cost-tracker-finalize": load_function("fn-drbl-cost-tracker-finalize").main,
+        },
+        "activity": activity,
+    }
+    yield functions
+
+    clients.reset()
+
+def test_a_slow_batch_does_not_hold_back_the_others(functions, monkeypatch):
+    monkeypatch.setenv("COST_TRACKER_SCOPE", f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/")
+
+    # The batch of rg-0 takes 10 units, the others 1
+    def get_duration(name, activity_input):
+        if name == "fn-drbl-cost-tracker-activity":
+            return 10 if activity_input["resourceGroups"][0]["name"] == "rg-0" else 1
+        return 0
+
+    context = FakeDurableContext({"batchSize": 2, "maxParallelism": 2}, functions["activities"], get_duration)
+    output = json.loads(run_orchestrator(functions["orchestrator"].orchestrator_function, context))
+
+    batch_calls = [call for call in context.calls if call[0] == "fn-drbl-cost-tracker-activity"]
+    assert len(batch_calls) == 6
+    assert context.max_running == 2
+    # The other slot works through the five short batches meanwhile
+    assert context.now == 10
+    assert [call[2] for call in batch_calls] == [0, 0, 1, 2, 3, 4]
+
+    # Merged in batch order, whatever order they finished in
+    assert [rg_cost["rgname"] for rg_cost in output["monthly"]["resourceGroupCost"]] == [f"rg-{i}" for i in range(12)]
+
+def test_a_failed_batch_fails_the_run(functions, monkeypatch):
+    monkeypatch.setenv("COST_TRACKER_SCOPE", f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/")
+
+    def failing_activity(activity_input):
+        if activity_input["resourceGroups"][0]["name"] == "rg-4":
+            raise RuntimeError("batch failed")
+        return functions["activity"].main(activity_input)
+
+    activities = dict(functions["activities"], **{"fn-drbl-cost-tracker-activity": failing_activity})
+    context = FakeDurableContext({"batchSize": 2, "maxParallelism": 3}, activities)
+
+    assert run_orchestrator(functions["orchestrator"].orchestrator_function, context).startswith("[ERROR]")
+
+def test_forecast_is_fitted_by_the_finalize_activity(functions, monkeypatch):
+    monkeypatch.setenv("COST_TRACKER_SCOPE", f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/")
+
+    context = FakeDurableContext({"batchSize": 5, "payloadFormat": "columnar+gzip"}, functions["activities"])
+    output = json.loads(run_orchestrator(functions["orchestrator"].orchestrator_function, context))
+
+    assert [call[0] for call in context.calls].count("fn-drbl-cost-tracker-finalize") == 1
+    assert context.calls[-1][0] == "fn-drbl-cost-tracker-finalize"
+    rgs_cost_dict = cost_payload.decode(output)
+    assert len(rgs_cost_dict["forecast"]["teams"]) > 0
+    assert "teamDailyCost" not in rgs_cost_dict["forecast"]
+    assert len(rgs_cost_dict["estimation"]["resourceGroupCost"]) == 12
+
+def test_team_budgets_are_checked_by_the_finalize_activity(functions, monkeypatch, tmp_path):
+    monkeypatch.setenv("COST_TRACKER_SCOPE", f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/")
+    monkeypatch.setenv("COST_ALERT_SINKS", budget_alerts.SINK_FILE)
+    monkeypatch.setenv("COST_ALERT_FILE_PATH", str(tmp_path / "cost_alerts.jsonl"))
+    budget_alerts.set_budgets({"teams": {"AI": {"monthly": 1}}})
+
+    try:
+        context = FakeDurableContext({"batchSize": 5}, functions["activities"])
+        output = json.loads(run_orchestrator(functions["orchestrator"].orchestrator_function, context))
+    finally:
+        budget_alerts.set_budgets(None)
+
+    # Nothing read from the budgets by the orchestrator itself
+    assert not hasattr(functions["orchestrator"], "budget_alerts")
+    assert [(breach["level"], breach["name"]) for breach in output["budgetBreaches"]] == [("team", "AI")]
+    notifications = [json.loads(line) for line in (tmp_path / "cost_alerts.jsonl").read_text().splitlines()]
+    assert len(notifications) == 1
+    assert notifications[0]["scope"] == f"/subscriptions/{SUBSCRIPTION_ID}/resourceGroups/"
+
+def test_two_subscriptions_in_one_run(functions):
+    # Each subscription with RGs of its own, batches never mixing them
+    resource_groups_by_subscription = {}
+    for s, subscription_id in enumerate(SUBSCRIPTION_IDS):
+        resource_groups = fake_azure.make_resource_groups(3, num_managed=1)
+        for rg in resource_groups:
+            rg.name = f"s{s}-{rg.name}"
+        resource_groups_by_subscription[subscription_id] = resource_groups
+    to_date = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    costs = fake_azure.make_costs([rg for resource_groups in resource_groups_by_subscription.values() for rg in resource_groups], to_date, 31)
+    service = fake_azure.FakeCostManagementService(costs, latency_secs=0)
+    clients.set_factory(clients.COST_MGMT_CLIENT, lambda credential: fake_azure.FakeCostManagementClient(service))
+    clients.set_factory(clients.RESOURCE_MGMT_CLIENT, lambda credential, subscription_id: fake_azure.FakeResourceManagementClient(resource_groups_by_subscription[subscription_id]))
+
+    context = FakeDurableContext({"subscriptions": SUBSCRIPTION_IDS, "batchSize": 2}, functions["activities"])
+    output = json.loads(run_orchestrator(functions["orchestrator"].orchestrator_function, context))
+
+    batches = [call[1] for call in context.calls if call[0] == "fn-drbl-cost-tracker-activity"]
+    assert [(batch["subscriptionId"], len(batch["resourceGroups"])) for batch in batches] == [(SUBSCRIPTION_IDS[0], 2), (SUBSCRIPTION_IDS[0], 1), (SUBSCRIPTION_IDS[1], 2), (SUBSCRIPTION_IDS[1], 1)]
+    assert all(rg["name"].startswith(f"s{SUBSCRIPTION_IDS.index(batch['subscriptionId'])}-") for batch in batches for rg in batch["resourceGroups"])
+
+    monthly = output["monthly"]
+    assert sorted((rg_cost["subscriptionId"], rg_cost["rgname"]) for rg_cost in monthly["resourceGroupCost"]) == [(subscription_id, f"s{s}-rg-{i}") for s, subscription_id in enumerate(SUBSCRIPTION_IDS) for i in range(3)]
+    assert list(output["subscriptions"].keys()) == SUBSCRIPTION_IDS
+    for subscription_id in SUBSCRIPTION_IDS:
+        subscription_monthly = output["subscriptions"][subscription_id]["monthly"]
+        assert subscription_monthly["totalCost"] == pytest.approx(sum(rg_cost["rgcost"] for rg_cost in monthly["resourceGroupCost"] if rg_cost["subscriptionId"] == subscription_id), abs=0.05)
+    assert monthly["totalCost"] == pytest.approx(sum(output["subscriptions"][subscription_id]["monthly"]["totalCost"] for subscription_id in SUBSCRIPTION_IDS), abs=0.02)
+    assert output["failedResourceGroups"] == []
+
+@pytest.mark.parametrize("scope", ["/subscriptions/s1", 5])
+def test_starter_rejects_a_bad_scope(scope):
+    starter = load_function("fn-drbl-cost-tracker-starter")
+    req = func.HttpRequest(method="POST", url="http://localhost/api/orchestrators/fn-drbl-cost-tracker-orchstr", body=json.dumps({"scope": scope}).encode(), route_params={"functionName": "fn-drbl-cost-tracker-orchstr"})
+
+    response = asyncio.run(starter.main(req, "{}"))
+
+    assert response.status_code == 400
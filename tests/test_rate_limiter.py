@@ -0,0 +1,173 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from azure.core.exceptions import HttpResponseError
+
+import fake_azure
+from shared_code import rate_limiter as rl
+from shared_code import retry_policy as rp
+from tests.helpers import FakeClock
+
+SCOPE = "/subscriptions/s/resourceGroups/rg-0"
+
+def http_error(status_code, headers=None):
+    e = HttpResponseError(message=f"Fake error {status_code}", response=fake_azure.FakeResponse(status_code, headers or {}))
+    e.status_code = status_code
+    return e
+
+def get_retry_policy(max_attempts=5):
+    # Full jitter drawn at its maximum, so the delays are known
+    return rp.RetryPolicy(max_attempts, base_delay_secs=1, max_delay_secs=60, random=lambda: 1.0)
+
+class ScriptedQuery:
+    # Raises or returns the next outcome of the script on each call, noting
+    # the fake time of the call
+
+    def __init__(self, outcomes, clock, headers=None):
+        self.outcomes = list(outcomes)
+        self.clock = clock
+        self.headers = headers or {}
+        self.called_at = []
+
+    def next_result(self, raw_response_hook):
+        self.called_at.append(self.clock.now)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        if raw_response_hook is not None:
+            raw_response_hook(fake_azure.FakePipelineResponse(self.headers))
+        return outcome
+
+    def usage(self, scope, parameters, raw_response_hook=None, **kwargs):
+        return self.next_result(raw_response_hook)
+
+class AioScriptedQuery(ScriptedQuery):
+
+    async def usage(self, scope, parameters, raw_response_hook=None, **kwargs):
+        return self.next_result(raw_response_hook)
+
+def ok_result():
+    return SimpleNamespace(rows=[[1.0, 20260101, "rg-0", "USD"]], next_link=None)
+
+def new_rate_limiter(clock, rate=0, capacity=1):
+    return rl.RateLimiter(rate, capacity, clock=clock, sleep=clock.sleep, async_sleep=clock.async_sleep)
+
+def test_429_waits_out_retry_after():
+    clock = FakeClock()
+    query = ScriptedQuery([http_error(429, {"Retry-After": "7"}), ok_result()], clock)
+    limiter = new_rate_limiter(clock)
+
+    result = rl.query_usage(SimpleNamespace(query=query), SCOPE, None, limiter, retry_policy=get_retry_policy())
+
+    assert result.rows
+    assert query.called_at == [0.0, 7.0]
+    assert limiter.blocked_until == 7.0
+    assert limiter.total_wait_secs == 7.0
+
+def test_429_blocks_other_queries_of_the_shared_limiter():
+    clock = FakeClock()
+    limiter = new_rate_limiter(clock)
+    limiter.update({"Retry-After": "5"}, throttled=True)
+
+    limiter.acquire()
+
+    assert clock.now == 5.0
+
+def test_503_then_success_backs_off():
+    clock = FakeClock()
+    query = ScriptedQuery([http_error(503), http_error(503), ok_result()], clock)
+
+    rl.query_usage(SimpleNamespace(query=query), SCOPE, None, new_rate_limiter(clock), retry_policy=get_retry_policy())
+
+    # 1 then 2 secs of exponential backoff
+    assert query.called_at == [0.0, 1.0, 3.0]
+
+def test_retries_exhausted_raise_the_last_error():
+    clock = FakeClock()
+    query = ScriptedQuery([http_error(503)] * 3, clock)
+
+    with pytest.raises(HttpResponseError) as e:
+        rl.query_usage(SimpleNamespace(query=query), SCOPE, None, new_rate_limiter(clock), retry_policy=get_retry_policy(max_attempts=3))
+
+    assert e.value.status_code == 503
+    assert len(query.called_at) == 3
+
+def test_non_retryable_error_fails_at_once():
+    clock = FakeClock()
+    query = ScriptedQuery([http_error(403), ok_result()], clock)
+
+    with pytest.raises(HttpResponseError):
+        rl.query_usage(SimpleNamespace(query=query), SCOPE, None, new_rate_limiter(clock), retry_policy=get_retry_policy())
+
+    assert len(query.called_at) == 1
+
+def test_async_429_then_503_then_success():
+    clock = FakeClock()
+    query = AioScriptedQuery([http_error(429, {"x-ms-ratelimit-microsoft.costmanagement-qpu-retry-after": "4"}), http_error(503), ok_result()], clock)
+
+    result = asyncio.run(rl.query_usage_async(SimpleNamespace(query=query), SCOPE, None, new_rate_limiter(clock), retry_policy=get_retry_policy()))
+
+    assert result.rows
+    # Retry-After 4, then 2 secs of backoff for the second attempt
+    assert query.called_at == [0.0, 4.0, 6.0]
+
+def test_async_retries_exhausted():
+    clock = FakeClock()
+    query = AioScriptedQuery([http_error(500)] * 2, clock)
+
+    with pytest.raises(HttpResponseError):
+        asyncio.run(rl.query_usage_async(SimpleNamespace(query=query), SCOPE, None, new_rate_limiter(clock), retry_policy=get_retry_policy(max_attempts=2)))
+
+    assert len(query.called_at) == 2
+
+def test_unpaced_by_default_until_the_service_asks():
+    clock = FakeClock()
+    limiter = new_rate_limiter(clock)
+
+    for _ in range(100):
+        limiter.acquire()
+    assert clock.sleeps == []
+
+    # Quota used up, waited out for the retry-after the service sent
+    limiter.update({"x-ms-ratelimit-microsoft.costmanagement-qpu-remaining": "QueryResource:0", "x-ms-ratelimit-microsoft.costmanagement-qpu-retry-after": "3"})
+    limiter.acquire()
+    assert clock.now == 3.0
+
+def test_unpaced_exhausted_quota_without_retry_after_waits_the_default():
+    clock = FakeClock()
+    limiter = new_rate_limiter(clock)
+
+    limiter.update({"x-ms-ratelimit-microsoft.costmanagement-qpu-remaining": "0"})
+    limiter.acquire()
+
+    assert clock.now == rl.DEFAULT_RETRY_AFTER_SECS
+
+def test_paced_limiter_spaces_the_calls():
+    clock = FakeClock()
+    limiter = new_rate_limiter(clock, rate=2, capacity=1)
+
+    for _ in range(3):
+        limiter.acquire()
+
+    assert clock.now == pytest.approx(1.0)
+
+def test_rate_must_not_be_negative():
+    with pytest.raises(ValueError):
+        rl.RateLimiter(rate=-1, capacity=1)
+
+def test_parse_ratelimit_headers_takes_the_tightest_limits():
+    headers = {
+        "x-ms-ratelimit-microsoft.costmanagement-qpu-remaining": "QueryResource:12, Other:3",
+        "X-Ms-Ratelimit-Microsoft.CostManagement-Entity-Remaining": "7",
+        "Retry-After": "2",
+        "x-ms-ratelimit-microsoft.costmanagement-qpu-retry-after": "9",
+        "x-ms-ratelimit-microsoft.costmanagement-entity-retry-after": "soon",
+        "Content-Type": "application/json",
+    }
+
+    assert rl.parse_ratelimit_headers(headers) == (3, 9.0)
+
+def test_parse_ratelimit_headers_without_throttling_headers():
+    assert rl.parse_ratelimit_headers({"Content-Type": "application/json"}) == (None, None)
+    assert rl.parse_ratelimit_headers(None) == (None, None)
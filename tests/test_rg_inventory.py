@@ -0,0 +1,262 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from shared_code import cost_query
+from shared_code import cost_store
+from shared_code import rg_inventory
+from shared_code import rgs_cost
+from tests.helpers import FakeClock
+
+SUBSCRIPTION_ID = "s1"
+
+def new_record(name, team="AI", managed=False):
+    return rg_inventory.ResourceGroupRecord(SUBSCRIPTION_ID, name, team, managed)
+
+class Backend:
+    # Lists records and hands out the queued change batches, None once they
+    # are used up so the inventory relists
+
+    def __init__(self, records, changes=(), delay_secs=0):
+        self.key = SUBSCRIPTION_ID
+        self.records = list(records)
+        self.changes = list(changes)
+        self.delay_secs = delay_secs
+        self.listed = 0
+        self.since = []
+
+    def list_resource_groups(self):
+        self.listed += 1
+        time.sleep(self.delay_secs)
+        return list(self.records)
+
+    def list_changes(self, since):
+        self.since.append(since)
+        return self.changes.pop(0) if self.changes else None
+
+class AsyncBackend(Backend):
+
+    async def list_resource_groups(self):
+        self.listed += 1
+        await asyncio.sleep(self.delay_secs)
+        return list(self.records)
+
+    async def list_changes(self, since):
+        return Backend.list_changes(self, since)
+
+def get_names(records):
+    return sorted(record.name for record in records)
+
+def test_served_from_the_inventory_until_the_ttl():
+    clock = FakeClock()
+    inventory = rg_inventory.ResourceGroupInventory(ttl_secs=60, clock=clock)
+    backend = Backend([new_record("rg-0"), new_record("rg-managed", managed=True)])
+
+    assert get_names(inventory.refresh(backend)) == ["rg-0"]
+    clock.sleep(59)
+    inventory.refresh(backend)
+    assert backend.listed == 1
+
+    # Without a changes feed an expired inventory is relisted
+    backend.records.append(new_record("rg-1"))
+    clock.sleep(1)
+    assert get_names(inventory.refresh(backend)) == ["rg-0", "rg-1"]
+    assert backend.listed == 2
+
+def test_expired_inventory_applies_the_changes():
+    clock = FakeClock()
+    clock.sleep(1_000_000)
+    inventory = rg_inventory.ResourceGroupInventory(ttl_secs=60, clock=clock)
+    changes = [
+        (rg_inventory.get_record_key(SUBSCRIPTION_ID, "rg-new"), new_record("rg-new")),
+        (rg_inventory.get_record_key(SUBSCRIPTION_ID, "RG-0"), new_record("RG-0", team="Infra")),
+        (rg_inventory.get_record_key(SUBSCRIPTION_ID, "rg-1"), None),
+    ]
+    backend = Backend([new_record("rg-0"), new_record("rg-1")], changes=[changes])
+    inventory.refresh(backend)
+
+    clock.sleep(60)
+    records = inventory.refresh(backend)
+
+    assert backend.listed == 1
+    assert {record.name: record.team for record in records} == {"RG-0": "Infra", "rg-new": "AI"}
+    # From a bit before the last refresh
+    assert backend.since[0].timestamp() == 1_000_000 - rg_inventory.CHANGES_OVERLAP_SECS
+
+def test_inventory_too_old_for_the_changes_feed_is_relisted():
+    clock = FakeClock()
+    inventory = rg_inventory.ResourceGroupInventory(ttl_secs=60, clock=clock)
+    backend = Backend([new_record("rg-0")], changes=[[]])
+    inventory.refresh(backend)
+
+    clock.sleep(rg_inventory.MAX_INCREMENTAL_AGE_SECS)
+    inventory.refresh(backend)
+
+    assert backend.since == []
+    assert backend.listed == 2
+
+def test_inventory_is_kept_across_cold_starts(tmp_path):
+    path = str(tmp_path / "rg_inventory_s1.json")
+    clock = FakeClock()
+    inventory = rg_inventory.ResourceGroupInventory(ttl_secs=60, path=path, clock=clock)
+    inventory.refresh(Backend([new_record("rg-0"), new_record("rg-1", team=None), new_record("rg-managed", team=None, managed=True)]))
+
+    loaded = rg_inventory.ResourceGroupInventory(ttl_secs=60, path=path, clock=clock)
+
+    assert loaded.refreshed_at == inventory.refreshed_at
+    assert [(record.name, record.team, record.managed) for record in loaded.get_records(include_managed=True)] == [("rg-0", "AI", False), ("rg-1", None, False), ("rg-managed", None, True)]
+    # Still fresh, nothing to list
+    backend = Backend([])
+    assert get_names(loaded.refresh(backend)) == ["rg-0", "rg-1"]
+    assert backend.listed == 0
+
+def test_unreadable_inventory_file_is_relisted(tmp_path):
+    path = tmp_path / "rg_inventory_s1.json"
+    path.write_text("{not json")
+
+    inventory = rg_inventory.ResourceGroupInventory(ttl_secs=60, path=str(path), clock=FakeClock())
+
+    assert inventory.records == {}
+    assert not inventory.is_fresh()
+
+def test_concurrent_refreshes_list_once():
+    inventory = rg_inventory.ResourceGroupInventory(ttl_secs=60)
+    backend = Backend([new_record("rg-0")], delay_secs=0.05)
+
+    threads = [threading.Thread(target=inventory.refresh, args=(backend,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert backend.listed == 1
+
+def test_concurrent_async_refreshes_list_once():
+    clock = FakeClock()
+    inventory = rg_inventory.ResourceGroupInventory(ttl_secs=60, clock=clock)
+    backend = AsyncBackend([new_record("rg-0")], delay_secs=0.05)
+
+    async def collect():
+        return await asyncio.gather(*[inventory.refresh_async(backend) for _ in range(4)])
+
+    assert [get_names(records) for records in asyncio.run(collect())] == [["rg-0"]] * 4
+    assert backend.listed == 1
+
+    # Another event loop gets a lock of its own
+    clock.sleep(60)
+    asyncio.run(collect())
+    assert backend.listed == 2
+
+class FakeResourceGraphClient:
+    # Answers the unmanaged RGs query and the changes query, page_size rows at
+    # a time behind a skip token, noting every request
+
+    def __init__(self, rows, changed_rows=(), page_size=2):
+        self.rows = list(rows)
+        self.changed_rows = list(changed_rows)
+        self.page_size = page_size
+        self.requests = []
+
+    def resources(self, query_request):
+        self.requests.append(query_request)
+        rows = self.changed_rows if query_request.query.startswith("resourcecontainerchanges") else self.rows
+        start = int(query_request.options.skip_token or 0)
+        end = start + self.page_size
+        return SimpleNamespace(data=rows[start:end], skip_token=str(end) if end < len(rows) else None)
+
+class AioFakeResourceGraphClient(FakeResourceGraphClient):
+
+    async def resources(self, query_request):
+        return FakeResourceGraphClient.resources(self, query_request)
+
+SUBSCRIPTION_IDS = ["s1", "s2"]
+GRAPH_ROWS = [
+    {"subscriptionId": "s1", "name": "rg-0", "team": "AI"},
+    {"subscriptionId": "s1", "name": "rg-1", "team": ""},
+    {"subscriptionId": "s2", "name": "rg-2", "team": "Infra"},
+]
+CHANGED_ROWS = [
+    {"targetResourceId": "/subscriptions/s1/resourcegroups/rg-0", "name": "rg-0", "team": "Infra", "managedBy": ""},
+    {"targetResourceId": "/subscriptions/s1/resourcegroups/rg-1", "name": None, "team": None, "managedBy": None},
+    {"targetResourceId": "/subscriptions/s2/resourcegroups/rg-3", "name": "rg-3", "team": "AI", "managedBy": ""},
+    {"targetResourceId": "/subscriptions/s2/resourcegroups/rg-databricks", "name": "rg-databricks", "team": "", "managedBy": "/subscriptions/s2/providers/Microsoft.Databricks/workspaces/w"},
+]
+
+@pytest.fixture
+def inventories(monkeypatch):
+    # The backends fill the module's shared inventories, one per key
+    monkeypatch.setattr(rg_inventory, "_inventories", {})
+    monkeypatch.setenv("RG_INVENTORY_TTL_SECS", "3600")
+    monkeypatch.delenv("RG_INVENTORY_DIR", raising=False)
+    return rg_inventory._inventories
+
+def get_teams(records):
+    return {(record.subscription_id, record.name): record.team for record in records}
+
+def expire(inventories):
+    for inventory in inventories.values():
+        inventory.refreshed_at -= 3600
+
+def test_resource_graph_backend_loads_every_page_then_applies_the_changes(inventories):
+    resource_graph_client = FakeResourceGraphClient(GRAPH_ROWS, CHANGED_ROWS)
+    backend = rg_inventory.ResourceGraphInventoryBackend(resource_graph_client, SUBSCRIPTION_IDS)
+
+    records = rg_inventory.get_resource_groups(backend)
+
+    assert get_teams(records) == {("s1", "rg-0"): "AI", ("s1", "rg-1"): None, ("s2", "rg-2"): "Infra"}
+    assert [request.options.skip_token for request in resource_graph_client.requests] == [None, "2"]
+    assert all(request.subscriptions == SUBSCRIPTION_IDS for request in resource_graph_client.requests)
+    assert rg_inventory.group_by_subscription(records, SUBSCRIPTION_IDS)["s2"][0].name == "rg-2"
+
+    expire(inventories)
+    expired_at = inventories[backend.key].refreshed_at
+    records = rg_inventory.get_resource_groups(backend)
+
+    # Modified, deleted and created RGs; the new managed one is kept out
+    assert get_teams(records) == {("s1", "rg-0"): "Infra", ("s2", "rg-2"): "Infra", ("s2", "rg-3"): "AI"}
+    changes_requests = resource_graph_client.requests[2:]
+    assert len(changes_requests) == 2
+    assert changes_requests[0].query == rg_inventory.get_changes_query(datetime.fromtimestamp(expired_at - rg_inventory.CHANGES_OVERLAP_SECS, timezone.utc))
+
+def test_async_resource_graph_backend_matches_the_sync_one(inventories):
+    resource_graph_client = AioFakeResourceGraphClient(GRAPH_ROWS, CHANGED_ROWS)
+    backend = rg_inventory.AsyncResourceGraphInventoryBackend(resource_graph_client, SUBSCRIPTION_IDS)
+
+    records = asyncio.run(rg_inventory.get_resource_groups_async(backend))
+    assert get_teams(records) == {("s1", "rg-0"): "AI", ("s1", "rg-1"): None, ("s2", "rg-2"): "Infra"}
+
+    expire(inventories)
+    records = asyncio.run(rg_inventory.get_resource_groups_async(backend))
+    assert get_teams(records) == {("s1", "rg-0"): "Infra", ("s2", "rg-2"): "Infra", ("s2", "rg-3"): "AI"}
+    assert len(resource_graph_client.requests) == 4
+
+def test_resource_graph_backend_relists_without_incremental_refresh(inventories, monkeypatch):
+    monkeypatch.setenv("RG_INVENTORY_INCREMENTAL", "false")
+    resource_graph_client = FakeResourceGraphClient(GRAPH_ROWS, CHANGED_ROWS, page_size=10)
+    backend = rg_inventory.ResourceGraphInventoryBackend(resource_graph_client, SUBSCRIPTION_IDS)
+
+    rg_inventory.get_resource_groups(backend)
+    expire(inventories)
+    rg_inventory.get_resource_groups(backend)
+
+    assert [request.query for request in resource_graph_client.requests] == [rg_inventory.get_unmanaged_resource_groups_query()] * 2
+
+def test_rgs_cost_of_a_static_inventory(inventories):
+    records = [new_record("rg-0"), new_record("rg-1", team="Infra"), new_record("rg-managed", managed=True)]
+    to_datetime = datetime(2026, 10, 17, 23, 59, tzinfo=timezone.utc)
+    from_datetime = datetime(2026, 9, 17, tzinfo=timezone.utc)
+    queried = []
+
+    def get_cost(scope_with_rg, query_from_datetime, query_to_datetime):
+        queried.append(scope_with_rg)
+        return [cost_query.CostRow(1.0, cost_store.to_usage_date(query_from_datetime + timedelta(days=day)), scope_with_rg.split("/")[-1], "USD") for day in range(31)]
+
+    # The RGs come from the inventory, not from resource_groups
+    cost_dicts = rgs_cost.get_rgs_cost(None, "/subscriptions/s1/resourceGroups/", from_datetime, to_datetime, get_cost, {"AI": "aiTotalCost", "Infra": "infraTotalCost"}, inventory_backend=rg_inventory.StaticInventoryBackend(records))
+
+    assert queried == ["/subscriptions/s1/resourceGroups/rg-0", "/subscriptions/s1/resourceGroups/rg-1"]
+    assert (cost_dicts["monthly"]["aiTotalCost"], cost_dicts["monthly"]["infraTotalCost"]) == (30.0, 30.0)
@@ -0,0 +1,116 @@
+from datetime import date, datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from shared_code import cost_merge
+from shared_code import cost_store
+from shared_code import rgs_cost
+from shared_code import rollups
+
+FROM_DATE = date(2026, 9, 16)
+NUM_DAYS = 31
+TO_DATE = FROM_DATE + timedelta(days=NUM_DAYS - 1)
+SCOPE = "/subscriptions/s/resourceGroups/"
+TEAM_COST_KEYS = {"AI": "aiTotalCost", "Infra": "infraTotalCost"}
+
+def usage_date(day):
+    return cost_store.to_usage_date(FROM_DATE + timedelta(days=day))
+
+# Sparse rows: rg-a misses most days and has two currencies on one day,
+# rg-b has no rows, rg-c has rows outside the window on both sides
+ROWS_OF_COST_BY_RG = {
+    "rg-a": [
+        [1.25, usage_date(0), "rg-a", "USD"],
+        [2.5, usage_date(10), "rg-a", "USD"],
+        [0.75, usage_date(10), "rg-a", "EUR"],
+        [4.0, usage_date(24), "rg-a", "USD"],
+        [8.0, usage_date(29), "rg-a", "USD"],
+    ],
+    "rg-b": [],
+    "rg-c": [
+        [100.0, usage_date(-1), "rg-c", "USD"],
+        [3.0, usage_date(5), "rg-c", "USD"],
+        [5.5, usage_date(23), "rg-c", "USD"],
+        [0.5, usage_date(30), "rg-c", "USD"],
+        [200.0, usage_date(31), "rg-c", "USD"],
+    ],
+    "rg-d": [
+        [7.0, usage_date(27), "rg-d", "USD"],
+    ],
+}
+TEAM_BY_RG = {"rg-a": "AI", "rg-b": "AI", "rg-c": "Infra", "rg-d": "Ops"}
+
+def plain_sum(rows_of_cost, first_day, last_day):
+    # The cost of the rows dated first_day to last_day, one row at a time
+    return sum(row[0] for row in rows_of_cost if usage_date(first_day) <= row[1] <= usage_date(last_day))
+
+def test_build_cost_matrix_places_sparse_rows_by_date():
+    rows_of_cost_list = list(ROWS_OF_COST_BY_RG.values())
+
+    cost_matrix = rollups.build_cost_matrix(rows_of_cost_list, FROM_DATE, NUM_DAYS)
+
+    assert cost_matrix.shape == (4, NUM_DAYS)
+    for i, rows_of_cost in enumerate(rows_of_cost_list):
+        for day in range(NUM_DAYS):
+            assert cost_matrix[i, day] == pytest.approx(plain_sum(rows_of_cost, day, day))
+    # No rows, a zero row
+    assert not cost_matrix[1].any()
+    # The rows before and after the window are left out
+    assert cost_matrix[2].sum() == pytest.approx(9.0)
+
+def test_build_cost_matrix_without_rgs():
+    assert rollups.build_cost_matrix([], FROM_DATE, NUM_DAYS).shape == (0, NUM_DAYS)
+
+@pytest.mark.parametrize("from_day, to_day", [(0, NUM_DAYS), (0, 1), (5, 24), (23, 30), (10, 10)])
+def test_sum_days_matches_a_plain_sum(from_day, to_day):
+    rows_of_cost_list = list(ROWS_OF_COST_BY_RG.values())
+    cumulative_cost = rollups.get_cumulative_cost(rollups.build_cost_matrix(rows_of_cost_list, FROM_DATE, NUM_DAYS))
+
+    costs = rollups.sum_days(cumulative_cost, from_day, to_day)
+
+    assert list(costs) == pytest.approx([plain_sum(rows_of_cost, from_day, to_day - 1) for rows_of_cost in rows_of_cost_list])
+
+@pytest.mark.parametrize("num_days", [7, 30, 45])
+def test_window_cost_ends_the_day_before_yesterday(num_days):
+    rows_of_cost_list = list(ROWS_OF_COST_BY_RG.values())
+    cumulative_cost = rollups.get_cumulative_cost(rollups.build_cost_matrix(rows_of_cost_list, FROM_DATE, NUM_DAYS))
+
+    costs = rollups.get_window_cost(cumulative_cost, num_days)
+
+    # A window longer than the fetched days covers all but yesterday
+    first_day = max(NUM_DAYS - num_days - 1, 0)
+    assert list(costs) == pytest.approx([plain_sum(rows_of_cost, first_day, NUM_DAYS - 2) for rows_of_cost in rows_of_cost_list])
+
+def test_team_totals_skip_untracked_teams():
+    totals = rollups.get_team_totals(np.array([1.0, 2.0, 4.0, 8.0]), np.array([0, 1, 0, -1]), 2)
+
+    assert list(totals) == [5.0, 2.0]
+
+def test_get_rgs_cost_totals_match_a_plain_sum():
+    resource_groups = [SimpleNamespace(name=name, managed_by=None, tags={"Team": team}) for name, team in TEAM_BY_RG.items()]
+    to_datetime = datetime(TO_DATE.year, TO_DATE.month, TO_DATE.day, 23, 59, tzinfo=timezone.utc)
+    from_datetime = datetime(FROM_DATE.year, FROM_DATE.month, FROM_DATE.day, tzinfo=timezone.utc)
+
+    cost_dicts = rgs_cost.get_rgs_cost(resource_groups, SCOPE, from_datetime, to_datetime, None, TEAM_COST_KEYS, rows_of_cost_by_rg=ROWS_OF_COST_BY_RG)
+
+    last_day = NUM_DAYS - 1
+    windows = {
+        "yesterday": (last_day, last_day),
+        "weekly": (last_day - 7, last_day - 1),
+        "monthly": (last_day - 30, last_day - 1),
+    }
+    for period, (first_day, to_day) in windows.items():
+        rg_costs = {rg_cost["rgname"]: rg_cost["rgcost"] for rg_cost in cost_dicts[period]["resourceGroupCost"]}
+        expected = {rg_name: plain_sum(rows_of_cost, first_day, to_day) for rg_name, rows_of_cost in ROWS_OF_COST_BY_RG.items()}
+        assert rg_costs == pytest.approx(expected, abs=0.005), period
+
+        for team, cost_key in TEAM_COST_KEYS.items():
+            team_total = sum(expected[rg_name] for rg_name, rg_team in TEAM_BY_RG.items() if rg_team == team)
+            assert cost_dicts[period][cost_key] == pytest.approx(team_total, abs=0.005), period
+        # Ops is not a tracked team, its RG has an entry but no total
+        assert cost_dicts[period]["totalCost"] == pytest.approx(sum(expected[rg_name] for rg_name in ["rg-a", "rg-b", "rg-c"]), abs=0.005), period
+
+    assert cost_dicts["daily"]["aiTotalCost"] == pytest.approx(cost_dicts["weekly"]["aiTotalCost"] / 7, abs=0.005)
+    assert cost_dicts[cost_merge.FAILED_RESOURCE_GROUPS] == []
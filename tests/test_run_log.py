@@ -0,0 +1,93 @@
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from shared_code import cost_query
+from shared_code import cost_store
+from shared_code import rgs_cost
+from shared_code import run_log as rlog
+
+SCOPE = "/subscriptions/s/resourceGroups/"
+TO_DATETIME = datetime(2026, 10, 17, 23, 59, tzinfo=timezone.utc)
+FROM_DATETIME = datetime(2026, 9, 17, tzinfo=timezone.utc)
+
+def new_resource_groups(num_rgs):
+    # rg-1 fails, rg-2 has no rows, plus a managed RG
+    resource_groups = [SimpleNamespace(name=f"rg-{i}", managed_by=None, tags={"Team": "AI"}) for i in range(num_rgs)]
+    return resource_groups + [SimpleNamespace(name="rg-managed", managed_by="/subscriptions/s/providers/Microsoft.Databricks/workspaces/w", tags=None)]
+
+def get_cost(scope_with_rg, from_datetime, to_datetime):
+    rg_name = scope_with_rg.split("/")[-1]
+    if rg_name == "rg-1":
+        raise RuntimeError("Fake error 403")
+    if rg_name == "rg-2":
+        return []
+    return [cost_query.CostRow(1.0, cost_store.to_usage_date(from_datetime + timedelta(days=day)), rg_name, "USD") for day in range(31)]
+
+def run(caplog, num_rgs=5):
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        rgs_cost.get_rgs_cost(new_resource_groups(num_rgs), SCOPE, FROM_DATETIME, TO_DATETIME, get_cost, {"AI": "aiTotalCost"})
+    return caplog.records
+
+def get_summaries(records):
+    return [json.loads(record.getMessage().split("Cost run summary ", 1)[1]) for record in records if "Cost run summary" in record.getMessage()]
+
+def get_rg_lines(records):
+    # The separators and row counts of the per-RG loop
+    return [record for record in records if record.getMessage().startswith("-----") or record.getMessage().isdigit()]
+
+def test_summary_mode_logs_one_record_instead_of_the_rg_lines(caplog, monkeypatch):
+    monkeypatch.setenv("COST_TRACKER_LOG_MODE", rlog.LOG_MODE_SUMMARY)
+    monkeypatch.delenv("COST_TRACKER_LOG_SAMPLE_RATE", raising=False)
+
+    records = run(caplog)
+
+    assert get_rg_lines(records) == []
+    assert not any(record.levelno >= logging.ERROR for record in records)
+    summaries = get_summaries(records)
+    assert len(summaries) == 1
+    summary = summaries[0]
+    assert (summary["rgs"], summary["managedRgs"], summary["fetchedRgs"], summary["rgsWithoutRows"], summary["failedRgs"]) == (6, 1, 4, 1, 1)
+    assert (summary["rgsWithoutRowsNames"], summary["failedRgsNames"]) == (["rg-2"], ["rg-1"])
+    assert summary["scope"] == SCOPE
+    assert set(summary["timingsSecs"]) >= {"fetch", "aggregate", "total"}
+    # The same fields as custom dimensions of the record
+    summary_record = [record for record in records if "Cost run summary" in record.getMessage()][0]
+    assert summary_record.custom_dimensions["failedRgs"] == 1
+    assert json.loads(summary_record.custom_dimensions["failedRgsNames"]) == ["rg-1"]
+
+def test_verbose_mode_keeps_the_rg_lines(caplog, monkeypatch):
+    monkeypatch.delenv("COST_TRACKER_LOG_MODE", raising=False)
+
+    records = run(caplog)
+
+    # Two separators for every RG, a row count for the fetched ones
+    assert len(get_rg_lines(records)) == 2 * 6 + 4
+    assert [record.getMessage() for record in records if record.levelno == logging.ERROR][0].startswith("[ERROR]: Could not get the cost of rg-1")
+    assert len(get_summaries(records)) == 1
+
+def test_summary_mode_keeps_the_lines_of_the_sampled_rgs(caplog, monkeypatch):
+    monkeypatch.setenv("COST_TRACKER_LOG_MODE", rlog.LOG_MODE_SUMMARY)
+    monkeypatch.setenv("COST_TRACKER_LOG_SAMPLE_RATE", "0.5")
+    rg_names = [f"rg-{i}" for i in range(40)]
+    sampled = [rg_name for rg_name in rg_names if rlog.is_sampled(rg_name, 0.5)]
+    assert 0 < len(sampled) < len(rg_names)
+
+    records = run(caplog, num_rgs=40)
+
+    # Separators only, a sampled RG may still be the failed or empty one
+    separators = [record for record in get_rg_lines(records) if record.getMessage().startswith("-----")]
+    assert len(separators) == 2 * len(sampled) + 2 * rlog.is_sampled("rg-managed", 0.5)
+    assert len(get_summaries(records)) == 1
+
+@pytest.mark.parametrize("sample_rate, expected", [(0, False), (1, True)])
+def test_sampling_extremes(sample_rate, expected):
+    assert all(rlog.is_sampled(f"rg-{i}", sample_rate) is expected for i in range(100))
+
+def test_sampling_is_stable_and_ignores_case():
+    assert [rlog.is_sampled(f"rg-{i}", 0.3) for i in range(100)] == [rlog.is_sampled(f"RG-{i}", 0.3) for i in range(100)]
+    assert 10 < sum(rlog.is_sampled(f"rg-{i}", 0.3) for i in range(1000)) < 500
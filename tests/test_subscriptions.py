@@ -0,0 +1,101 @@
+import pytest
+
+import fake_azure
+from shared_code import clients
+from shared_code import cost_merge
+from shared_code import subscriptions
+from tests.helpers import load_function
+from tests.test_rg_inventory import FakeResourceGraphClient
+
+# Of the list-rgs runs, the RG inventories are kept per subscription
+SUBSCRIPTION_IDS = ["30000000-0000-0000-0000-000000000001", "30000000-0000-0000-0000-000000000002"]
+
+@pytest.fixture
+def no_settings(monkeypatch):
+    monkeypatch.delenv("COST_TRACKER_SUBSCRIPTIONS", raising=False)
+    monkeypatch.delenv("COST_TRACKER_MANAGEMENT_GROUP", raising=False)
+    return monkeypatch
+
+@pytest.mark.parametrize("request_body, expected", [
+    ({"subscriptions": ["s1", "s2"]}, (["s1", "s2"], None)),
+    ({"managementGroup": "mg"}, (None, "mg")),
+    ({"scope": "/providers/Microsoft.Management/managementGroups/mg/"}, (None, "mg")),
+    ({"scope": "/subscriptions/s1/resourceGroups/"}, (None, None)),
+    ({"subscriptions": []}, (None, None)),
+    (None, (None, None)),
+])
+def test_requested_subscriptions(no_settings, request_body, expected):
+    assert subscriptions.get_requested_subscriptions(request_body) == expected
+
+def test_app_settings_apply_to_requests_without_a_scope(no_settings):
+    no_settings.setenv("COST_TRACKER_SUBSCRIPTIONS", " s1, s2,,")
+    no_settings.setenv("COST_TRACKER_MANAGEMENT_GROUP", "mg")
+
+    assert subscriptions.get_requested_subscriptions({}) == (["s1", "s2"], "mg")
+    assert subscriptions.get_requested_subscriptions({"subscriptions": ["s3"]}) == (["s3"], None)
+    # A scope of its own overrides them
+    assert subscriptions.get_requested_subscriptions({"scope": "/subscriptions/s1/resourceGroups/"}) == (None, None)
+
+def test_management_group_resolves_to_its_subscriptions():
+    resource_graph_client = FakeResourceGraphClient([{"subscriptionId": "s3"}, {"subscriptionId": "s1"}, {"subscriptionId": "s2"}])
+
+    subscription_ids = subscriptions.resolve_subscription_ids(["s1", "s9"], "mg", resource_graph_client)
+
+    assert subscription_ids == ["s1", "s2", "s3", "s9"]
+    assert [request.management_groups for request in resource_graph_client.requests] == [["mg"], ["mg"]]
+    # No query without a management group
+    assert subscriptions.resolve_subscription_ids(["s2", "s1"], None, None) == ["s2", "s1"]
+
+def new_batch_rgs_cost(rg_costs, failed_rg_names=()):
+    # Unrounded activity result of one batch, {rg name: (team cost key, cost)}
+    rgs_cost_dict = {}
+    for period in cost_merge.PERIODS:
+        cost_dict = {"resourceGroupCost": [{"rgname": rg_name, "rgcost": cost} for rg_name, (_, cost) in rg_costs.items()], "aiTotalCost": 0.0, "infraTotalCost": 0.0}
+        for cost_key, cost in rg_costs.values():
+            cost_dict[cost_key] += cost
+        rgs_cost_dict[period] = cost_dict
+    rgs_cost_dict[cost_merge.FAILED_RESOURCE_GROUPS] = [{"rgname": rg_name, "error": "Fake error 403"} for rg_name in failed_rg_names]
+    return rgs_cost_dict
+
+def test_subscriptions_are_merged_with_their_own_totals():
+    rgs_cost_dict = cost_merge.merge_subscriptions_rgs_cost([
+        ("s1", new_batch_rgs_cost({"rg-0": ("aiTotalCost", 1.004), "rg-1": ("infraTotalCost", 2.0)})),
+        ("s2", new_batch_rgs_cost({"rg-2": ("aiTotalCost", 3.003)}, failed_rg_names=["rg-3"])),
+        ("s1", new_batch_rgs_cost({"rg-4": ("aiTotalCost", 0.003)})),
+    ])
+
+    monthly = rgs_cost_dict["monthly"]
+    assert [(rg_cost["subscriptionId"], rg_cost["rgname"]) for rg_cost in monthly["resourceGroupCost"]] == [("s1", "rg-0"), ("s1", "rg-1"), ("s2", "rg-2"), ("s1", "rg-4")]
+    # Summed before rounding
+    assert (monthly["aiTotalCost"], monthly["infraTotalCost"], monthly["totalCost"]) == (4.01, 2.0, 6.01)
+    assert rgs_cost_dict[cost_merge.FAILED_RESOURCE_GROUPS] == [{"rgname": "rg-3", "error": "Fake error 403", "subscriptionId": "s2"}]
+
+    assert list(rgs_cost_dict["subscriptions"].keys()) == ["s1", "s2"]
+    assert rgs_cost_dict["subscriptions"]["s1"]["monthly"] == {"aiTotalCost": 1.01, "infraTotalCost": 2.0, "totalCost": 3.01}
+    assert rgs_cost_dict["subscriptions"]["s2"]["yesterday"] == {"aiTotalCost": 3.0, "infraTotalCost": 0.0, "totalCost": 3.0}
+
+@pytest.fixture
+def list_rgs(no_settings):
+    resource_groups_by_subscription = {
+        subscription_id: fake_azure.make_resource_groups(2, num_managed=1)
+        for subscription_id in SUBSCRIPTION_IDS
+    }
+    clients.set_factory(clients.CREDENTIAL, lambda: None)
+    clients.set_factory(clients.RESOURCE_MGMT_CLIENT, lambda credential, subscription_id: fake_azure.FakeResourceManagementClient(resource_groups_by_subscription[subscription_id]))
+    clients.set_factory(clients.RESOURCE_GRAPH_CLIENT, lambda credential: None)
+    no_settings.setenv("COST_TRACKER_SCOPE", f"/subscriptions/{SUBSCRIPTION_IDS[0]}/resourceGroups/")
+    yield load_function("fn-drbl-cost-tracker-list-rgs").main
+
+    clients.reset()
+
+def test_list_rgs_honours_the_request_scope(list_rgs):
+    assert {rg["subscriptionId"] for rg in list_rgs({})} == {SUBSCRIPTION_IDS[0]}
+
+    resource_groups = list_rgs({"scope": f"/subscriptions/{SUBSCRIPTION_IDS[1]}/resourceGroups/"})
+
+    assert [(rg["subscriptionId"], rg["name"]) for rg in resource_groups] == [(SUBSCRIPTION_IDS[1], "rg-0"), (SUBSCRIPTION_IDS[1], "rg-1")]
+
+@pytest.mark.parametrize("scope", ["/subscriptions/" + SUBSCRIPTION_IDS[1], "rg-0", 5])
+def test_list_rgs_rejects_a_bad_scope(list_rgs, scope):
+    with pytest.raises(ValueError):
+        list_rgs({"scope": scope})
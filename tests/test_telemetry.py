@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from shared_code import cost_query
+from shared_code import cost_store
+from shared_code import rate_limiter as rl
+from shared_code import rgs_cost
+from shared_code import telemetry
+from tests.helpers import FakeClock
+from tests.test_rate_limiter import ScriptedQuery, get_retry_policy, http_error, new_rate_limiter, ok_result
+
+SCOPE = "/subscriptions/s/resourceGroups/"
+
+@pytest.fixture
+def exported():
+    span_exporter = InMemorySpanExporter()
+    tracer_provider = TracerProvider()
+    tracer_provider.add_span_processor(SimpleSpanProcessor(span_exporter))
+    metric_reader = InMemoryMetricReader()
+    telemetry.set_providers(tracer_provider, MeterProvider(metric_readers=[metric_reader]))
+    yield SimpleNamespace(span_exporter=span_exporter, metric_reader=metric_reader)
+
+    telemetry.set_providers(None, None)
+
+def get_spans(exported, name):
+    return [span for span in exported.span_exporter.get_finished_spans() if span.name == name]
+
+def get_points(exported, name):
+    # The data points of one metric, by their attributes
+    metrics_data = exported.metric_reader.get_metrics_data()
+    if metrics_data is None:
+        return {}
+    return {
+        tuple(sorted(point.attributes.items())): point
+        for resource_metrics in metrics_data.resource_metrics
+        for scope_metrics in resource_metrics.scope_metrics
+        for metric in scope_metrics.metrics if metric.name == name
+        for point in metric.data.data_points
+    }
+
+def test_every_query_attempt_is_a_span_and_counted(exported):
+    clock = FakeClock()
+    query = ScriptedQuery([http_error(429, {"Retry-After": "2"}), ok_result()], clock, headers={"x-ms-ratelimit-microsoft.costmanagement-qpu-remaining": "QueryResource:11"})
+
+    rl.query_usage(SimpleNamespace(query=query), SCOPE + "rg-0", None, new_rate_limiter(clock), retry_policy=get_retry_policy())
+
+    spans = get_spans(exported, "cost_tracker.query_usage")
+    assert [(span.attributes["attempt"], span.attributes["status_code"]) for span in spans] == [(1, 429), (2, 200)]
+    assert spans[0].attributes["ratelimit_retry_after"] == 2.0
+    assert spans[1].attributes["ratelimit_remaining"] == 11
+    assert spans[1].attributes["rows"] == 1
+    assert all(span.attributes["resource_group"] == "rg-0" for span in spans)
+
+    calls = get_points(exported, "cost_tracker.query.calls")
+    assert calls[(("resource_group", "rg-0"), ("status_code", 429))].value == 1
+    assert calls[(("resource_group", "rg-0"), ("status_code", 200))].value == 1
+    assert [point.value for point in get_points(exported, "cost_tracker.query.throttled").values()] == [1]
+    assert [point.value for point in get_points(exported, "cost_tracker.query.rows").values()] == [1]
+    assert sum(point.count for point in get_points(exported, "cost_tracker.query.duration").values()) == 2
+
+def test_cost_run_phases_and_rg_fetches(exported):
+    to_datetime = datetime(2026, 10, 17, 23, 59, tzinfo=timezone.utc)
+    from_datetime = datetime(2026, 9, 17, tzinfo=timezone.utc)
+    resource_groups = [SimpleNamespace(name=f"rg-{i}", managed_by=None, tags={"Team": "AI"}) for i in range(3)]
+
+    def get_cost(scope_with_rg, query_from_datetime, query_to_datetime):
+        if scope_with_rg.endswith("rg-2"):
+            raise RuntimeError("Fake error 403")
+        return [cost_query.CostRow(1.0, cost_store.to_usage_date(query_from_datetime + timedelta(days=day)), scope_with_rg.split("/")[-1], "USD") for day in range(31)]
+
+    rgs_cost.get_rgs_cost(resource_groups, SCOPE, from_datetime, to_datetime, get_cost, {"AI": "aiTotalCost"})
+
+    assert len(get_spans(exported, "cost_tracker.fetch_rows")) == 1
+    aggregate_span = get_spans(exported, "cost_tracker.aggregate")[0]
+    assert (aggregate_span.attributes["rgs"], aggregate_span.attributes["days"]) == (2, 31)
+    assert {dict(attributes)["phase"] for attributes in get_points(exported, "cost_tracker.phase.duration")} >= {telemetry.PHASE_FETCH_ROWS, telemetry.PHASE_AGGREGATE}
+
+    rg_rows = get_points(exported, "cost_tracker.rg.rows")
+    assert {dict(attributes)["resource_group"]: point.value for attributes, point in rg_rows.items()} == {"rg-0": 31, "rg-1": 31}
+    assert [dict(attributes)["resource_group"] for attributes in get_points(exported, "cost_tracker.rg.failed")] == ["rg-2"]
+    assert sum(point.count for point in get_points(exported, "cost_tracker.rg.fetch.duration").values()) == 3
+
+def test_nothing_recorded_when_turned_off(exported, monkeypatch):
+    monkeypatch.setenv("COST_TRACKER_TELEMETRY", "false")
+
+    with telemetry.phase(telemetry.PHASE_SERIALIZE) as span:
+        assert span is None
+    telemetry.record_query(SCOPE + "rg-0", 0.1, 200, num_rows=3)
+    telemetry.record_rg_fetch("rg-0", "AI", 0.1, num_rows=3)
+
+    assert exported.span_exporter.get_finished_spans() == ()
+    assert get_points(exported, "cost_tracker.query.calls") == {}